@@ -87,7 +87,7 @@ async def register_user(
         email=user.email,
         roles=user.roles,
         job_title=user.job_title,
-        hashed_password=get_password_hash(user.email, user.password),
+        hashed_password=await get_password_hash(user.email, user.password),
         state=UserAccountState.ACTIVE,
     )
     await Users.create(user=user_db)
@@ -235,7 +235,7 @@ async def add_tallulah_admin():
         email=admin_email,
         roles=[UserRole.TALLULAH_ADMIN],
         job_title="Array Insights Admin",
-        hashed_password=get_password_hash("admin@tallulah.net", secret_store.TALLULAH_ADMIN_PASSWORD),
+        hashed_password=await get_password_hash("admin@tallulah.net", secret_store.TALLULAH_ADMIN_PASSWORD),
         state=UserAccountState.ACTIVE,
     )
 
@@ -12,16 +12,22 @@
 #     prior written permission of Array Insights, Inc.
 # -------------------------------------------------------------------------------
 
+import asyncio
+import hashlib
 import json
+import os
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from time import time
-from typing import List
+from typing import List, Optional, Tuple
 
 import firebase_admin
 import firebase_admin.auth
 from fastapi import APIRouter, Body, Depends, HTTPException, Path, Query, Response, status
 from fastapi.concurrency import run_in_threadpool
 from fastapi.encoders import jsonable_encoder
+from fastapi.requests import Request
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from jose import ExpiredSignatureError, JWTError, jwt
 from passlib.context import CryptContext
@@ -39,9 +45,19 @@ from app.models.common import PyObjectId
 from app.models.form_templates import FormTemplates, FormTemplateState
 from app.models.organizations import Organizations
 from app.utils.emails import EmailAddress, EmailBody, Message, MessageResponse, OutlookClient, ToRecipient
+from app.utils.firebase_auth import FirebaseTokenVerifier
 from app.utils.secrets import secret_store
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Hashes made with fewer rounds are replaced on the next successful login
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=BCRYPT_ROUNDS)
+# bcrypt is pure CPU and releases the GIL, so it runs on a thread per core instead of on the event loop
+password_hash_executor = ThreadPoolExecutor(max_workers=os.cpu_count() or 1, thread_name_prefix="password-hash")
+# Hashes running or queued on the executor at most. A request beyond that waits up to PASSWORD_HASH_WAIT_SECONDS
+# for a slot and is then turned away, instead of queueing without bound.
+PASSWORD_HASH_MAX_PENDING = int(os.getenv("PASSWORD_HASH_MAX_PENDING", "64"))
+PASSWORD_HASH_WAIT_SECONDS = float(os.getenv("PASSWORD_HASH_WAIT_SECONDS", "2"))
+password_hash_slots = asyncio.Semaphore(PASSWORD_HASH_MAX_PENDING)
 router = APIRouter(tags=["authentication"])
 
 # Authentication settings
@@ -49,6 +65,9 @@ ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 20
 REFRESH_TOKEN_EXPIRE_MINUTES = 60 * 24
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="login")
+# Least recently used cache of the access tokens already verified, sha256 of the token -> token data
+VERIFIED_ACCESS_TOKENS_MAX_ENTRIES = 10000
+verified_access_tokens: OrderedDict[str, TokenData] = OrderedDict()
 
 # Firebase
 cred = ""
@@ -57,17 +76,39 @@ if secret_store.FIREBASE_CREDENTIALS_FILE:
 else:
     cred = json.loads(bytes.fromhex(secret_store.FIREBASE_CREDENTIALS).decode("utf-8"))
 cred = firebase_admin.credentials.Certificate(cred)
-firebase_admin.initialize_app(cred)
+firebase_app = firebase_admin.initialize_app(cred)
+firebase_token_verifier = FirebaseTokenVerifier(project_id=firebase_app.project_id)
 
 
-def get_password_hash(salt, password):
+async def run_password_hash(function, *args):
+    try:
+        await asyncio.wait_for(password_hash_slots.acquire(), timeout=PASSWORD_HASH_WAIT_SECONDS)
+    except asyncio.TimeoutError:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="The service is busy, try again later.",
+            headers={"Retry-After": "1"},
+        )
+
+    try:
+        return await asyncio.get_running_loop().run_in_executor(password_hash_executor, function, *args)
+    finally:
+        password_hash_slots.release()
+
+
+async def get_password_hash(salt, password):
     PASSWORD_PEPPER = secret_store.PASSWORD_PEPPER
-    return pwd_context.hash(f"{salt}{password}{PASSWORD_PEPPER}")
+    return await run_password_hash(pwd_context.hash, f"{salt}{password}{PASSWORD_PEPPER}")
+
+
+async def verify_password(secret: str, hash: str) -> Tuple[bool, Optional[str]]:
+    # Returns whether the password matches, and a new hash if the stored one was made with outdated settings
+    return await run_password_hash(pwd_context.verify_and_update, secret, hash)
 
 
 async def firebase_get_current_user(token: str = Depends(oauth2_scheme)):
     try:
-        decoded_token = firebase_admin.auth.verify_id_token(token)
+        decoded_token = await firebase_token_verifier.verify(token)
         return FirebaseTokenData(**decoded_token)
     except Exception as e:
         raise HTTPException(
@@ -89,7 +130,23 @@ async def create_firebase_user(email: str, password: str, name: str):
     )
 
 
-async def get_current_user(token: str = Depends(oauth2_scheme)):
+def remember_access_token(key: str, token_data: TokenData):
+    verified_access_tokens[key] = token_data
+    verified_access_tokens.move_to_end(key)
+    if len(verified_access_tokens) > VERIFIED_ACCESS_TOKENS_MAX_ENTRIES:
+        verified_access_tokens.popitem(last=False)
+
+
+async def get_current_user(request: Request, token: str = Depends(oauth2_scheme)):
+    # A token that has already been verified is valid until it expires, it is looked up by its hash
+    key = hashlib.sha256(token.encode()).hexdigest()
+    token_data = verified_access_tokens.get(key)
+    if token_data and token_data.exp > time():
+        verified_access_tokens.move_to_end(key)
+        # Shared with the audit log middleware so that it does not decode the token again
+        request.state.token_data = token_data
+        return token_data
+
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials.",
@@ -110,6 +167,8 @@ async def get_current_user(token: str = Depends(oauth2_scheme)):
     except JWTError as exception:
         raise credentials_exception
 
+    remember_access_token(key, token_data)
+    request.state.token_data = token_data
     return token_data
 
 
@@ -209,10 +268,11 @@ async def login_for_access_token(
             detail=f"User account is {found_user_db.state.value}. Contact Array Insights support.",
         )
 
-    if not pwd_context.verify(
+    password_verified, updated_password_hash = await verify_password(
         secret=f"{found_user_db.email.strip().lower()}{form_data.password}{secret_store.PASSWORD_PEPPER}",
         hash=found_user_db.hashed_password,
-    ):
+    )
+    if not password_verified:
         # If this is a 5th failed attempt, lock the account and increase the failed login attempts
         # Otherwise, just increase the failed login attempts
         if found_user_db.failed_login_attempts >= 4:
@@ -236,6 +296,7 @@ async def login_for_access_token(
             query_user_id=found_user_db.id,
             update_last_login_time=datetime.utcnow(),
             update_failed_login_attempts=0,
+            update_password_hash=updated_password_hash,
         )
 
     # Create the access token and refresh token and return them
@@ -13,11 +13,11 @@
 # -------------------------------------------------------------------------------
 
 from datetime import datetime
+from typing import Optional
 
 from fastapi import APIRouter, Body, Depends, HTTPException, Path, Query, Response, status
-from fastapi_utils.tasks import repeat_every
 
-from app.api.authentication import get_current_user
+from app.api.authentication import RoleChecker, get_current_user
 from app.models.authentication import TokenData
 from app.models.common import PyObjectId
 from app.models.content_generation import (
@@ -25,13 +25,11 @@ from app.models.content_generation import (
     ContentGenerations,
     ContentGenerationState,
     GetContentGeneration_Out,
+    GetContentGenerationQueueStats_Out,
     GetMultipleContentGeneration_Out,
     RegisterContentGeneration_In,
     RegisterContentGeneration_Out,
 )
-from app.models.content_generation_template import ContentGenerationTemplates, Context
-from app.utils.azure_openai import OpenAiGenerator
-from app.utils.secrets import secret_store
 
 router = APIRouter(prefix="/api/content-generations", tags=["content-generations"])
 
@@ -74,17 +72,18 @@ async def get_all_content_generations(
     limit: int = Query(description="Limit the number of records", default=50),
     sort_key: str = Query(description="Sort key", default="creation_time"),
     sort_direction: int = Query(description="Sort direction", default=-1),
+    cursor: Optional[str] = Query(description="Cursor of the next page, overrides skip", default=None),
     current_user: TokenData = Depends(get_current_user),
 ) -> GetMultipleContentGeneration_Out:
 
-    content_generations = await ContentGenerations.read(
+    content_generations, next_cursor = await ContentGenerations.read_page(
         organization_id=current_user.organization_id,
         content_generation_template_id=content_generation_template_id,
-        sort_key=sort_key,
-        sort_direction=sort_direction,
+        cursor=cursor,
         skip=skip,
         limit=limit,
-        throw_on_not_found=False,
+        sort_key=sort_key,
+        sort_direction=sort_direction,
     )
     count = await ContentGenerations.count(content_generation_template_id=content_generation_template_id)
 
@@ -95,9 +94,23 @@ async def get_all_content_generations(
         count=count,
         limit=limit,
         next=skip + limit,
+        next_cursor=next_cursor,
     )
 
 
+@router.get(
+    path="/queue-stats",
+    description="Get the depth and latency of the content generation queue",
+    status_code=status.HTTP_200_OK,
+    dependencies=[Depends(RoleChecker(allowed_roles=[]))],
+    response_model_by_alias=False,
+    operation_id="get_content_generation_queue_stats",
+)
+async def get_content_generation_queue_stats() -> GetContentGenerationQueueStats_Out:
+
+    return await ContentGenerations.queue_stats()
+
+
 @router.get(
     path="/{content_generation_id}",
     description="Get a specific content generation record",
@@ -149,61 +162,3 @@ async def retry_content_generation(
     )
 
     return Response(status_code=status.HTTP_201_CREATED)
-
-
-@router.on_event("startup")
-# 1 second interval between each run. No overlap as the next run will only start after the current run is finished
-# This is done to prevent the open ai rate limiter from blocking the requests. Only 1 request per second will be processed
-@repeat_every(seconds=1)
-async def generate_content():
-
-    # read the database to get the content generation object that is not processed yet and is the oldest one
-    content_generation_req = await ContentGenerations.read(
-        content_generation_state=ContentGenerationState.RECEIVED,
-        skip=0,
-        limit=1,
-        sort_key="creation_time",
-        sort_direction=1,
-        throw_on_not_found=False,
-    )
-
-    if content_generation_req:
-        content_generation_req = content_generation_req[0]
-
-        try:
-            # Get the content generation template
-            content_generation_template = await ContentGenerationTemplates.read(
-                content_generation_template_id=content_generation_req.template_id
-            )
-
-            # prepare the content generation messages
-            messages = content_generation_template[0].context
-            prompt = content_generation_template[0].prompt.format(**content_generation_req.values)
-
-            messages.append(Context(role="user", content=prompt))
-            messages = [message.dict() for message in messages]
-
-            # Update the state to processing
-            await ContentGenerations.update(
-                query_content_generation_id=content_generation_req.id,
-                update_state=ContentGenerationState.PROCESSING,
-            )
-
-            # Make a call to OpenAI to generate the content
-            openai = OpenAiGenerator(secret_store.OPENAI_API_BASE, secret_store.OPENAI_API_KEY)
-            generated_content = await openai.get_response(messages=messages)
-
-            # Update the state to processed
-            await ContentGenerations.update(
-                query_content_generation_id=content_generation_req.id,
-                update_generated_content=generated_content,
-                update_state=ContentGenerationState.DONE,
-            )
-
-        except Exception as e:
-            # Update the state to failed
-            await ContentGenerations.update(
-                query_content_generation_id=content_generation_req.id,
-                update_state=ContentGenerationState.ERROR,
-                update_error_message=str(e),
-            )
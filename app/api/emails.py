@@ -118,19 +118,20 @@ async def get_all_emails(
     sort_direction: int = Query(default=-1, description="Sort direction"),
     filter_labels: Optional[List[str]] = Query(default=None, description="Filter tags"),
     filter_state: Optional[List[EmailState]] = Query(default=None, description="Filter state"),
+    cursor: Optional[str] = Query(default=None, description="Cursor of the next page, overrides skip"),
     current_user: TokenData = Depends(get_current_user),
 ) -> GetMultipleEmail_Out:
     # Check if the mailbox belongs to the user
     _ = await Mailboxes.read(mailbox_id=mailbox_id, user_id=current_user.id, throw_on_not_found=True)
-    emails = await Emails.read(
+    emails, next_cursor = await Emails.read_page(
         mailbox_id=mailbox_id,
         filter_labels=filter_labels,
         filter_state=filter_state,
+        cursor=cursor,
         skip=skip,
         limit=limit,
         sort_key=sort_key,
         sort_direction=sort_direction,
-        throw_on_not_found=False,
     )
     email_count = await Emails.count(
         mailbox_id=mailbox_id,
@@ -143,6 +144,7 @@ async def get_all_emails(
         count=email_count,
         next=skip + limit,
         limit=limit,
+        next_cursor=next_cursor,
     )
 
 
@@ -15,7 +15,6 @@
 import traceback
 
 from fastapi import APIRouter, Body, Depends, Path, Query, Response, status
-from fastapi.encoders import jsonable_encoder
 
 from app.api.authentication import get_current_user
 from app.models.authentication import TokenData
@@ -148,7 +147,7 @@ async def update_etapestry_data(
         throw_on_not_found=True,
     )
 
-    # Update the tags and notes
+    # Update the tags and notes, the search indexer updates elasticsearch from the change stream
     await ETapestryDatas.update(
         query_id=etapestry_data_id,
         update_tags=update_data.tags,
@@ -157,14 +156,6 @@ async def update_etapestry_data(
         update_videos=update_data.videos,
     )
 
-    # Update the data in the elastic search cluster as well
-    elastic_client = ElasticsearchClient()
-    await elastic_client.update_document(
-        index_name=str(etapestry_data[0].repository_id),
-        id=str(etapestry_data_id),
-        document=jsonable_encoder(etapestry_data[0], exclude=set(["_id", "id"])),
-    )
-
     return Response(status_code=status.HTTP_204_NO_CONTENT)
 
 
@@ -188,16 +179,12 @@ async def delete_etapestry_data(
         throw_on_not_found=True,
     )
 
-    # Delete the response template
+    # Delete the response template, the search indexer removes it from elasticsearch
     await ETapestryDatas.update(
         query_id=etapestry_data_id,
         update_state=ETapestryDataState.DELETED,
     )
 
-    # Delete from the elastic search cluster as well
-    elastic_client = ElasticsearchClient()
-    await elastic_client.delete_document(index_name=str(etapestry_data[0].repository_id), id=str(etapestry_data_id))
-
     return Response(status_code=status.HTTP_204_NO_CONTENT)
 
 
@@ -209,15 +196,8 @@ async def add_etapestry_data(data: AccountInfo, repository_id: PyObjectId):
             account=data,
             state=ETapestryDataState.ACTIVE,
         )
-        inserted_data = await ETapestryDatas.create(etapestry_data_db)
-
-        # Add the data to the elastic search cluster
-        elastic_client = ElasticsearchClient()
-        await elastic_client.insert_document(
-            index_name=str(repository_id),
-            id=str(inserted_data.id),
-            document=jsonable_encoder(inserted_data, exclude=set(["_id", "id"])),
-        )
+        # The search indexer picks up the new accounts from the change stream
+        await ETapestryDatas.create(etapestry_data_db)
     except Exception as e:
         print(f"Error adding eTapestry data: {e}")
         traceback.print_exc()
@@ -13,9 +13,10 @@
 # -------------------------------------------------------------------------------
 
 
-import asyncio
 import logging
+import os
 from datetime import datetime
+from typing import List, Optional, Tuple
 
 from fastapi import APIRouter, BackgroundTasks, Body, Depends, HTTPException, Path, Query, Response, status
 from fastapi.encoders import jsonable_encoder
@@ -30,6 +31,7 @@ from app.models.form_data import (
     FormDataState,
     FormFilter_In,
     GetFormData_Out,
+    GetFormDataClusters_Out,
     GetFormDataLocation_Out,
     GetMultipleFormData_Out,
     RegisterFormData_In,
@@ -39,12 +41,13 @@ from app.models.form_data import (
 from app.models.form_templates import FormMediaTypes, FormTemplates, GetStorageUrl_Out
 from app.utils import log_manager
 from app.utils.azure_blob_manager import AzureBlobManager
-from app.utils.azure_openai import OpenAiGenerator
+from app.utils.azure_openai import OpenAiGenerator, OpenAiPriority
 from app.utils.background_couroutines import AsyncTaskManager
 from app.utils.elastic_search import ElasticsearchClient
 from app.utils.emails import EmailAddress, EmailBody, Message, MessageResponse, OutlookClient, ToRecipient
 from app.utils.lock_store import RedisLockStore
 from app.utils.message_queue import MessageQueueTypes, RabbitMQProducerConsumer
+from app.utils.rate_limiter import TokenBucket
 from app.utils.secrets import secret_store
 from dateutil.parser import parse as parse_date
 
@@ -53,6 +56,11 @@ router = APIRouter(prefix="/api/form-data", tags=["form-data"])
 # logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# OpenAI requests per minute the structured data backfills are allowed to use
+BACKFILL_OPENAI_REQUESTS_PER_MINUTE = int(os.getenv("BACKFILL_OPENAI_REQUESTS_PER_MINUTE", "60"))
+METADATA_GENERATION_BATCH_SIZE = 100
+
+
 def clean_fields(values: dict):
     try:
         for key, field in values.items():
@@ -71,66 +79,55 @@ def clean_fields(values: dict):
     return values
 
 
-async def queue_form_data_metadata_generation():
-    log_manager.DEBUG({"message": "Pushing a message to the task queue to generate structured data"})
+async def enqueue_form_data_metadata_generation(field_not_exists: Optional[str] = None):
+    # Streams the form data ids and pushes them to the task queue in batches. The pace is set by a token
+    # bucket sized on the OpenAI quota set aside for backfills, each form costs one request for the
+    # structured data plus one per attachment to transcribe.
+    log_manager.INFO({"message": "Queueing form data for structured data generation"})
+    lock_store = RedisLockStore()
+    task_queue = RabbitMQProducerConsumer(
+        queue_name=MessageQueueTypes.FORM_DATA_METADATA_GENERATION,
+        connection_string=f"{secret_store.RABBIT_MQ_HOST}:5672",
+    )
+    await task_queue.connect()
+    openai_requests_per_second = BACKFILL_OPENAI_REQUESTS_PER_MINUTE / 60
+    rate_limiter = TokenBucket(rate=openai_requests_per_second, capacity=BACKFILL_OPENAI_REQUESTS_PER_MINUTE)
+
+    async def push_batch(batch: List[Tuple[str, int]]):
+        is_locked = await lock_store.are_locked([f"form_data_{form_data_id}" for form_data_id, _ in batch])
+        form_data_ids = []
+        for (form_data_id, attachment_count), locked in zip(batch, is_locked):
+            if locked:
+                log_manager.INFO({"message": f"Form data {form_data_id} is already being processed"})
+                continue
+            await rate_limiter.acquire(1 + attachment_count)
+            form_data_ids.append(str(form_data_id))
 
-    # Get the form data for which the metadata is not yet generated
-    metadata_not_generated = await FormDatas.read(field_not_exists="metadata")
-    if not metadata_not_generated:
-        return
+        if form_data_ids:
+            await task_queue.push_messages(form_data_ids)
+        return len(form_data_ids)
 
-    for form_data in metadata_not_generated:
-        form_data_id = form_data.id
+    queued = 0
+    batch = []
+    async for form_data_id, attachment_count in FormDatas.stream_attachment_counts(field_not_exists=field_not_exists):
+        batch.append((form_data_id, attachment_count))
+        if len(batch) >= METADATA_GENERATION_BATCH_SIZE:
+            queued += await push_batch(batch)
+            batch = []
+    if batch:
+        queued += await push_batch(batch)
 
-        lock_store = RedisLockStore()
-        is_locked = await lock_store.is_locked(f"form_data_{str(form_data_id)}")
-        if is_locked:
-            log_manager.INFO({"message": f"Form data {form_data_id} is already being processed"})
-            continue
+    log_manager.INFO({"message": f"Queued {queued} form data for structured data generation"})
 
-        log_manager.DEBUG(
-            {"message": f"Pushing a message {form_data_id} to the task queue to generate structured data"}
-        )
-        task_queue = RabbitMQProducerConsumer(
-            queue_name=MessageQueueTypes.FORM_DATA_METADATA_GENERATION,
-            connection_string=f"{secret_store.RABBIT_MQ_HOST}:5672",
-        )
-        await task_queue.connect()
-        await task_queue.push_message(str(form_data_id))
 
-        # sleep for 10 seconds to avoid rate limiting
-        await asyncio.sleep(10)
+async def queue_form_data_metadata_generation():
+    # Only the form data for which the structured data is not yet generated. The metadata is created by the first
+    # finished transcription, the structured data is only set once every attachment has been transcribed.
+    await enqueue_form_data_metadata_generation(field_not_exists="metadata.structured_data")
 
 
 async def queue_all_form_data_metadata_generation():
-    log_manager.DEBUG({"message": "Pushing a message to the task queue to generate structured data"})
-
-    # Get all the form data
-    metadata_not_generated = await FormDatas.read()
-    if not metadata_not_generated:
-        return
-
-    for form_data in metadata_not_generated:
-        form_data_id = form_data.id
-
-        lock_store = RedisLockStore()
-        is_locked = await lock_store.is_locked(f"form_data_{str(form_data_id)}")
-        if is_locked:
-            log_manager.INFO({"message": f"Form data {form_data_id} is already being processed"})
-            continue
-
-        log_manager.DEBUG(
-            {"message": f"Pushing a message {form_data_id} to the task queue to generate structured data"}
-        )
-        task_queue = RabbitMQProducerConsumer(
-            queue_name=MessageQueueTypes.FORM_DATA_METADATA_GENERATION,
-            connection_string=f"{secret_store.RABBIT_MQ_HOST}:5672",
-        )
-        await task_queue.connect()
-        await task_queue.push_message(str(form_data_id))
-
-        # sleep for 10 seconds to avoid rate limiting
-        await asyncio.sleep(10)
+    await enqueue_form_data_metadata_generation()
 
 
 async def notify_users(form_template_id: PyObjectId):
@@ -190,23 +187,9 @@ async def add_form_data(
         form_template_id=form_data.form_template_id,
         values=clean_fields(form_data.values),
     )
+    # The search indexer picks up the new form data from the change stream
     await FormDatas.create(form_data_db)
 
-    try:
-        # Add the form data to elasticsearch for search
-        elastic_client = ElasticsearchClient()
-        await elastic_client.insert_document(
-            index_name=str(form_data.form_template_id),
-            id=str(form_data_db.id),
-            document=jsonable_encoder(form_data_db, exclude=set(["_id", "id"])),
-        )
-    except Exception as e:
-        log_manager.ERROR({"message": f"Error while adding form data to elasticsearch: {e}"})
-        # raise HTTPException(
-        #     status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-        #     detail="Error while adding form data to elasticsearch",
-        # )
-
     # Send email notifications
     async_task_manager = AsyncTaskManager()
     async_task_manager.create_task(notify_users(form_data.form_template_id))
@@ -240,16 +223,9 @@ async def add_form_data_manual(
         values=form_data.values,
         creation_time=form_data.creation_time if form_data.creation_time else datetime.utcnow(),
     )
+    # The search indexer picks up the new form data from the change stream
     await FormDatas.create(form_data_db)
 
-    # Add the form data to elasticsearch for search
-    elastic_client = ElasticsearchClient()
-    await elastic_client.insert_document(
-        index_name=str(form_data.form_template_id),
-        id=str(form_data_db.id),
-        document=jsonable_encoder(form_data_db, exclude=set(["_id", "id"])),
-    )
-
     # Generate Tags
     background_tasks.add_task(generate_tags, form_data_db)
 
@@ -269,6 +245,7 @@ async def get_all_form_data(
     limit: int = Query(default=200, description="Number of emails to return"),
     sort_key: str = Query(default="creation_time", description="Sort key"),
     sort_direction: int = Query(default=-1, description="Sort direction"),
+    cursor: Optional[str] = Query(default=None, description="Cursor of the next page, overrides skip"),
     filters: FormFilter_In = Body(default=None, description="Filter key"),
     current_user: TokenData = Depends(get_current_user),
 ) -> GetMultipleFormData_Out:
@@ -285,14 +262,14 @@ async def get_all_form_data(
         if sort_key == "values.lastName.value":
             sort_key = "values.Last Name.value"
 
-    form_data_list = await FormDatas.read(
+    form_data_list, next_cursor = await FormDatas.read_page(
         form_template_id=form_template_id,
+        data_filter=filters,
+        cursor=cursor,
         skip=skip,
         limit=limit,
         sort_key=sort_key,
         sort_direction=sort_direction,
-        data_filter=filters,
-        throw_on_not_found=False,
     )
 
     form_data_count = await FormDatas.count(form_template_id=form_template_id, data_filter=filters)
@@ -302,6 +279,7 @@ async def get_all_form_data(
         count=form_data_count,
         next=skip + limit,
         limit=limit,
+        next_cursor=next_cursor,
     )
 
 
@@ -332,23 +310,11 @@ async def update_form_data(
         throw_on_not_found=True,
     )
 
-    # Update the form data
+    # Update the form data, the search indexer updates elasticsearch from the change stream
     await FormDatas.update(
         query_form_data_id=form_data_id, update_form_data_values=form_data.values, throw_on_no_update=False
     )
 
-    # Read the form data again to get the updated values
-    updated_form_data = await FormDatas.read(form_data_id=form_data_id, throw_on_not_found=True)
-    updated_form_data = updated_form_data[0]
-
-    # Update the form data in elasticsearch for search
-    elastic_client = ElasticsearchClient()
-    await elastic_client.update_document(
-        index_name=str(current_form_data[0].form_template_id),
-        id=str(form_data_id),
-        document=jsonable_encoder(updated_form_data, exclude=set(["_id", "id"])),
-    )
-
     return Response(status_code=status.HTTP_200_OK)
 
 
@@ -417,6 +383,35 @@ async def get_zipcodes(
     return GetFormDataLocation_Out(form_data_location=form_data_list)
 
 
+@router.get(
+    path="/zipcodes/clusters",
+    description="Get the form data of the template in the bounding box, clustered on a grid sized for the zoom level",
+    status_code=status.HTTP_200_OK,
+    response_model_by_alias=False,
+    operation_id="get_zipcode_clusters",
+)
+async def get_zipcode_clusters(
+    form_template_id: PyObjectId = Query(description="Form template id"),
+    west: float = Query(default=-180, ge=-180, le=180, description="Western longitude of the bounding box"),
+    south: float = Query(default=-90, ge=-90, le=90, description="Southern latitude of the bounding box"),
+    east: float = Query(default=180, ge=-180, le=180, description="Eastern longitude of the bounding box"),
+    north: float = Query(default=90, ge=-90, le=90, description="Northern latitude of the bounding box"),
+    zoom: int = Query(default=3, ge=0, le=22, description="Zoom level of the map"),
+    current_user: TokenData = Depends(get_current_user),
+) -> GetFormDataClusters_Out:
+    # Check if the user is the owner of the response template
+    _ = await FormTemplates.read(
+        template_id=form_template_id, organization_id=current_user.organization_id, throw_on_not_found=True
+    )
+
+    if south > north:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="South is above north")
+
+    return await FormDatas.cluster_locations(
+        form_template_id=form_template_id, west=west, south=south, east=east, north=north, zoom=zoom
+    )
+
+
 @router.get(
     path="/search",
     description="Search the text form data for the current user for the template",
@@ -534,16 +529,12 @@ async def delete_form_data(
         template_id=form_data[0].form_template_id, organization_id=current_user.organization_id, throw_on_not_found=True
     )
 
-    # Delete the response template
+    # Delete the response template, the search indexer removes it from elasticsearch
     await FormDatas.update(
         query_form_data_id=form_data_id,
         update_form_data_state=FormDataState.DELETED,
     )
 
-    # Delete from the elastic search cluster as well
-    elastic_client = ElasticsearchClient()
-    await elastic_client.delete_document(index_name=str(form_data[0].form_template_id), id=str(form_data_id))
-
     return Response(status_code=status.HTTP_204_NO_CONTENT)
 
 
@@ -577,6 +568,21 @@ async def backfill_metadata(background_tasks: BackgroundTasks):
     return Response(status_code=status.HTTP_200_OK)
 
 
+@router.get(
+    path="/test/backfill_locations",
+    description="Backfill the locations of the zip codes",
+    status_code=status.HTTP_200_OK,
+    response_model_by_alias=False,
+    dependencies=[Depends(RoleChecker(allowed_roles=[]))],
+    operation_id="backfill_locations",
+)
+async def backfill_locations(background_tasks: BackgroundTasks):
+    # Resolve the locations of the form data saved before they were stored with them
+    background_tasks.add_task(FormDatas.backfill_locations)
+
+    return Response(status_code=status.HTTP_200_OK)
+
+
 @router.get(
     path="/test/generate-all-metadata",
     description="Backfill the metadata",
@@ -614,7 +620,7 @@ async def generate_tag_for_form(form_data: FormData_Db):
     # messages.append({"role": "user", "content": "Pick from the following tags, if possible, and don't hesitate to add new ones: " + preferred_tags})
     messages.append({"role": "user", "content": patient})
     openai = OpenAiGenerator(secret_store.OPENAI_API_BASE, secret_store.OPENAI_API_KEY)
-    generated_content = await openai.get_response(messages=messages)
+    generated_content = await openai.get_response(messages=messages, priority=OpenAiPriority.BATCH, use_cache=True)
     if generated_content is None:
         logger.error(f"OpenAI Could not generate tags: {form_data.id}")
         return
@@ -646,7 +652,7 @@ async def generate_theme_for_story(form_data: FormData_Db):
     ]
     messages.append({"role": "user", "content": patient_story})
     openai = OpenAiGenerator(secret_store.OPENAI_API_BASE, secret_store.OPENAI_API_KEY)
-    generated_content = await openai.get_response(messages=messages)
+    generated_content = await openai.get_response(messages=messages, priority=OpenAiPriority.BATCH, use_cache=True)
     if generated_content is None:
         logger.error(f"OpenAI Could not generate themes: {form_data.id}")
         return
@@ -659,32 +665,20 @@ async def generate_theme_for_story(form_data: FormData_Db):
 
 
 async def generate_all_tags():
-    # Get all the form data
-    form_data = await FormDatas.read_forms_without_tags()
-    if not form_data:
-        return
-
-    # Process one at a time
-    for data in form_data:
+    # Stream the form data without tags and process one at a time
+    async for data in FormDatas.read_forms_without_tags():
         try:
             await generate_tag_for_form(data)
-            await asyncio.sleep(2)
         except Exception as e:
             print(e)
             logger.error(f"Error generating tags for form data: {data.id}")
 
 
 async def generate_all_themes():
-    # Get all the form data
-    form_data = await FormDatas.read(field_not_exists="themes", throw_on_not_found=False)
-    if not form_data:
-        return
-
-    # Process one at a time
-    for data in form_data:
+    # Stream the form data without themes and process one at a time
+    async for data in FormDatas.stream(field_not_exists="themes", batch_size=50):
         try:
             await generate_theme_for_story(data)
-            await asyncio.sleep(2)
         except Exception as e:
             print(e)
             logger.error(f"Error generating themes for form data: {data.id}")
@@ -705,18 +699,11 @@ async def deduplicate_form_data(
     organization_id = "bf863520-5dea-4447-9e3e-b85044c323ed"
     # form_template_id = "eec41736-f197-4d8b-8373-47ff7207237c"
 
-    # Get all the form data for the template
-    form_data_list = await FormDatas.read(
-        form_template_id=form_template_id,
-        throw_on_not_found=False,
-    )
-    if not form_data_list:
-        return Response(status_code=status.HTTP_204_NO_CONTENT)
-    
     original_forms = []
     duplicate_forms = []
 
-    for form_data in form_data_list:
+    # Stream all the form data for the template
+    async for form_data in FormDatas.stream(form_template_id=form_template_id, batch_size=1000):
         # Check if the form data is already processed
         if form_data.metadata and form_data.state == FormDataState.DELETED:
             continue
@@ -731,6 +718,9 @@ async def deduplicate_form_data(
         if not is_duplicate:
             original_forms.append(form_data)
 
+    if not original_forms:
+        return Response(status_code=status.HTTP_204_NO_CONTENT)
+
     print(f"Original forms: {len(original_forms)}, Duplicate forms: {len(duplicate_forms)}")
 
     for form_data in duplicate_forms:
@@ -741,14 +731,6 @@ async def deduplicate_form_data(
             throw_on_no_update=False,
         )
         print(f"Deleted form data: {form_data.id}")
-        # Delete from elasticsearch
-        elastic_client = ElasticsearchClient()
-        try:
-            await elastic_client.delete_document(
-                index_name=str(form_template_id), id=str(form_data.id)
-            )
-        except Exception as e:
-            logger.error(f"Error deleting form data from elasticsearch: {e}")
 
     return Response(
         status_code=status.HTTP_200_OK,
@@ -769,42 +751,26 @@ async def reindex_form_data(
     organization_id = current_user.organization_id
     # form_template_id = "eec41736-f197-4d8b-8373-47ff7207237c"
 
-    # Get all the form data for the template
-    form_data_list = await FormDatas.read(
-        form_template_id=form_template_id,
-        throw_on_not_found=False,
-    )
-    if not form_data_list:
-        return Response(status_code=status.HTTP_204_NO_CONTENT)
-
-    elastic_client = ElasticsearchClient()
-    for form_data in form_data_list:
-        try:
-            # get the form data from elasticsearch
-            existing_document = await elastic_client.get_document(
-                index_name=str(form_template_id),
-                id=str(form_data.id),
-            )
-            if existing_document:
-                if form_data.state == FormDataState.DELETED:
-                    # If the form data is deleted, delete it from elasticsearch
-                    await elastic_client.delete_document(
-                        index_name=str(form_template_id),
-                        id=str(form_data.id),
-                    )
-                    logger.info(f"Deleted form data from elasticsearch: {form_data.id}")
-                    continue
-                continue
-            if form_data.state == FormDataState.DELETED:
-                continue
+    # Stream all the form data for the template straight into the bulk indexer, the active
+    # documents are (re)indexed and the deleted ones are removed from the index
+    async def form_data_actions():
+        async for form_data in FormDatas.stream(form_template_id=form_template_id, batch_size=1000):
             # Clean the fields before reindexing
             form_data.values = clean_fields(form_data.values)
-            await elastic_client.insert_document(
+            yield ElasticsearchClient.index_action(
                 index_name=str(form_template_id),
                 id=str(form_data.id),
                 document=jsonable_encoder(form_data, exclude=set(["_id", "id"])),
             )
-        except Exception as e:
-            logger.error(f"Error reindexing form data: {e}")
+        async for form_data in FormDatas.stream(
+            form_template_id=form_template_id, state=FormDataState.DELETED, batch_size=1000
+        ):
+            yield ElasticsearchClient.delete_action(index_name=str(form_template_id), id=str(form_data.id))
+
+    elastic_client = ElasticsearchClient()
+    result = await elastic_client.bulk(form_data_actions())
+    logger.info(f"Reindexed form data for {form_template_id}: {result.succeeded} succeeded, {result.failed} failed")
+    for error in result.errors:
+        logger.error(f"Error reindexing form data: {error}")
 
     return Response(status_code=status.HTTP_200_OK)
\ No newline at end of file
@@ -45,23 +45,11 @@ router = APIRouter(prefix="/api/organization", tags=["organization"])
 
 
 async def aggregate_themes(template: FormTemplate_Db):
-    skip = 0
-    limit = 1000
-    themes = {}
-    while True:
-        forms = await FormDatas.read(form_template_id=template.id, skip=skip, limit=limit, throw_on_not_found=False)
-        if not forms or len(forms) == 0:
-            break
-        skip += limit
-        for form in forms:
-            if not form.themes or len(form.themes) == 0:
-                continue
-            for theme in form.themes:
-                if theme not in themes:
-                    themes[theme] = 0
-                themes[theme] += 1
-
-    themes = Counter(themes).most_common(10)
+    themes = Counter()
+    async for form_themes in FormDatas.stream_themes(form_template_id=template.id):
+        themes.update(form_themes)
+
+    themes = themes.most_common(10)
 
     db_themes = []
     for theme, c in themes:
@@ -12,22 +12,38 @@
 #     prior written permission of Array Insights, Inc.
 # -------------------------------------------------------------------------------
 
+import json
+import traceback
 from datetime import datetime
 
 from fastapi import APIRouter, Body, Depends, HTTPException, Path, Query, Response, status
+from fastapi.responses import StreamingResponse
 
 from app.api.authentication import get_current_user
 from app.models.authentication import TokenData
 from app.models.common import PyObjectId
 from app.models.content_generation_template import Context
-from app.models.form_data import FormDatas, GetFormData_Out, GetMultipleFormData_Out
+from app.models.form_data import FormDatas, GetMultipleFormData_Out
 from app.models.form_templates import FormTemplates
 from app.models.patient_chat import PatientChat, PatientChat_Base, PatientChat_Db, PatientChat_Out
-from app.utils.azure_openai import OpenAiGenerator
+from app.utils import log_manager
+from app.utils.azure_openai import OpenAiGenerator, OpenAiPriority
+from app.utils.chat_context import build_chat_context
 from app.utils.secrets import secret_store
 
 router = APIRouter(prefix="/api/patient-chat", tags=["patient-chat"])
 
+PATIENT_CHAT_SYSTEM_PROMPT = """
+        You are an AI assistant that works with a patient advocacy organization.
+        You are skilled at creating patient stories, fundraising emails, and personal emails or letters from data provided to you.
+        You craft these letters or emails based on patient information, highlighting the patients' personal journeys and what is
+        important to the patient in order to foster a sense of connection from the organization’s followers.
+        You do not include any personally identifiable information other than the person’s name, their state if applicable,
+        their diagnosis and their current disease state. You do not use full names and you do not use any financial information.
+        You do not embellish upon the information given to you and you do not sensationalize or use cliches.
+        You do not add any information that is not provided. You use empathy and write like a human.
+    """
+
 
 @router.get(
     path="/",
@@ -42,14 +58,9 @@ async def get_patient_chats(
     limit: int = Query(default=200, description="Number of emails to return"),
 ) -> GetMultipleFormData_Out:
 
-    chats = await PatientChat.get_chats(current_user.id, current_user.organization_id, skip, limit)
-    form_data = []
-    for chat in chats:
-        form_data_list = await FormDatas.read(form_data_id=chat.form_data_id, throw_on_not_found=False)
-        if form_data_list and len(form_data_list) > 0:
-            form_data.append(GetFormData_Out(**form_data_list[0].dict()))
-
-    chat_count = await PatientChat.count(current_user.id, current_user.organization_id)
+    form_data, chat_count = await PatientChat.get_chats_with_form_data(
+        current_user.id, current_user.organization_id, skip, limit
+    )
 
     return GetMultipleFormData_Out(
         form_data=form_data,
@@ -105,29 +116,7 @@ async def start_patient_chat(
     return PatientChat_Out(id=patient_chat.id, chat=[])
 
 
-@router.post(
-    path="/{chat_id}",
-    description="Ask a query",
-    status_code=status.HTTP_200_OK,
-    response_model_by_alias=False,
-    operation_id="patient_chat",
-)
-async def patient_chat(
-    chat_id: PyObjectId = Path(description="Chat Id"),
-    query: str = Body(description="Query"),
-    current_user: TokenData = Depends(get_current_user),
-) -> PatientChat_Out:
-
-    system_prompt = """
-        You are an AI assistant that works with a patient advocacy organization.
-        You are skilled at creating patient stories, fundraising emails, and personal emails or letters from data provided to you.
-        You craft these letters or emails based on patient information, highlighting the patients' personal journeys and what is
-        important to the patient in order to foster a sense of connection from the organization’s followers.
-        You do not include any personally identifiable information other than the person’s name, their state if applicable,
-        their diagnosis and their current disease state. You do not use full names and you do not use any financial information.
-        You do not embellish upon the information given to you and you do not sensationalize or use cliches.
-        You do not add any information that is not provided. You use empathy and write like a human.
-    """
+async def prepare_conversation(chat_id: PyObjectId, query: str, current_user: TokenData):
     # TODO: Avoid parallel chat on the same chat_id
     chat = await PatientChat.get_chat_by_id(chat_id)
 
@@ -143,20 +132,89 @@ async def patient_chat(
     if not chat.chat:
         chat.chat = [Context(role="user", content=patient)]
 
-    conversation = [Context(role="system", content=system_prompt)]
-    conversation.extend(chat.chat)
-    conversation.append(Context(role="user", content=query))
-    messages = [message.dict() for message in conversation]
+    # Only the recent messages are sent verbatim, the older ones are summarized
+    messages = await build_chat_context(PATIENT_CHAT_SYSTEM_PROMPT, chat, query)
 
-    openai = OpenAiGenerator(secret_store.OPENAI_API_BASE, secret_store.OPENAI_API_KEY)
-    generated_content = await openai.get_response(messages=messages)
-    conversation.append(Context(role="assistant", content=generated_content))
+    return chat, messages
+
+
+async def save_conversation(chat: PatientChat_Db, query: str, generated_content: str):
+    chat.chat.append(Context(role="user", content=query))
+    chat.chat.append(Context(role="assistant", content=generated_content))
 
-    chat.chat = conversation[1:]
-    await PatientChat.update(chat_id, chat)
+    await PatientChat.update(chat.id, chat)
     await FormDatas.update(chat.form_data_id, update_chat_time=datetime.utcnow(), throw_on_no_update=False)
 
-    return PatientChat_Out(id=chat.id, chat=conversation[1:])
+
+def server_sent_event(event: str, data: str) -> str:
+    # The data is json encoded so that new lines in the content do not end the event
+    return f"event: {event}\ndata: {data}\n\n"
+
+
+@router.post(
+    path="/{chat_id}",
+    description="Ask a query",
+    status_code=status.HTTP_200_OK,
+    response_model_by_alias=False,
+    operation_id="patient_chat",
+)
+async def patient_chat(
+    chat_id: PyObjectId = Path(description="Chat Id"),
+    query: str = Body(description="Query"),
+    current_user: TokenData = Depends(get_current_user),
+) -> PatientChat_Out:
+
+    chat, messages = await prepare_conversation(chat_id, query, current_user)
+
+    openai = OpenAiGenerator(secret_store.OPENAI_API_BASE, secret_store.OPENAI_API_KEY)
+    generated_content = await openai.get_response(messages=messages, priority=OpenAiPriority.INTERACTIVE)
+    await save_conversation(chat, query, generated_content)
+
+    return PatientChat_Out(id=chat.id, chat=chat.chat)
+
+
+@router.post(
+    path="/{chat_id}/stream",
+    description="Ask a query and receive the answer as server-sent events while it is generated",
+    status_code=status.HTTP_200_OK,
+    response_class=StreamingResponse,
+    operation_id="patient_chat_stream",
+)
+async def patient_chat_stream(
+    chat_id: PyObjectId = Path(description="Chat Id"),
+    query: str = Body(description="Query"),
+    current_user: TokenData = Depends(get_current_user),
+) -> StreamingResponse:
+
+    # Validated before the response starts so that a missing chat is still a 404
+    chat, messages = await prepare_conversation(chat_id, query, current_user)
+
+    async def events():
+        # A "token" event per piece of content, then "done" with the saved chat or "error". The chat is only
+        # saved once the whole answer has been generated.
+        openai = OpenAiGenerator(secret_store.OPENAI_API_BASE, secret_store.OPENAI_API_KEY)
+        generated_content = []
+        try:
+            async for content in openai.stream_response(messages=messages, priority=OpenAiPriority.INTERACTIVE):
+                generated_content.append(content)
+                yield server_sent_event("token", json.dumps({"content": content}))
+
+            await save_conversation(chat, query, "".join(generated_content))
+            yield server_sent_event("done", PatientChat_Out(id=chat.id, chat=chat.chat).model_dump_json(by_alias=False))
+        except Exception as exception:
+            log_manager.ERROR(
+                {
+                    "message": f"Error: while streaming patient chat {chat_id}: {exception}",
+                    "stack_trace": f"{traceback.format_exc()}",
+                }
+            )
+            yield server_sent_event("error", json.dumps({"error": "Failed to generate a response"}))
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 
 @router.get(
@@ -13,7 +13,6 @@
 # -------------------------------------------------------------------------------
 
 from fastapi import APIRouter, Body, Depends, Path, Query, Response, status
-from fastapi.encoders import jsonable_encoder
 
 from app.api.authentication import get_current_user
 from app.models.authentication import TokenData
@@ -80,16 +79,9 @@ async def add_new_patient_profile(
         state=PatientProfileState.ACTIVE,
     )
 
+    # The search indexer picks up the new patient profile from the change stream
     patient_profile_id = await PatientProfiles.create(patient_profile_db)
 
-    # Add the form data to elasticsearch for search
-    elastic_client = ElasticsearchClient()
-    await elastic_client.insert_document(
-        index_name=str(patient_profile.repository_id),
-        id=str(patient_profile_id),
-        document=jsonable_encoder(patient_profile_db, exclude=set(["_id", "id"])),
-    )
-
     return RegisterPatientProfile_Out(id=patient_profile_id)
 
 
@@ -200,26 +192,13 @@ async def update_patient_profile(
     current_user: TokenData = Depends(get_current_user),
 ) -> Response:
 
+    # The search indexer updates elasticsearch from the change stream
     await PatientProfiles.update(
         query_patient_profile_id=patient_profile_id,
         query_organization_id=current_user.organization_id,
         update_patient_profile=patient_profile,
     )
 
-    updated_patient_profile = await PatientProfiles.read(
-        organization_id=current_user.organization_id,
-        patient_profile_id=patient_profile_id,
-        throw_on_not_found=True,
-    )
-
-    # Update the form data in elasticsearch for search
-    elastic_client = ElasticsearchClient()
-    await elastic_client.update_document(
-        index_name=str(updated_patient_profile[0].repository_id),
-        id=str(patient_profile_id),
-        document=jsonable_encoder(updated_patient_profile[0], exclude=set(["_id", "id"])),
-    )
-
     return Response(status_code=status.HTTP_200_OK)
 
 
@@ -236,20 +215,17 @@ async def delete_patient_profile(
 ) -> Response:
 
     # Get the patient profile to check if the user is the owner of the patient profile
-    patient_profile = await PatientProfiles.read(
+    _ = await PatientProfiles.read(
         organization_id=current_user.organization_id,
         patient_profile_id=patient_profile_id,
         throw_on_not_found=True,
     )
 
+    # The search indexer removes the deleted patient profile from elasticsearch
     await PatientProfiles.update(
         query_patient_profile_id=patient_profile_id,
         query_organization_id=current_user.organization_id,
         update_patient_profile_state=PatientProfileState.DELETED,
     )
 
-    # Delete the form data from elasticsearch for search
-    elastic_client = ElasticsearchClient()
-    await elastic_client.delete_document(index_name=str(patient_profile[0].repository_id), id=str(patient_profile_id))
-
     return Response(status_code=status.HTTP_200_OK)
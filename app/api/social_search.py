@@ -17,7 +17,7 @@ from calendar import c
 from datetime import datetime
 from typing import List, Optional
 
-import httpx
+import aiohttp
 from fastapi import APIRouter, Body, Depends, HTTPException, Path, Query, Response, status
 from fastapi.concurrency import run_in_threadpool
 from fastapi.encoders import jsonable_encoder
@@ -38,6 +38,7 @@ from app.models.social_search import (
     SearchHistoryResponse,
 )
 from app.utils.azure_openai import OpenAiGenerator
+from app.utils.http_clients import Upstream, http_clients
 from app.utils.secrets import secret_store
 
 router = APIRouter(prefix="/api/social/search", tags=["social-search"])
@@ -54,18 +55,18 @@ def chunks(lst, n):
 
 async def filter_posts_by_patient_stories(posts: List[RedditPost]) -> List[RedditPost]:
     filtered_posts: List[RedditPost] = []
-    messages = []
-    messages.append(
-        {
-            "role": "system",
-            "content": """
+    system_message = {
+        "role": "system",
+        "content": """
     You are an assistant who helps with reading reddit posts and finding which posts are posts by potential or current patients.
     Each story has an id, title, and optional selftext. Return comma separated ids of potential stories.
     """,
-        }
-    )
+    }
     ids = []
     for subposts in chunks(posts, FILTER_BATCH_SIZE):
+        # Every batch is classified on its own so that the same posts always make the same request and are
+        # answered from the cache on a repeated search
+        messages = [system_message]
         for post in subposts:
             messages.append(
                 {
@@ -78,7 +79,7 @@ async def filter_posts_by_patient_stories(posts: List[RedditPost]) -> List[Reddi
                 }
             )
         openai = OpenAiGenerator(secret_store.OPENAI_API_BASE, secret_store.OPENAI_API_KEY)
-        generated_content = await openai.get_response(messages=messages)
+        generated_content = await openai.get_response(messages=messages, use_cache=True)
         ids.extend([x.strip() for x in generated_content.split(",")])
 
     for post in posts:
@@ -113,7 +114,7 @@ async def search_history(
         sort_direction=sort_direction,
     )
 
-    users = await Users.read(organization_id=current_user.organization_id)
+    users = await Users.read_many([search.user_id for search in result], current_user.organization_id)
 
     response = []
     for search in result:
@@ -170,12 +171,12 @@ async def reddit_search(
     url += "&q=" + urllib.parse.quote(query)
 
     results = []
-    async with httpx.AsyncClient() as client:
-        response = await client.get(
-            url,
-            auth=(secret_store.REDDIT_API_KEY, secret_store.REDDIT_API_SECRET),
-        )
-        results = response.json()
+    session = http_clients.get(Upstream.REDDIT)
+    async with session.get(
+        url,
+        auth=aiohttp.BasicAuth(secret_store.REDDIT_API_KEY, secret_store.REDDIT_API_SECRET),
+    ) as response:
+        results = await response.json(content_type=None)
 
     if "data" not in results or "children" not in results["data"]:
         raise HTTPException(
@@ -243,7 +244,7 @@ async def reddit_tags(
         sort_direction=sort_direction,
     )
     response = []
-    users = await Users.read(organization_id=current_user.organization_id)
+    users = await Users.read_many([post.added_by for post in result], current_user.organization_id)
     for post in result:
         user = next((x for x in users if x.id == post.added_by), None)
         response.append(
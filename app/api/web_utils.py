@@ -13,11 +13,11 @@
 # -------------------------------------------------------------------------------
 
 
-import aiohttp
 from fastapi import APIRouter, Body, Response, status
 from msal import ConfidentialClientApplication
 
 from app.models.common import SailBaseModel
+from app.utils.http_clients import Upstream, http_clients
 from app.utils.secrets import secret_store
 
 router = APIRouter(tags=["web-utils"])
@@ -54,10 +54,10 @@ async def verify_captcha(
     verification_url = "https://www.google.com/recaptcha/api/siteverify"
     payload = {"secret": secret_key, "response": captcha_token}
 
-    async with aiohttp.ClientSession() as session:
-        async with session.post(verification_url, data=payload) as response:
-            response = await response.json()
-            if response["success"]:
-                return Response(status_code=status.HTTP_202_ACCEPTED, content="Captcha verification successful")
-            else:
-                return Response(status_code=status.HTTP_400_BAD_REQUEST, content="Captcha verification failed")
+    session = http_clients.get(Upstream.RECAPTCHA)
+    async with session.post(verification_url, data=payload) as response:
+        response = await response.json()
+        if response["success"]:
+            return Response(status_code=status.HTTP_202_ACCEPTED, content="Captcha verification successful")
+        else:
+            return Response(status_code=status.HTTP_400_BAD_REQUEST, content="Captcha verification failed")
@@ -0,0 +1,160 @@
+# -------------------------------------------------------------------------------
+# Engineering
+# indexes.py
+# -------------------------------------------------------------------------------
+"""Declarative registry of the MongoDB indexes used by the models"""
+# -------------------------------------------------------------------------------
+# Copyright (C) 2024 Array Insights, Inc. All Rights Reserved.
+# Private and Confidential. Internal Use Only.
+#     This software contains proprietary information which shall not
+#     be reproduced or transferred to other documents and shall not
+#     be disclosed to others for any purpose without
+#     prior written permission of Array Insights, Inc.
+# -------------------------------------------------------------------------------
+
+import os
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple, Union
+
+from pydantic import BaseModel, Field
+from pymongo.errors import OperationFailure
+
+import app.utils.log_manager as logger
+from app.data.operations import DatabaseOperations
+
+# An index is only reported as unused once its usage has been counted for this long
+INDEX_USAGE_WINDOW_DAYS = int(os.getenv("INDEX_USAGE_WINDOW_DAYS", "7"))
+
+
+class MongoIndex(BaseModel):
+    keys: List[Tuple[str, Union[int, str]]] = Field()
+    unique: bool = Field(default=False)
+    sparse: bool = Field(default=False)
+    expire_after_seconds: Optional[int] = Field(default=None)
+
+    @property
+    def name(self) -> str:
+        # Same naming scheme as mongo uses for indexes created without an explicit name
+        return "_".join(f"{key}_{direction}" for key, direction in self.keys)
+
+
+class CollectionIndexReport(BaseModel):
+    collection: str = Field()
+    created: List[str] = Field(default=[])
+    missing: List[str] = Field(default=[])
+    failed: List[str] = Field(default=[])
+    mismatched: List[str] = Field(default=[])
+    undeclared: List[str] = Field(default=[])
+    dropped: List[str] = Field(default=[])
+    unused: List[str] = Field(default=[])
+
+
+# Collection name -> indexes declared by the model that owns the collection
+INDEX_REGISTRY: Dict[str, List[MongoIndex]] = {}
+
+
+def register_indexes(collection: str, indexes: List[MongoIndex]) -> List[MongoIndex]:
+    # Called from the body of the model classes, so the indexes are declared next to the queries that need them
+    INDEX_REGISTRY.setdefault(collection, [])
+    for index in indexes:
+        if index.name not in [registered.name for registered in INDEX_REGISTRY[collection]]:
+            INDEX_REGISTRY[collection].append(index)
+    return indexes
+
+
+async def reconcile_collection_indexes(
+    collection: str,
+    indexes: List[MongoIndex],
+    create_missing: bool = True,
+    drop_undeclared: bool = False,
+) -> CollectionIndexReport:
+    data_service = DatabaseOperations()
+    report = CollectionIndexReport(collection=collection)
+
+    existing = {}
+    for index_info in await data_service.list_indexes(collection=collection):
+        # Directions come back as floats for regular indexes and as strings for text and geo indexes
+        index_key = tuple(
+            (key, direction if isinstance(direction, str) else int(direction))
+            for key, direction in index_info["key"].items()
+        )
+        existing[index_key] = index_info
+
+    declared_keys = set()
+    for index in indexes:
+        key = tuple(index.keys)
+        declared_keys.add(key)
+        index_info = existing.get(key)
+        if index_info:
+            if (
+                bool(index_info.get("unique", False)) != index.unique
+                or bool(index_info.get("sparse", False)) != index.sparse
+                or index_info.get("expireAfterSeconds") != index.expire_after_seconds
+            ):
+                report.mismatched.append(index_info["name"])
+            continue
+
+        if not create_missing:
+            report.missing.append(index.name)
+            continue
+
+        try:
+            await data_service.create_index(
+                collection=collection,
+                index=index.keys,
+                unique=index.unique,
+                name=index.name,
+                sparse=index.sparse,
+                expire_after_seconds=index.expire_after_seconds,
+            )
+            report.created.append(index.name)
+        except OperationFailure as exception:
+            # Most likely duplicate values for a unique index, the index needs to be fixed by hand
+            logger.ERROR({"message": f"Failed to create index {collection}.{index.name}: {exception}"})
+            report.failed.append(index.name)
+
+    for key, index_info in existing.items():
+        if key == (("_id", 1),) or key in declared_keys:
+            continue
+        if drop_undeclared:
+            await data_service.drop_index(collection=collection, name=index_info["name"])
+            report.dropped.append(index_info["name"])
+        else:
+            report.undeclared.append(index_info["name"])
+
+    usage_window_start = datetime.utcnow() - timedelta(days=INDEX_USAGE_WINDOW_DAYS)
+    # $indexStats needs the clusterMonitor role which is not granted everywhere, the usage report is best effort
+    try:
+        for index_stats in await data_service.index_stats(collection=collection):
+            if index_stats["name"] == "_id_" or index_stats["name"] in report.dropped:
+                continue
+            # The counters start when the index is created or the server restarts, a recent index has not been used yet
+            accesses = index_stats.get("accesses", {})
+            since = accesses.get("since")
+            if since is None or since.replace(tzinfo=None) > usage_window_start:
+                continue
+            if accesses.get("ops", 0) == 0:
+                report.unused.append(index_stats["name"])
+    except OperationFailure as exception:
+        logger.WARNING({"message": f"Could not read the index usage of {collection}: {exception}"})
+
+    return report
+
+
+async def reconcile_indexes(
+    create_missing: bool = True,
+    drop_undeclared: bool = False,
+) -> List[CollectionIndexReport]:
+    # Only the models that have been imported are in the registry, importing the routers in main is enough
+    reports = []
+    for collection, indexes in INDEX_REGISTRY.items():
+        report = await reconcile_collection_indexes(
+            collection=collection,
+            indexes=indexes,
+            create_missing=create_missing,
+            drop_undeclared=drop_undeclared,
+        )
+        logger.INFO({"message": "Index reconciliation", **report.model_dump()})
+        reports.append(report)
+
+    return reports
@@ -14,18 +14,42 @@
 
 import asyncio
 import os
-from typing import Any, Dict, List, Optional, Tuple
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple, Union
 
 import pymongo.results as results
 from azure.identity import DefaultAzureCredential
 from azure.keyvault.secrets import SecretClient
 from motor import motor_asyncio
 from motor.motor_asyncio import AsyncIOMotorChangeStream
-from pymongo import ReturnDocument
+from pymongo import ReturnDocument, monitoring
 from pymongo.server_api import ServerApi
 
+import app.utils.log_manager as logger
+from app.utils.metrics import record_call
+from app.utils.pagination import PageCursor
 from app.utils.secrets import secret_store
 
+# Number of documents fetched from the server per round-trip when streaming a cursor
+DEFAULT_CURSOR_BATCH_SIZE = 200
+# Most documents the list helpers load in memory, larger results have to be streamed with find_cursor/aggregate_cursor
+MAX_LIST_LENGTH = int(os.getenv("MONGO_MAX_LIST_LENGTH", "10000"))
+
+
+class ResultTooLargeError(Exception):
+    pass
+
+
+class MongoCommandMetrics(monitoring.CommandListener):
+    # Records the duration of every command sent by the driver, called from the driver threads
+    def started(self, event: monitoring.CommandStartedEvent):
+        pass
+
+    def succeeded(self, event: monitoring.CommandSucceededEvent):
+        record_call("mongo", event.command_name, event.duration_micros / 1e6, failed=False)
+
+    def failed(self, event: monitoring.CommandFailedEvent):
+        record_call("mongo", event.command_name, event.duration_micros / 1e6, failed=True)
+
 
 class DatabaseOperations:
     _instance = None
@@ -54,11 +78,13 @@ class DatabaseOperations:
                     tlsCertificateKeyFile="/tmp/mongo_atlas_cert.pem",
                     server_api=ServerApi("1"),
                     io_loop=asyncio.get_event_loop(),
+                    event_listeners=[MongoCommandMetrics()],
                 )
             else:
                 cls.client = cls.client = motor_asyncio.AsyncIOMotorClient(
                     cls.mongodb_host,
                     io_loop=asyncio.get_event_loop(),
+                    event_listeners=[MongoCommandMetrics()],
                 )
             cls.sail_db = cls.client[secret_store.MONGO_DB_NAME]
 
@@ -66,14 +92,24 @@ class DatabaseOperations:
             os.remove("/tmp/mongo_atlas_cert.pem")
         return cls._instance
 
+    @staticmethod
+    async def _to_list(collection: str, cursor) -> List[Dict[str, Any]]:
+        # Load at most MAX_LIST_LENGTH documents, one more is read to tell a full result from a truncated one
+        documents = await cursor.to_list(MAX_LIST_LENGTH + 1)
+        if len(documents) > MAX_LIST_LENGTH:
+            message = f"More than {MAX_LIST_LENGTH} documents read from {collection}, use a cursor instead"
+            logger.ERROR({"message": message, "collection": collection})
+            raise ResultTooLargeError(message)
+        return documents
+
     async def find_one(self, collection, query) -> Optional[dict]:
         return await self.sail_db[collection].find_one(query)
 
     async def find_all(self, collection: str) -> list:
-        return await self.sail_db[collection].find().to_list(1000)
+        return await self._to_list(collection, self.sail_db[collection].find())
 
     async def find_sorted(self, collection: str, query: Dict, sort_key: str, sort_direction: int) -> list:
-        return await self.sail_db[collection].find(query).sort(sort_key, sort_direction).to_list(1000)
+        return await self._to_list(collection, self.sail_db[collection].find(query).sort(sort_key, sort_direction))
 
     async def find_sorted_pagination(
         self, collection: str, query: Dict, sort_key: str, sort_direction: int, skip: int, limit: int
@@ -87,16 +123,79 @@ class DatabaseOperations:
             .to_list(limit)
         )
 
-    async def find_one_and_update(self, collection: str, query: Dict, update: Dict) -> Optional[dict]:
+    async def find_keyset_pagination(
+        self,
+        collection: str,
+        query: Dict,
+        sort_key: str,
+        sort_direction: int,
+        limit: int,
+        cursor: Optional[str] = None,
+        skip: int = 0,
+    ) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        # Page through the collection in (sort_key, _id) order. When a cursor from a previous page is
+        # given the query resumes after its last document instead of skipping, which keeps deep pages
+        # cheap and stable while documents are being inserted. Raises ValueError on a bad cursor.
+        if cursor:
+            page_cursor = PageCursor.decode(cursor)
+            if page_cursor.sort_key != sort_key or page_cursor.sort_direction != sort_direction:
+                raise ValueError("Page cursor does not match the requested sort order")
+            query = {"$and": [query, page_cursor.keyset_filter()]}
+            skip = 0
+
+        sort = [(sort_key, sort_direction)]
+        if sort_key != "_id":
+            sort.append(("_id", sort_direction))
+
+        documents = await self.sail_db[collection].find(query).sort(sort).skip(skip).limit(limit).to_list(limit)
+
+        next_cursor = None
+        if documents and len(documents) == limit:
+            next_cursor = PageCursor.from_document(documents[-1], sort_key, sort_direction).encode()
+
+        return documents, next_cursor
+
+    async def find_one_and_update(
+        self,
+        collection: str,
+        query: Dict,
+        update: Dict,
+        sort: Optional[List[Tuple[str, int]]] = None,
+        upsert: bool = False,
+    ) -> Optional[dict]:
         return await self.sail_db[collection].find_one_and_update(
             query,
             update,
-            upsert=False,
+            sort=sort,
+            upsert=upsert,
             return_document=ReturnDocument.AFTER,
         )
 
     async def find_by_query(self, collection: str, query) -> List[Dict[str, Any]]:
-        return await self.sail_db[collection].find(query).to_list(1000)
+        return await self._to_list(collection, self.sail_db[collection].find(query))
+
+    async def find_cursor(
+        self,
+        collection: str,
+        query: Dict,
+        projection: Optional[Dict[str, Any]] = None,
+        sort: Optional[List[Tuple[str, int]]] = None,
+        batch_size: int = DEFAULT_CURSOR_BATCH_SIZE,
+        max_time_ms: Optional[int] = None,
+    ) -> AsyncIterator[Dict[str, Any]]:
+        # Stream the documents one at a time. Only one batch is held in memory at any point,
+        # so this is safe to use on whole collections.
+        cursor = self.sail_db[collection].find(query, projection).batch_size(batch_size)
+        if sort:
+            cursor = cursor.sort(sort)
+        if max_time_ms:
+            cursor = cursor.max_time_ms(max_time_ms)
+
+        try:
+            async for document in cursor:
+                yield document
+        finally:
+            await cursor.close()
 
     async def count(self, collection: str, query: Dict) -> int:
         return await self.sail_db[collection].count_documents(query)
@@ -104,12 +203,18 @@ class DatabaseOperations:
     async def insert_one(self, collection: str, data) -> results.InsertOneResult:
         return await self.sail_db[collection].insert_one(data)
 
-    async def update_one(self, collection: str, query: dict, data) -> results.UpdateResult:
-        return await self.sail_db[collection].update_one(query, data)
+    async def insert_many(self, collection: str, data: list, ordered: bool = False) -> results.InsertManyResult:
+        return await self.sail_db[collection].insert_many(data, ordered=ordered)
+
+    async def update_one(self, collection: str, query: dict, data, upsert: bool = False) -> results.UpdateResult:
+        return await self.sail_db[collection].update_one(query, data, upsert=upsert)
 
     async def update_many(self, collection: str, query: dict, data) -> results.UpdateResult:
         return await self.sail_db[collection].update_many(query, data)
 
+    async def bulk_write(self, collection: str, requests: list, ordered: bool = False) -> results.BulkWriteResult:
+        return await self.sail_db[collection].bulk_write(requests, ordered=ordered)
+
     async def delete(self, collection: str, query: dict) -> results.DeleteResult:
         return await self.sail_db[collection].delete_one(query)
 
@@ -119,20 +224,72 @@ class DatabaseOperations:
     async def drop(self):
         return await self.client.drop_database(self.sail_db)
 
-    async def create_index(self, collection: str, index: List[Tuple[str, int]], unique: bool = False):
-        return await self.sail_db[collection].create_index(index, unique=unique)
+    async def create_index(
+        self,
+        collection: str,
+        index: List[Tuple[str, Union[int, str]]],
+        unique: bool = False,
+        name: Optional[str] = None,
+        sparse: bool = False,
+        expire_after_seconds: Optional[int] = None,
+    ):
+        options: Dict[str, Any] = {"unique": unique}
+        if name:
+            options["name"] = name
+        if sparse:
+            options["sparse"] = sparse
+        if expire_after_seconds is not None:
+            options["expireAfterSeconds"] = expire_after_seconds
+        return await self.sail_db[collection].create_index(index, **options)
+
+    async def list_indexes(self, collection: str) -> List[Dict[str, Any]]:
+        return await self.sail_db[collection].list_indexes().to_list(None)
+
+    async def index_stats(self, collection: str) -> List[Dict[str, Any]]:
+        return await self.sail_db[collection].aggregate([{"$indexStats": {}}]).to_list(None)
+
+    async def drop_index(self, collection: str, name: str):
+        return await self.sail_db[collection].drop_index(name)
 
     async def aggregate(self, collection: str, pipeline: List[Dict]) -> List[Dict]:
-        return await self.sail_db[collection].aggregate(pipeline).to_list(10000)
+        return await self._to_list(collection, self.sail_db[collection].aggregate(pipeline))
+
+    async def aggregate_cursor(
+        self,
+        collection: str,
+        pipeline: List[Dict],
+        batch_size: int = DEFAULT_CURSOR_BATCH_SIZE,
+        max_time_ms: Optional[int] = None,
+    ) -> AsyncIterator[Dict[str, Any]]:
+        options: Dict[str, Any] = {"batchSize": batch_size, "allowDiskUse": True}
+        if max_time_ms:
+            options["maxTimeMS"] = max_time_ms
+        cursor = self.sail_db[collection].aggregate(pipeline, **options)
+
+        try:
+            async for document in cursor:
+                yield document
+        finally:
+            await cursor.close()
 
     async def get_change_stream(
-        self, collection_name: str, pipeline: List[dict], resume_token: Optional[Any] = None
+        self,
+        collection_name: str,
+        pipeline: List[dict],
+        resume_token: Optional[Any] = None,
+        full_document: Optional[str] = None,
+        max_await_time_ms: Optional[int] = None,
     ) -> AsyncIOMotorChangeStream:
         collection = self.sail_db[collection_name]
+        options: Dict[str, Any] = {}
+        if full_document:
+            options["full_document"] = full_document
+        if max_await_time_ms:
+            options["max_await_time_ms"] = max_await_time_ms
         if resume_token:
-            change_stream = collection.watch(pipeline, resume_after=resume_token)
+            change_stream = collection.watch(pipeline, resume_after=resume_token, **options)
         else:
-            change_stream = collection.watch(pipeline)
+            change_stream = collection.watch(pipeline, **options)
         return change_stream
 
     async def get_collection(self, collection_name: str):
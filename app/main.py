@@ -13,22 +13,14 @@
 # -------------------------------------------------------------------------------
 
 import asyncio
-import base64
-import json
-import logging
-import time
 import traceback
 from datetime import datetime
-from typing import Any, Callable, Dict, List, Union
-from urllib.parse import parse_qs, urlencode
 
-import aiohttp
 import fastapi.openapi.utils as utils
 from fastapi import FastAPI, Response, status
 from fastapi.encoders import jsonable_encoder
 from fastapi.exceptions import RequestValidationError
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.middleware.gzip import GZipMiddleware
 from fastapi.openapi.docs import get_swagger_ui_html
 from fastapi.requests import Request
 from fastapi.responses import JSONResponse
@@ -57,13 +49,31 @@ from app.api import (
     social_search,
     web_utils,
 )
-from app.data.operations import DatabaseOperations
+from app.data.indexes import reconcile_indexes
 from app.models.common import PyObjectId
+from app.models.content_generation import ContentGenerations, ContentGenerationState
+from app.tasks.content_generation import run_content_generation
+from app.tasks.search_indexer import run_search_indexer
 from app.tasks.structured_data import on_generate_structured_data
 from app.utils import log_manager
+from app.utils.audit_log import AuditLogMiddleware
+from app.utils.azure_openai import OpenAiGenerator
+from app.utils.compression import StreamingAwareGZipMiddleware
 from app.utils.elastic_search import ElasticsearchClient
+from app.utils.entity_cache import listen_for_invalidations
+from app.utils.error_reporter import ErrorReporter
+from app.utils.http_clients import http_clients
 from app.utils.message_queue import MessageQueueTypes, RabbitMQProducerConsumer
-from app.utils.secrets import secret_store
+from app.utils.metrics import (
+    OPENAI_CACHE_STATS,
+    QUEUE_DEPTH,
+    MetricsMiddleware,
+    collect_metrics,
+    monitor_event_loop_lag,
+    register_collector,
+    start_metrics_server,
+)
+from app.utils.secrets import KeyVaultSecrets, secret_store
 
 server = FastAPI(
     title="Tallulah",
@@ -108,7 +118,22 @@ server.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
-server.add_middleware(GZipMiddleware, minimum_size=1000)
+
+
+# The health probe and the swagger assets are requested far more often than they are worth logging
+AUDIT_LOG_SAMPLE_RATES = {"/": 0.01, "/api/static": 0.0}
+
+server.add_middleware(StreamingAwareGZipMiddleware, minimum_size=1000)
+# Outside of the compression, so that the response time covers it
+server.add_middleware(
+    AuditLogMiddleware,
+    max_body_size=4096,
+    skip_body_paths=["/api/media"],
+    skip_body_content_types=["multipart/form-data", "application/octet-stream"],
+    sample_rates=AUDIT_LOG_SAMPLE_RATES,
+)
+# Added last so that it is the outermost middleware and the request duration covers the whole request
+server.add_middleware(MetricsMiddleware)
 
 
 # Initialize the elasticsearch client
@@ -142,31 +167,12 @@ async def server_error_exception_handler(request: Request, exc: Exception):
         "exception": f"{str(exc)}",
         "request": f"{request.method} {request.url}",
         "stack_trace": f"{traceback.format_exc()}",
-        "created_at": f"{datetime.utcnow()}",
+        # A datetime so that the TTL index on the errors collection expires it
+        "created_at": datetime.utcnow(),
     }
 
-    # if the slack webhook is set, send the error to slack via aiohttp
-    if secret_store.SLACK_WEBHOOK:
-        headers = {"Content-type": "application/json"}
-        async with aiohttp.ClientSession() as session:
-            async with session.post(
-                secret_store.SLACK_WEBHOOK,
-                headers=headers,
-                json={
-                    "text": json.dumps(
-                        {
-                            "id": message["_id"],
-                            "exception": message["exception"],
-                        },
-                        indent=2,
-                    )
-                },
-            ) as response:
-                logging.info(f"Slack webhook response: {response.status}")
-
-    # Add it to the sail database audit log
-    data_service = DatabaseOperations()
-    await data_service.insert_one("errors", jsonable_encoder(message))
+    # Posted to slack and written to the database in the background, grouped by the fingerprint of the error
+    ErrorReporter().report(exc, dict(message))
 
     # Add the exception to the audit log as well
     log_manager.CRITICAL(message)
@@ -199,84 +205,32 @@ async def health_probe():
     return Response(status_code=status.HTTP_200_OK)
 
 
-async def set_body(request: Request, body: bytes):
-    async def receive():
-        return {"type": "http.request", "body": body}
-
-    request._receive = receive
-
-
-async def get_body(request: Request) -> bytes:
-    body = await request.body()
-    # await set_body(request, body)
-    return body
-
-
-def remove_sensitive_info(request_body: Union[Dict, List, Any]):
-    if isinstance(request_body, Dict):
-        for key in request_body.keys():
-            if "password" in key:
-                request_body[key] = "****"
-            elif isinstance(request_body[key], dict):
-                request_body[key] = remove_sensitive_info(request_body[key])
-        return request_body
-    elif isinstance(request_body, List):
-        for i in range(len(request_body)):
-            request_body[i] = remove_sensitive_info(request_body[i])
-        return request_body
-    else:
-        return request_body
-
-
-@server.middleware("http")
-async def add_audit_log(request: Request, call_next: Callable):
-    # await set_body(request, await request.body())
-    request_body = await get_body(request)
-
-    # remove sensitive data from the request body
-    if "Content-Type" in request.headers:
-        if request.headers.get("Content-Type") == "application/json":
-            try:
-                request_body = json.loads(request_body)
-            except json.JSONDecodeError:
-                request_body = {}
-            # recursively remove password from the request body
-            request_body_json = remove_sensitive_info(request_body)
-            request_body = json.dumps(request_body_json)
-        elif request.headers.get("Content-Type") == "application/x-www-form-urlencoded":
-            request_body = parse_qs(request_body.decode("utf-8"))
-            if "password" in request_body:
-                request_body["password"][0] = "****"
-            request_body = urlencode(request_body, doseq=True)
-
-    # calculate the response time
-    start_time = time.time()
-    response: Response = await call_next(request)
-    process_time = (time.time() - start_time) * 1000
-    response.headers["X-Process-Time"] = str(process_time) + "ms"
-
-    # Extract the user id from the JWT token in the request header
-    user_id = None
-    if "Authorization" in request.headers:
-        auth_token_list = request.headers["Authorization"].split(".")
-        if len(auth_token_list) > 1:
-            user_info_base_64 = request.headers["Authorization"].split(".")[1]
-            user_info = json.loads(base64.b64decode(user_info_base_64 + "=="))
-            user_id = user_info["id"] if "id" in user_info else "unknown"
+# One connection to the task queue, shared by its consumer and the metrics collector
+metadata_task_queue = RabbitMQProducerConsumer(
+    queue_name=MessageQueueTypes.FORM_DATA_METADATA_GENERATION,
+    connection_string=f"{secret_store.RABBIT_MQ_HOST}:5672",
+)
+
+
+async def collect_queue_depths():
+    QUEUE_DEPTH.labels(queue=MessageQueueTypes.FORM_DATA_METADATA_GENERATION.value).set(
+        await metadata_task_queue.message_count()
+    )
+
+    content_generations = await ContentGenerations.count_by_state(ContentGenerationState.RECEIVED)
+    QUEUE_DEPTH.labels(queue="content-generation").set(content_generations)
 
-    message = {
-        "user_id": user_id,
-        "host": f"{request.client.host}",  # type: ignore
-        "method": f"{request.method}",
-        "url": f"{request.url.path}",
-        "request_body": f"{request_body}",
-        "response": response.status_code,
-        "response_time": process_time,
-    }
 
-    log_manager.INFO(message)
+register_collector(collect_queue_depths)
 
-    return response
+
+async def collect_openai_cache_stats():
+    openai_generator = OpenAiGenerator(api_base=secret_store.OPENAI_API_BASE, api_key=secret_store.OPENAI_API_KEY)
+    for stat, value in (await openai_generator.response_cache.stats()).items():
+        OPENAI_CACHE_STATS.labels(stat=stat).set(value)
+
+
+register_collector(collect_openai_cache_stats)
 
 
 async def start_queue_consumers():
@@ -284,18 +238,25 @@ async def start_queue_consumers():
         await asyncio.sleep(30)
         log_manager.INFO({"message": "Starting the task queue consumer for generating structured data"})
 
-        rabbit_mq_connect_url = secret_store.RABBIT_MQ_HOST
-        task_queue = RabbitMQProducerConsumer(
-            queue_name=MessageQueueTypes.FORM_DATA_METADATA_GENERATION,
-            connection_string=f"{rabbit_mq_connect_url}:5672",
+        await metadata_task_queue.connect()
+        await metadata_task_queue.consume_messages(on_generate_structured_data)
+    except Exception as exception:
+        log_manager.ERROR(
+            {
+                "message": f"Error: while starting the task queue consumer: {exception}",
+                "stack_trace": f"{traceback.format_exc()}",
+            }
         )
 
-        await task_queue.connect()
-        await task_queue.consume_messages(on_generate_structured_data)
+
+async def reconcile_database_indexes():
+    try:
+        log_manager.INFO({"message": "Reconciling the database indexes"})
+        await reconcile_indexes(create_missing=True, drop_undeclared=False)
     except Exception as exception:
         log_manager.ERROR(
             {
-                "message": f"Error: while starting the task queue consumer: {exception}",
+                "message": f"Error: while reconciling the database indexes: {exception}",
                 "stack_trace": f"{traceback.format_exc()}",
             }
         )
@@ -304,3 +265,18 @@ async def start_queue_consumers():
 @server.on_event("startup")
 async def startup_event():
     asyncio.run_coroutine_threadsafe(start_queue_consumers(), asyncio.get_event_loop())
+    asyncio.run_coroutine_threadsafe(reconcile_database_indexes(), asyncio.get_event_loop())
+    asyncio.run_coroutine_threadsafe(run_search_indexer(), asyncio.get_event_loop())
+    asyncio.run_coroutine_threadsafe(run_content_generation(), asyncio.get_event_loop())
+    asyncio.run_coroutine_threadsafe(monitor_event_loop_lag(), asyncio.get_event_loop())
+    asyncio.run_coroutine_threadsafe(collect_metrics(), asyncio.get_event_loop())
+    # Scraped by prometheus on its own port, the metrics are not part of the public API
+    start_metrics_server()
+    asyncio.run_coroutine_threadsafe(listen_for_invalidations(), asyncio.get_event_loop())
+
+
+@server.on_event("shutdown")
+async def shutdown_event():
+    # Closes the pooled connections to the external services
+    await http_clients.close()
+    await KeyVaultSecrets().close()
@@ -41,18 +41,24 @@ async def move_data_from_mongo_to_es():
         # Create a new index
         await es_client.create_index(index_name=str(form_template["_id"]))
 
-        # Get the form data for the form template
-        form_data = await data_service.find_by_query(
-            collection=form_data_collection,
-            query={"form_template_id": form_template["_id"], "state": {"$ne": "DELETED"}},
-        )
+        # Stream the form data for the form template into the Elasticsearch
+        async def form_data_actions(form_template_id: str):
+            async for data in data_service.find_cursor(
+                collection=form_data_collection,
+                query={"form_template_id": form_template_id, "state": {"$ne": "DELETED"}},
+                batch_size=1000,
+            ):
+                yield es_client.index_action(
+                    index_name=form_template_id,
+                    id=str(data["_id"]),
+                    document=jsonable_encoder(data, exclude=set(["_id", "id"])),
+                )
 
-        # Insert the form data into the Elasticsearch
-        for data in form_data:
-            await es_client.insert_document(
-                index_name=str(form_template["_id"]),
-                id=str(data["_id"]),
-                document=jsonable_encoder(data, exclude=set(["_id", "id"])),
-            )
+        result = await es_client.bulk(form_data_actions(str(form_template["_id"])))
+        for error in result.errors:
+            print(f"Failed to move form data to Elasticsearch: {error}")
 
-        print(f"Form data for the form template {form_template['_id']} has been moved to Elasticsearch.")
+        print(
+            f"Form data for the form template {form_template['_id']} has been moved to Elasticsearch. "
+            f"{result.succeeded} documents indexed, {result.failed} failed."
+        )
@@ -25,8 +25,7 @@ async def org_name_to_id():
 
     # Update documents in the documents collection
     for collection in collections_with_org_name:
-        documents = await data_service.find_by_query(collection=collection, query={})
-        for doc in documents:
+        async for doc in data_service.find_cursor(collection=collection, query={}):
             # Check if the organization_name in doc exists in the mapping
             if doc.get("organization") and doc["organization"] in org_name_to_id:
                 # Update the document with the organization_id
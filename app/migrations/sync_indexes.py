@@ -0,0 +1,44 @@
+# -------------------------------------------------------------------------------
+# Engineering
+# sync_indexes.py
+# -------------------------------------------------------------------------------
+"""Reconcile the MongoDB indexes with the ones declared by the models"""
+# -------------------------------------------------------------------------------
+# Copyright (C) 2024 Array Insights, Inc. All Rights Reserved.
+# Private and Confidential. Internal Use Only.
+#     This software contains proprietary information which shall not
+#     be reproduced or transferred to other documents and shall not
+#     be disclosed to others for any purpose without
+#     prior written permission of Array Insights, Inc.
+# -------------------------------------------------------------------------------
+
+import argparse
+import asyncio
+import importlib
+import pkgutil
+
+import app.models
+from app.data.indexes import reconcile_indexes
+
+
+async def sync_indexes(create_missing: bool, drop_undeclared: bool):
+    # The models register their indexes when they are imported
+    for module in pkgutil.iter_modules(app.models.__path__):
+        importlib.import_module(f"app.models.{module.name}")
+
+    reports = await reconcile_indexes(create_missing=create_missing, drop_undeclared=drop_undeclared)
+    for report in reports:
+        print(f"{report.collection}:")
+        for field in ["created", "missing", "failed", "mismatched", "undeclared", "dropped", "unused"]:
+            names = getattr(report, field)
+            if names:
+                print(f"    {field}: {', '.join(names)}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Reconcile the MongoDB indexes with the ones declared by the models")
+    parser.add_argument("--dry-run", action="store_true", help="Only report the missing indexes, do not create them")
+    parser.add_argument("--drop-undeclared", action="store_true", help="Drop the indexes not declared by any model")
+    args = parser.parse_args()
+
+    asyncio.run(sync_indexes(create_missing=not args.dry_run, drop_undeclared=args.drop_undeclared))
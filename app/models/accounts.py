@@ -12,16 +12,19 @@
 #     prior written permission of Array Insights, Inc.
 # -------------------------------------------------------------------------------
 
+import asyncio
 from datetime import datetime
 from enum import Enum
-from typing import List, Optional
+from typing import Iterable, List, Optional
 
 from fastapi import HTTPException, status
 from fastapi.encoders import jsonable_encoder
 from pydantic import EmailStr, Field, StrictStr
 
+from app.data.indexes import MongoIndex, register_indexes
 from app.data.operations import DatabaseOperations
 from app.models.common import PyObjectId, SailBaseModel
+from app.utils.entity_cache import EntityCache
 
 
 class UserRole(Enum):
@@ -52,7 +55,8 @@ class User_Db(User_Base):
     id: PyObjectId = Field(default_factory=PyObjectId, alias="_id")
     organization_id: PyObjectId = Field()
     account_creation_time: datetime = Field(default_factory=datetime.utcnow)
-    hashed_password: StrictStr = Field()
+    # Only read from the database, it is left out of the users served from the cache
+    hashed_password: Optional[StrictStr] = Field(default=None)
     state: UserAccountState = Field()
     last_login_time: Optional[datetime] = Field(default=None)
     failed_login_attempts: int = Field(default=0)
@@ -100,6 +104,15 @@ class UpdateUser_In(SailBaseModel):
 class Users:
     DB_COLLECTION_USERS = "users"
     data_service = DatabaseOperations()
+    # The password hash is not copied into the shared cache, the login reads the user by email from the database
+    cache = EntityCache(DB_COLLECTION_USERS, excluded_fields=["hashed_password"])
+    DB_INDEXES = register_indexes(
+        DB_COLLECTION_USERS,
+        [
+            MongoIndex(keys=[("email", 1)]),
+            MongoIndex(keys=[("organization_id", 1)]),
+        ],
+    )
 
     @staticmethod
     async def create(
@@ -136,10 +149,14 @@ class Users:
         if user_state:
             query["state"] = user_state.value
 
-        response = await Users.data_service.find_by_query(
-            collection=Users.DB_COLLECTION_USERS,
-            query=jsonable_encoder(query),
-        )
+        if "_id" in query:
+            # The reads by id are served from the cache, these are made on almost every request
+            response = await Users.cache.find_by_id(jsonable_encoder(query))
+        else:
+            response = await Users.data_service.find_by_query(
+                collection=Users.DB_COLLECTION_USERS,
+                query=jsonable_encoder(query),
+            )
 
         if response:
             for data_model in response:
@@ -152,6 +169,21 @@ class Users:
 
         return dataset_version_list
 
+    @staticmethod
+    async def read_many(
+        user_ids: Iterable[PyObjectId],
+        organization_id: Optional[PyObjectId] = None,
+    ) -> List[User_Db]:
+        # Reads the users one by one through the cache instead of all the users of the organization
+        users = await asyncio.gather(
+            *[
+                Users.read(user_id=user_id, organization_id=organization_id, throw_on_not_found=False)
+                for user_id in set(user_ids)
+                if user_id
+            ]
+        )
+        return [user for found in users for user in found]
+
     @staticmethod
     async def update(
         query_user_id: Optional[PyObjectId] = None,
@@ -195,6 +227,8 @@ class Users:
             query=query,
             data=jsonable_encoder(update_request),
         )
+        # Drop the cached copies on all the replicas
+        await Users.cache.invalidate_query(query)
 
         if update_response.modified_count == 0 and not ignore_no_update:
             raise HTTPException(
@@ -13,14 +13,15 @@
 # -------------------------------------------------------------------------------
 
 
-from datetime import datetime
+from datetime import datetime, timedelta
 from enum import Enum
-from typing import Dict, List, Optional
+from typing import Dict, List, Optional, Tuple
 
 from fastapi import HTTPException, status
 from fastapi.encoders import jsonable_encoder
 from pydantic import Field, StrictStr
 
+from app.data.indexes import MongoIndex, register_indexes
 from app.data.operations import DatabaseOperations
 from app.models.common import PyObjectId, SailBaseModel
 
@@ -45,6 +46,12 @@ class ContentGeneration_Db(ContentGeneration_Base):
     state: ContentGenerationState = Field(default=ContentGenerationState.RECEIVED)
     error_message: Optional[StrictStr] = Field(default=None)
     creation_time: datetime = Field(default_factory=datetime.utcnow)
+    # Set when a worker claims the record, the claim is only valid until the lease expires
+    lease_id: Optional[PyObjectId] = Field(default=None)
+    lease_expiry_time: Optional[datetime] = Field(default=None)
+    attempts: int = Field(default=0)
+    processing_start_time: Optional[datetime] = Field(default=None)
+    completion_time: Optional[datetime] = Field(default=None)
 
 
 class GetContentGeneration_Out(ContentGeneration_Base):
@@ -60,6 +67,15 @@ class GetMultipleContentGeneration_Out(SailBaseModel):
     count: int
     limit: int
     next: int
+    next_cursor: Optional[StrictStr] = None
+
+
+class GetContentGenerationQueueStats_Out(SailBaseModel):
+    received: int = Field()
+    processing: int = Field()
+    oldest_received_age_seconds: float = Field()
+    average_wait_seconds: float = Field()
+    average_processing_seconds: float = Field()
 
 
 class RegisterContentGeneration_In(ContentGeneration_Base):
@@ -73,6 +89,15 @@ class RegisterContentGeneration_Out(SailBaseModel):
 class ContentGenerations:
     DB_COLLECTION_CONTENT_GENERATION = "content-generation"
     data_service = DatabaseOperations()
+    DB_INDEXES = register_indexes(
+        DB_COLLECTION_CONTENT_GENERATION,
+        [
+            MongoIndex(keys=[("state", 1), ("creation_time", 1)]),
+            MongoIndex(keys=[("state", 1), ("lease_expiry_time", 1)]),
+            MongoIndex(keys=[("completion_time", -1)]),
+            MongoIndex(keys=[("template_id", 1), ("organization_id", 1), ("creation_time", -1), ("_id", -1)]),
+        ],
+    )
 
     @staticmethod
     async def create(
@@ -140,6 +165,35 @@ class ContentGenerations:
 
         return conversations_list
 
+    @staticmethod
+    async def read_page(
+        organization_id: PyObjectId,
+        content_generation_template_id: PyObjectId,
+        cursor: Optional[StrictStr] = None,
+        skip: int = 0,
+        limit: int = 50,
+        sort_key: str = "creation_time",
+        sort_direction: int = -1,
+    ) -> Tuple[List[ContentGeneration_Db], Optional[StrictStr]]:
+        query = {}
+        query["template_id"] = str(content_generation_template_id)
+        query["organization_id"] = str(organization_id)
+
+        try:
+            response, next_cursor = await ContentGenerations.data_service.find_keyset_pagination(
+                collection=ContentGenerations.DB_COLLECTION_CONTENT_GENERATION,
+                query=jsonable_encoder(query),
+                sort_key=sort_key,
+                sort_direction=sort_direction,
+                limit=limit,
+                cursor=cursor,
+                skip=skip,
+            )
+        except ValueError as exception:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(exception))
+
+        return [ContentGeneration_Db(**conversation) for conversation in response], next_cursor
+
     @staticmethod
     async def update(
         query_content_generation_id: Optional[PyObjectId] = None,
@@ -171,6 +225,138 @@ class ContentGenerations:
                 detail=f"Conversation not found or no changes to update",
             )
 
+    @staticmethod
+    async def claim(lease_seconds: int) -> Optional[ContentGeneration_Db]:
+        # Atomically move the oldest received record to processing, only one worker can win the record
+        now = datetime.utcnow()
+        update = jsonable_encoder(
+            {
+                "$set": {
+                    "state": ContentGenerationState.PROCESSING.value,
+                    "lease_id": PyObjectId(),
+                    "processing_start_time": now,
+                },
+                "$inc": {"attempts": 1},
+            }
+        )
+        # Stored as a date, not an encoded string, so the expired leases are found with a date comparison
+        update["$set"]["lease_expiry_time"] = now + timedelta(seconds=lease_seconds)
+        claimed = await ContentGenerations.data_service.find_one_and_update(
+            collection=ContentGenerations.DB_COLLECTION_CONTENT_GENERATION,
+            query={"state": ContentGenerationState.RECEIVED.value},
+            update=update,
+            sort=[("creation_time", 1)],
+        )
+        if not claimed:
+            return None
+        return ContentGeneration_Db(**claimed)
+
+    @staticmethod
+    async def complete_claim(
+        content_generation_id: PyObjectId,
+        lease_id: PyObjectId,
+        state: ContentGenerationState,
+        generated_content: Optional[StrictStr] = None,
+        error_message: Optional[StrictStr] = None,
+    ) -> bool:
+        # Returns False if the lease was lost to another worker in the meantime, the result is then dropped
+        update_request = {"$set": {"state": state, "completion_time": datetime.utcnow(), "lease_expiry_time": None}}
+        if generated_content:
+            update_request["$set"]["generated"] = generated_content
+        if error_message:
+            update_request["$set"]["error_message"] = error_message
+
+        update_response = await ContentGenerations.data_service.update_one(
+            collection=ContentGenerations.DB_COLLECTION_CONTENT_GENERATION,
+            query={
+                "_id": str(content_generation_id),
+                "lease_id": str(lease_id),
+                "state": ContentGenerationState.PROCESSING.value,
+            },
+            data=jsonable_encoder(update_request),
+        )
+        return update_response.modified_count == 1
+
+    @staticmethod
+    async def recover_expired_leases(max_attempts: int) -> int:
+        # Records whose worker died while processing go back to the queue, or fail after too many attempts
+        expired = {
+            "state": ContentGenerationState.PROCESSING.value,
+            "lease_expiry_time": {"$lt": datetime.utcnow()},
+        }
+        failed_response = await ContentGenerations.data_service.update_many(
+            collection=ContentGenerations.DB_COLLECTION_CONTENT_GENERATION,
+            query={**expired, "attempts": {"$gte": max_attempts}},
+            data={
+                "$set": {
+                    "state": ContentGenerationState.ERROR.value,
+                    "error_message": "Content generation timed out",
+                    "lease_expiry_time": None,
+                }
+            },
+        )
+        retry_response = await ContentGenerations.data_service.update_many(
+            collection=ContentGenerations.DB_COLLECTION_CONTENT_GENERATION,
+            query=expired,
+            data={"$set": {"state": ContentGenerationState.RECEIVED.value, "lease_expiry_time": None}},
+        )
+        return failed_response.modified_count + retry_response.modified_count
+
+    @staticmethod
+    async def count_by_state(state: ContentGenerationState) -> int:
+        return await ContentGenerations.data_service.count(
+            collection=ContentGenerations.DB_COLLECTION_CONTENT_GENERATION,
+            query={"state": state.value},
+        )
+
+    @staticmethod
+    async def queue_stats(sample_size: int = 100) -> GetContentGenerationQueueStats_Out:
+        now = datetime.utcnow()
+        received = await ContentGenerations.count_by_state(ContentGenerationState.RECEIVED)
+        processing = await ContentGenerations.count_by_state(ContentGenerationState.PROCESSING)
+
+        oldest_received = await ContentGenerations.data_service.find_sorted_pagination(
+            collection=ContentGenerations.DB_COLLECTION_CONTENT_GENERATION,
+            query={"state": ContentGenerationState.RECEIVED.value},
+            sort_key="creation_time",
+            sort_direction=1,
+            skip=0,
+            limit=1,
+        )
+        oldest_received_age_seconds = 0.0
+        if oldest_received:
+            oldest_received_age_seconds = (
+                now - ContentGeneration_Db(**oldest_received[0]).creation_time
+            ).total_seconds()
+
+        # Latency of the most recently completed records
+        completed = await ContentGenerations.data_service.find_sorted_pagination(
+            collection=ContentGenerations.DB_COLLECTION_CONTENT_GENERATION,
+            query={"completion_time": {"$ne": None}, "processing_start_time": {"$ne": None}},
+            sort_key="completion_time",
+            sort_direction=-1,
+            skip=0,
+            limit=sample_size,
+        )
+        wait_seconds = []
+        processing_seconds = []
+        for content_generation in [ContentGeneration_Db(**record) for record in completed]:
+            if content_generation.processing_start_time and content_generation.completion_time:
+                wait_seconds.append(
+                    (content_generation.processing_start_time - content_generation.creation_time).total_seconds()
+                )
+                processing_seconds.append(
+                    (content_generation.completion_time - content_generation.processing_start_time).total_seconds()
+                )
+
+        return GetContentGenerationQueueStats_Out(
+            received=received,
+            processing=processing,
+            oldest_received_age_seconds=oldest_received_age_seconds,
+            average_wait_seconds=sum(wait_seconds) / len(wait_seconds) if wait_seconds else 0.0,
+            average_processing_seconds=sum(processing_seconds) / len(processing_seconds) if processing_seconds else 0.0,
+        )
+
     @staticmethod
     async def count(
         content_generation_template_id: Optional[PyObjectId] = None,
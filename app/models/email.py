@@ -14,12 +14,13 @@
 
 from datetime import datetime
 from enum import Enum
-from typing import Dict, List, Optional
+from typing import Dict, List, Optional, Tuple
 
 from fastapi import HTTPException, status
 from fastapi.encoders import jsonable_encoder
 from pydantic import Field, StrictStr
 
+from app.data.indexes import MongoIndex, register_indexes
 from app.data.operations import DatabaseOperations
 from app.models.common import PyObjectId, SailBaseModel
 
@@ -67,6 +68,7 @@ class GetMultipleEmail_Out(SailBaseModel):
     count: int = Field()
     next: int = Field()
     limit: int = Field()
+    next_cursor: Optional[StrictStr] = Field(default=None)
 
 
 class UpdateEmail_In(SailBaseModel):
@@ -76,6 +78,13 @@ class UpdateEmail_In(SailBaseModel):
 class Emails:
     DB_COLLECTION_EMAILS = "emails"
     data_service = DatabaseOperations()
+    DB_INDEXES = register_indexes(
+        DB_COLLECTION_EMAILS,
+        [
+            MongoIndex(keys=[("mailbox_id", 1), ("received_time", -1), ("_id", -1)]),
+            MongoIndex(keys=[("user_id", 1), ("message_state", 1)]),
+        ],
+    )
 
     @staticmethod
     async def create(
@@ -144,6 +153,39 @@ class Emails:
 
         return messages_list
 
+    @staticmethod
+    async def read_page(
+        mailbox_id: PyObjectId,
+        filter_labels: Optional[List[str]] = None,
+        filter_state: Optional[List[EmailState]] = None,
+        cursor: Optional[StrictStr] = None,
+        skip: int = 0,
+        limit: int = 20,
+        sort_key: str = "received_time",
+        sort_direction: int = -1,
+    ) -> Tuple[List[Email_Db], Optional[StrictStr]]:
+        query = {}
+        query["mailbox_id"] = str(mailbox_id)
+        if filter_labels:
+            query["label"] = {"$in": filter_labels}
+        if filter_state:
+            query["message_state"] = {"$in": [state.value for state in filter_state]}
+
+        try:
+            response, next_cursor = await Emails.data_service.find_keyset_pagination(
+                collection=Emails.DB_COLLECTION_EMAILS,
+                query=jsonable_encoder(query),
+                sort_key=sort_key,
+                sort_direction=sort_direction,
+                limit=limit,
+                cursor=cursor,
+                skip=skip,
+            )
+        except ValueError as exception:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(exception))
+
+        return [Email_Db(**data_model) for data_model in response], next_cursor
+
     @staticmethod
     async def update(
         query_message_id: Optional[PyObjectId] = None,
@@ -73,40 +73,26 @@ class ETapestryDatas:
     async def create(
         etapestry_data: ETapestryData_Db,
     ) -> ETapestryData_Db:
-        # check if the account exists
+        # Upsert the account by its eTapestry id in a single write. A pull refreshes the account and marks it active
+        # again, the notes, tags, photos and videos added in tallulah are only set when the account is first added
         query_request = {}
         query_request["repository_id"] = str(etapestry_data.repository_id)
         query_request["account.id"] = etapestry_data.account.id
 
-        account = await ETapestryDatas.data_service.find_one(
+        document = jsonable_encoder(etapestry_data)
+        refreshed_fields = ["repository_id", "account", "state"]
+        update_request = {
+            "$set": {field: document[field] for field in refreshed_fields},
+            "$setOnInsert": {field: value for field, value in document.items() if field not in refreshed_fields},
+        }
+        account = await ETapestryDatas.data_service.find_one_and_update(
             collection=ETapestryDatas.DB_COLLECTION_ETAPESTRY_DATA,
             query=jsonable_encoder(query_request),
+            update=update_request,
+            upsert=True,
         )
-        if not account:
-            await ETapestryDatas.data_service.insert_one(
-                collection=ETapestryDatas.DB_COLLECTION_ETAPESTRY_DATA,
-                data=jsonable_encoder(etapestry_data),
-            )
-        else:
-            # Use the same id
-            etapestry_data.id = account["_id"]
-            if "notes" in account:
-                etapestry_data.notes = account["notes"]
-            if "tags" in account:
-                etapestry_data.tags = account["tags"]
-            if "photos" in account:
-                etapestry_data.photos = account["photos"]
-            if "videos" in account:
-                etapestry_data.videos = account["videos"]
-
-            # update the existing account
-            await ETapestryDatas.data_service.update_one(
-                collection=ETapestryDatas.DB_COLLECTION_ETAPESTRY_DATA,
-                query=jsonable_encoder(query_request),
-                data=jsonable_encoder({"$set": jsonable_encoder(etapestry_data)}),
-            )
 
-        return etapestry_data
+        return ETapestryData_Db(**account)
 
     @staticmethod
     async def read(
@@ -23,6 +23,7 @@ from pydantic import Field, StrictStr
 from app.data.operations import DatabaseOperations
 from app.models.common import PyObjectId, SailBaseModel
 from app.models.form_templates import CardLayout
+from app.utils.entity_cache import EntityCache
 
 
 class ETapestryRepositoryState(Enum):
@@ -78,6 +79,7 @@ class UpdateETapestryRepository_In(SailBaseModel):
 class ETapestryRepositories:
     DB_COLLECTION_etapestry_REPOSITORIES = "etapestry_repositories"
     data_service = DatabaseOperations()
+    cache = EntityCache(DB_COLLECTION_etapestry_REPOSITORIES)
 
     @staticmethod
     async def create(
@@ -107,10 +109,14 @@ class ETapestryRepositories:
         else:
             query["state"] = {"$ne": ETapestryRepositoryState.DELETED.value}
 
-        response = await ETapestryRepositories.data_service.find_by_query(
-            collection=ETapestryRepositories.DB_COLLECTION_etapestry_REPOSITORIES,
-            query=jsonable_encoder(query),
-        )
+        if "_id" in query:
+            # The reads by id are served from the cache, these are made on almost every request
+            response = await ETapestryRepositories.cache.find_by_id(jsonable_encoder(query))
+        else:
+            response = await ETapestryRepositories.data_service.find_by_query(
+                collection=ETapestryRepositories.DB_COLLECTION_etapestry_REPOSITORIES,
+                query=jsonable_encoder(query),
+            )
 
         if response:
             for etapestry_repository in response:
@@ -156,6 +162,8 @@ class ETapestryRepositories:
             query=query,
             data=jsonable_encoder(update_request),
         )
+        # Drop the cached copies on all the replicas
+        await ETapestryRepositories.cache.invalidate_query(query)
 
         if update_response.modified_count == 0:
             raise HTTPException(
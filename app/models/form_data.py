@@ -15,16 +15,19 @@
 import math
 from datetime import date, datetime
 from enum import Enum
-from typing import Any, Dict, List, Optional, Union
+from typing import Any, AsyncIterator, Dict, List, Literal, Optional, Tuple, Union
 
-import pgeocode
 from fastapi import HTTPException, status
 from fastapi.encoders import jsonable_encoder
 from pydantic import Field, StrictStr
+from pymongo import UpdateOne
 
 import app.utils.log_manager as logger
+from app.data.indexes import MongoIndex, register_indexes
 from app.data.operations import DatabaseOperations
 from app.models.common import PyObjectId, SailBaseModel
+from app.models.form_templates import FormFieldTypes
+from app.utils.geocoding import ZipCodes
 
 
 class FormDataState(Enum):
@@ -66,6 +69,18 @@ class FormDataMetadata(SailBaseModel):
     creation_time: datetime = Field(default_factory=datetime.utcnow)
 
 
+class Location(SailBaseModel):
+    latitude: float = Field()
+    longitude: float = Field()
+    city: str = Field()
+
+
+class GeoPoint(SailBaseModel):
+    # GeoJSON point, the coordinates are the longitude then the latitude
+    type: Literal["Point"] = Field(default="Point")
+    coordinates: List[float] = Field()
+
+
 class FormData_Base(SailBaseModel):
     form_template_id: PyObjectId = Field()
     values: Dict[StrictStr, Any] = Field(default=None)
@@ -86,6 +101,10 @@ class FormData_Db(FormData_Base):
     themes: Optional[List[StrictStr]] = Field(default=None)
     metadata: Optional[FormDataMetadata] = Field(default=None)
     creation_time: datetime = Field(default_factory=datetime.utcnow)
+    # Resolved from the zip code field of the values when they are saved
+    zipcode: Optional[StrictStr] = Field(default=None)
+    location: Optional[Location] = Field(default=None)
+    geo_point: Optional[GeoPoint] = Field(default=None)
 
 
 class GetFormData_Out(FormData_Base):
@@ -105,6 +124,7 @@ class GetMultipleFormData_Out(SailBaseModel):
     count: int = Field()
     next: int = Field()
     limit: int = Field()
+    next_cursor: Optional[StrictStr] = Field(default=None)
 
 
 class FormFilter_In(SailBaseModel):
@@ -113,12 +133,6 @@ class FormFilter_In(SailBaseModel):
     values_not_present: Optional[List[StrictStr]] = Field(default=None)
 
 
-class Location(SailBaseModel):
-    latitude: float = Field()
-    longitude: float = Field()
-    city: str = Field()
-
-
 class FormDataLocation(SailBaseModel):
     form_data_id: PyObjectId = Field()
     zipcode: str = Field()
@@ -129,19 +143,84 @@ class GetFormDataLocation_Out(SailBaseModel):
     form_data_location: List[FormDataLocation] = Field()
 
 
+class FormDataCluster(SailBaseModel):
+    # Average position of the form data in the cell of the grid
+    latitude: float = Field()
+    longitude: float = Field()
+    count: int = Field()
+    # Set when the cluster is a single form data, so that it can be shown as a marker
+    form_data_id: Optional[PyObjectId] = Field(default=None)
+    city: Optional[StrictStr] = Field(default=None)
+
+
+class GetFormDataClusters_Out(SailBaseModel):
+    clusters: List[FormDataCluster] = Field()
+    total: int = Field()
+    cell_size: float = Field()
+
+
 class FormDatas:
     DB_COLLECTION_FORM_DATA = "form_data"
     data_service = DatabaseOperations()
+    DB_INDEXES = register_indexes(
+        DB_COLLECTION_FORM_DATA,
+        [
+            MongoIndex(keys=[("form_template_id", 1), ("state", 1), ("creation_time", -1), ("_id", -1)]),
+            MongoIndex(keys=[("form_template_id", 1), ("geo_point", "2dsphere")]),
+        ],
+    )
+    # Cells of the clustering grid per tile of the map, a 256px tile is split into 64px cells
+    MAP_CELLS_PER_TILE = 4
+    MAP_MAX_CLUSTERS = 2000
+    # Resolved from the zip code, unset until the zip code has been geocoded
+    LOCATION_FIELDS = {"location", "geo_point"}
 
     @staticmethod
     async def create(
         form_data: FormData_Db,
     ):
+        # Resolved once here so that the map views read the location instead of geocoding every zip code
+        resolved = await FormDatas.resolve_location(form_data.values)
+        for field, value in resolved.items():
+            setattr(form_data, field, value)
         return await FormDatas.data_service.insert_one(
             collection=FormDatas.DB_COLLECTION_FORM_DATA,
-            data=jsonable_encoder(form_data),
+            # The fields that could not be resolved are left out instead of null, for the backfill to find them
+            data=jsonable_encoder(form_data, exclude=FormDatas.LOCATION_FIELDS - resolved.keys()),
         )
 
+    @staticmethod
+    def get_zipcode(values: Optional[Dict[StrictStr, Any]]) -> Optional[StrictStr]:
+        # The value of the first zip code field of the form
+        for field in (values or {}).values():
+            if isinstance(field, dict) and field.get("type") == FormFieldTypes.ZIPCODE.value and field.get("value"):
+                return str(field["value"]).strip()
+        return None
+
+    @staticmethod
+    async def resolve_location(values: Optional[Dict[StrictStr, Any]]) -> Dict[str, Any]:
+        # The zip code and its location to store with the values, null when there is no zip code or it is unknown
+        zipcode = FormDatas.get_zipcode(values)
+        if not zipcode:
+            return {"zipcode": None, "location": None, "geo_point": None}
+        try:
+            locations = await ZipCodes().geocode([zipcode])
+        except Exception as exception:
+            # The form data is saved without a location rather than failing. The location is left out, not null,
+            # so that backfill_locations resolves it later.
+            logger.WARNING({"message": f"Failed to geocode zip code {zipcode}: {exception}"})
+            return {"zipcode": zipcode}
+        location = Location(**locations[zipcode]) if zipcode in locations else None
+        return {"zipcode": zipcode, "location": location, "geo_point": FormDatas.get_geo_point(location)}
+
+    @staticmethod
+    def get_geo_point(location: Union[None, Location, Dict[str, Any]]) -> Optional[GeoPoint]:
+        if not location:
+            return None
+        if isinstance(location, dict):
+            location = Location(**location)
+        return GeoPoint(coordinates=[location.longitude, location.latitude])
+
     @staticmethod
     def convert_form_data_to_string(form_data: FormData_Db):
         remove_form_fields = ["consentToTag", "image", "consent", "tags"]
@@ -164,36 +243,26 @@ class FormDatas:
         return patient
 
     @staticmethod
-    async def read_forms_without_tags() -> List[FormData_Db]:
-        form_data_list = []
+    async def read_forms_without_tags(batch_size: int = 50) -> AsyncIterator[FormData_Db]:
         query = {
             "values.tags": {"$exists": False}
             # "themes": {"$exists": False} # For missing themes only
         }
-        response = await FormDatas.data_service.find_by_query(
+        async for form_data in FormDatas.data_service.find_cursor(
             collection=FormDatas.DB_COLLECTION_FORM_DATA,
             query=jsonable_encoder(query),
-        )
-        if response:
-            for form_data in response:
-                form_data_list.append(FormData_Db(**form_data))
-
-        return form_data_list
+            batch_size=batch_size,
+        ):
+            yield FormData_Db(**form_data)
 
     @staticmethod
-    async def read(
+    def _build_query(
         form_data_id: Optional[PyObjectId] = None,
         form_template_id: Optional[PyObjectId] = None,
         data_filter: Optional[FormFilter_In] = None,
         field_not_exists: Optional[StrictStr] = None,
-        skip: Optional[int] = None,
-        limit: Optional[int] = None,
-        sort_key: str = "creation_time",
-        sort_direction: int = -1,
-        throw_on_not_found: bool = True,
-    ) -> List[FormData_Db]:
-        form_data_list = []
-
+        state: FormDataState = FormDataState.ACTIVE,
+    ) -> Dict[str, Any]:
         query = {}
         if form_data_id:
             query["_id"] = str(form_data_id)
@@ -223,8 +292,110 @@ class FormDatas:
         if field_not_exists:
             query["$or"] = [{field_not_exists: {"$exists": False}}, {field_not_exists: None}]
 
-        # only read the non deleted ones
-        query["state"] = FormDataState.ACTIVE.value
+        # only read the non deleted ones unless asked otherwise
+        query["state"] = state.value
+
+        return query
+
+    @staticmethod
+    async def stream(
+        form_template_id: Optional[PyObjectId] = None,
+        data_filter: Optional[FormFilter_In] = None,
+        field_not_exists: Optional[StrictStr] = None,
+        sort_key: Optional[str] = None,
+        sort_direction: int = -1,
+        batch_size: int = 200,
+        max_time_ms: Optional[int] = None,
+        state: FormDataState = FormDataState.ACTIVE,
+    ) -> AsyncIterator[FormData_Db]:
+        # Same filters as read() but the documents are streamed from the database cursor
+        # instead of being loaded into memory all at once
+        query = FormDatas._build_query(
+            form_template_id=form_template_id,
+            data_filter=data_filter,
+            field_not_exists=field_not_exists,
+            state=state,
+        )
+        async for form_data in FormDatas.data_service.find_cursor(
+            collection=FormDatas.DB_COLLECTION_FORM_DATA,
+            query=jsonable_encoder(query),
+            sort=[(sort_key, sort_direction)] if sort_key else None,
+            batch_size=batch_size,
+            max_time_ms=max_time_ms,
+        ):
+            yield FormData_Db(**form_data)
+
+    @staticmethod
+    async def stream_themes(
+        form_template_id: PyObjectId,
+        batch_size: int = 1000,
+    ) -> AsyncIterator[List[StrictStr]]:
+        # Only the themes are projected as the rest of the form data is not needed to aggregate them
+        query = FormDatas._build_query(form_template_id=form_template_id)
+        query["themes.0"] = {"$exists": True}
+        async for form_data in FormDatas.data_service.find_cursor(
+            collection=FormDatas.DB_COLLECTION_FORM_DATA,
+            query=query,
+            projection={"_id": 0, "themes": 1},
+            batch_size=batch_size,
+        ):
+            yield form_data["themes"]
+
+    @staticmethod
+    async def stream_attachment_counts(
+        field_not_exists: Optional[StrictStr] = None,
+        batch_size: int = 500,
+    ) -> AsyncIterator[Tuple[StrictStr, int]]:
+        # Streams the id of every form data with the number of video, audio and image attachments it has,
+        # the count is computed by the database so the values themselves are never sent over
+        query = FormDatas._build_query(field_not_exists=field_not_exists)
+        attachment_count = {
+            "$sum": {
+                "$map": {
+                    "input": {"$objectToArray": {"$ifNull": ["$values", {}]}},
+                    "as": "field",
+                    "in": {
+                        "$cond": [
+                            {
+                                "$and": [
+                                    {"$in": ["$$field.v.type", ["VIDEO", "AUDIO", "IMAGE"]]},
+                                    {"$isArray": "$$field.v.value"},
+                                ]
+                            },
+                            {"$size": "$$field.v.value"},
+                            0,
+                        ]
+                    },
+                }
+            }
+        }
+        async for form_data in FormDatas.data_service.aggregate_cursor(
+            collection=FormDatas.DB_COLLECTION_FORM_DATA,
+            pipeline=[{"$match": query}, {"$project": {"_id": 1, "attachment_count": attachment_count}}],
+            batch_size=batch_size,
+        ):
+            yield form_data["_id"], form_data["attachment_count"]
+
+    @staticmethod
+    async def read(
+        form_data_id: Optional[PyObjectId] = None,
+        form_template_id: Optional[PyObjectId] = None,
+        data_filter: Optional[FormFilter_In] = None,
+        field_not_exists: Optional[StrictStr] = None,
+        skip: Optional[int] = None,
+        limit: Optional[int] = None,
+        sort_key: str = "creation_time",
+        sort_direction: int = -1,
+        throw_on_not_found: bool = True,
+    ) -> List[FormData_Db]:
+        form_data_list = []
+
+        query = FormDatas._build_query(
+            form_data_id=form_data_id,
+            form_template_id=form_template_id,
+            data_filter=data_filter,
+            field_not_exists=field_not_exists,
+        )
 
         if skip is None and limit is None:
             response = await FormDatas.data_service.find_by_query(
@@ -257,35 +428,39 @@ class FormDatas:
 
         return form_data_list
 
+    @staticmethod
+    async def read_page(
+        form_template_id: PyObjectId,
+        data_filter: Optional[FormFilter_In] = None,
+        cursor: Optional[StrictStr] = None,
+        skip: int = 0,
+        limit: int = 200,
+        sort_key: str = "creation_time",
+        sort_direction: int = -1,
+    ) -> Tuple[List[FormData_Db], Optional[StrictStr]]:
+        query = FormDatas._build_query(form_template_id=form_template_id, data_filter=data_filter)
+
+        try:
+            response, next_cursor = await FormDatas.data_service.find_keyset_pagination(
+                collection=FormDatas.DB_COLLECTION_FORM_DATA,
+                query=jsonable_encoder(query),
+                sort_key=sort_key,
+                sort_direction=sort_direction,
+                limit=limit,
+                cursor=cursor,
+                skip=skip,
+            )
+        except ValueError as exception:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(exception))
+
+        return [FormData_Db(**form_data) for form_data in response], next_cursor
+
     @staticmethod
     async def count(
         form_template_id: Optional[PyObjectId] = None,
         data_filter: Optional[FormFilter_In] = None,
     ) -> int:
-        query = {}
-        query["state"] = FormDataState.ACTIVE.value
-        if form_template_id:
-            query["form_template_id"] = str(form_template_id)
-        if data_filter:
-            if data_filter.kv:
-                for key, value in data_filter.kv.items():
-                    query[f"values.{key}.value"] = {"$in": value}
-            if data_filter.values_present:
-                for field in data_filter.values_present:
-                    query["$and"] = [
-                        {f"values.{field}.value": {"$exists": True}},
-                        {f"values.{field}.value": {"$ne": None}},
-                        {f"values.{field}.value": {"$ne": ""}},
-                        {f"values.{field}.value": {"$ne": []}},
-                    ]
-            if data_filter.values_not_present:
-                for field in data_filter.values_not_present:
-                    query["$or"] = [
-                        {f"values.{field}.value": {"$exists": False}},
-                        {f"values.{field}.value": None},
-                        {f"values.{field}.value": {"$eq": []}},
-                        {f"values.{field}.value": {"$eq": ""}},
-                    ]
+        query = FormDatas._build_query(form_template_id=form_template_id, data_filter=data_filter)
 
         return await FormDatas.data_service.count(collection=FormDatas.DB_COLLECTION_FORM_DATA, query=query)
 
@@ -309,6 +484,12 @@ class FormDatas:
             update_request["$set"]["state"] = update_form_data_state.value
         if update_form_data_values:
             update_request["$set"]["values"] = update_form_data_values
+            resolved = await FormDatas.resolve_location(update_form_data_values)
+            update_request["$set"].update(resolved)
+            # The location of the previous values is removed when the new one could not be resolved
+            unresolved = FormDatas.LOCATION_FIELDS - resolved.keys()
+            if unresolved:
+                update_request["$unset"] = {field: "" for field in unresolved}
         if update_form_data_tags:
             update_request["$set"]["values.tags"] = {
                 "value": ", ".join(update_form_data_tags),
@@ -334,57 +515,195 @@ class FormDatas:
                     detail=f"Form Data not found or no changes to update",
                 )
 
+    @staticmethod
+    async def add_attachment_metadata(
+        form_data_id: PyObjectId,
+        attachment_metadata: Union[VideoMetadata, AudioMetadata, ImageMetadata],
+    ):
+        # Push a single finished transcription into the metadata, so a retry can skip it. The metadata is
+        # created first if the form data does not have one yet, and an attachment is never pushed twice.
+        if isinstance(attachment_metadata, VideoMetadata):
+            field, id_field, attachment_id = "video_metadata", "video_id", attachment_metadata.video_id
+        elif isinstance(attachment_metadata, AudioMetadata):
+            field, id_field, attachment_id = "audio_metadata", "audio_id", attachment_metadata.audio_id
+        else:
+            field, id_field, attachment_id = "image_metadata", "image_id", attachment_metadata.image_id
+
+        await FormDatas.data_service.update_one(
+            collection=FormDatas.DB_COLLECTION_FORM_DATA,
+            query={"_id": str(form_data_id), "metadata": None},
+            data={"$set": {"metadata": jsonable_encoder(FormDataMetadata())}},
+        )
+        await FormDatas.data_service.update_one(
+            collection=FormDatas.DB_COLLECTION_FORM_DATA,
+            query={"_id": str(form_data_id), f"metadata.{field}.{id_field}": {"$ne": str(attachment_id)}},
+            data={"$push": {f"metadata.{field}": jsonable_encoder(attachment_metadata)}},
+        )
+
     @staticmethod
     async def aggregate_zipcodes(
         form_template_id: PyObjectId,
     ) -> List[FormDataLocation]:
 
-        agg_pipeline = [
-            {"$match": {"form_template_id": str(form_template_id), "state": FormDataState.ACTIVE.value}},
-            {
-                "$project": {
-                    "_id": 1,
-                    "zipcode": {
-                        "$filter": {
-                            "input": {"$objectToArray": "$values"},
-                            "as": "item",
-                            "cond": {"$eq": ["$$item.v.type", "ZIPCODE"]},
+        # The locations are resolved when the form data is saved, or by backfill_locations for the older ones
+        # Streamed, a template can have more form data than the list helpers load at once
+        return [
+            FormDataLocation(**form_data_location)
+            async for form_data_location in FormDatas.data_service.aggregate_cursor(
+                collection=FormDatas.DB_COLLECTION_FORM_DATA,
+                pipeline=[
+                    {
+                        "$match": {
+                            "form_template_id": str(form_template_id),
+                            "state": FormDataState.ACTIVE.value,
+                            "location": {"$type": "object"},
                         }
                     },
-                }
-            },
-            {"$project": {"_id": 1, "zipcode": {"$first": "$zipcode.v.value"}}},
+                    {"$project": {"_id": 0, "form_data_id": "$_id", "zipcode": 1, "location": 1}},
+                ],
+                batch_size=1000,
+            )
         ]
 
-        response = await FormDatas.data_service.aggregate(
-            collection=FormDatas.DB_COLLECTION_FORM_DATA,
-            pipeline=agg_pipeline,
-        )
-
-        nomi = pgeocode.Nominatim("us")
+    @staticmethod
+    async def backfill_locations(batch_size: int = 1000):
+        # Resolves the location of the form data saved before it was stored with them, a batch of zip codes at a time
+        batch: List[Tuple[StrictStr, Optional[StrictStr]]] = []
 
-        form_data_location_list: List[FormDataLocation] = []
-        for zipcode in response:
-            if "zipcode" not in zipcode or not zipcode["zipcode"]:
-                continue
+        async def resolve_batch():
+            locations = await ZipCodes().geocode([zipcode for _, zipcode in batch if zipcode])
+            await FormDatas.data_service.bulk_write(
+                collection=FormDatas.DB_COLLECTION_FORM_DATA,
+                requests=[
+                    UpdateOne(
+                        {"_id": form_data_id},
+                        {
+                            "$set": {
+                                "zipcode": zipcode,
+                                "location": locations.get(zipcode) if zipcode else None,
+                                "geo_point": jsonable_encoder(
+                                    FormDatas.get_geo_point(locations.get(zipcode) if zipcode else None)
+                                ),
+                            }
+                        },
+                    )
+                    for form_data_id, zipcode in batch
+                ],
+            )
 
-            zipcode_info = nomi.query_postal_code(zipcode["zipcode"])
+        # Only the zip code field is read, a form data without one is given an empty location and not read again.
+        # A zip code without a geo point is tried again, it was saved as null by a failed geocoding before they were
+        # left unset, or is not a known zip code and is cheap to look up again.
+        async for form_data in FormDatas.data_service.aggregate_cursor(
+            collection=FormDatas.DB_COLLECTION_FORM_DATA,
+            pipeline=[
+                {
+                    "$match": {
+                        "$or": [
+                            {"geo_point": {"$exists": False}},
+                            {"geo_point": None, "zipcode": {"$ne": None}},
+                        ]
+                    }
+                },
+                {
+                    "$project": {
+                        "zipcode": {
+                            "$filter": {
+                                "input": {"$objectToArray": {"$ifNull": ["$values", {}]}},
+                                "as": "item",
+                                "cond": {"$eq": ["$$item.v.type", FormFieldTypes.ZIPCODE.value]},
+                            }
+                        },
+                    }
+                },
+                {"$project": {"_id": 1, "zipcode": {"$first": "$zipcode.v.value"}}},
+            ],
+            batch_size=batch_size,
+        ):
+            zipcode = form_data.get("zipcode")
+            batch.append((form_data["_id"], str(zipcode).strip() if zipcode else None))
+            if len(batch) >= batch_size:
+                await resolve_batch()
+                batch = []
+
+        if batch:
+            await resolve_batch()
 
-            # check if latitude and longitude are valid
-            if not zipcode_info["latitude"] or not zipcode_info["longitude"]:
-                continue
+    @staticmethod
+    def bounding_box_polygon(west: float, south: float, east: float, north: float) -> Dict[str, Any]:
+        # The edges of a GeoJSON polygon are great circles, not parallels. The top and bottom edges get a vertex
+        # every degree so that they stay close to the parallels, the exact box is matched on the coordinates.
+        steps = max(1, math.ceil(east - west))
+        longitudes = [west + (east - west) * step / steps for step in range(steps + 1)]
+        ring = [[longitude, south] for longitude in longitudes]
+        ring += [[longitude, north] for longitude in reversed(longitudes)]
+        ring.append([west, south])
+        return {"type": "Polygon", "coordinates": [ring]}
 
-            if math.isnan(zipcode_info["latitude"]) or math.isnan(zipcode_info["longitude"]):  # type: ignore
-                logger.INFO({"message": f"Invalid latitude or longitude for zipcode: {zipcode['zipcode']}"})
-                continue
+    @staticmethod
+    async def cluster_locations(
+        form_template_id: PyObjectId,
+        west: float,
+        south: float,
+        east: float,
+        north: float,
+        zoom: int,
+    ) -> GetFormDataClusters_Out:
+        # The form data in the bounding box counted per cell of a grid sized for the zoom level, so that the map
+        # gets a few hundred clusters instead of every form data
+        cell_size = 360 / (2**zoom) / FormDatas.MAP_CELLS_PER_TILE
+        match: Dict[str, Any] = {
+            "form_template_id": str(form_template_id),
+            "state": FormDataState.ACTIVE.value,
+            "geo_point": {"$type": "object"},
+        }
+        # A box wider than a hemisphere, or across the antimeridian, is not a valid GeoJSON polygon, the whole
+        # width of the map is shown then anyway
+        if west < east and east - west < 180:
+            match["geo_point"] = {"$geoWithin": {"$geometry": FormDatas.bounding_box_polygon(west, south, east, north)}}
+            match["location.longitude"] = {"$gte": west, "$lte": east}
+        match["location.latitude"] = {"$gte": south, "$lte": north}
+
+        longitude = {"$arrayElemAt": ["$geo_point.coordinates", 0]}
+        latitude = {"$arrayElemAt": ["$geo_point.coordinates", 1]}
+        response = await FormDatas.data_service.aggregate(
+            collection=FormDatas.DB_COLLECTION_FORM_DATA,
+            pipeline=[
+                {"$match": match},
+                {
+                    "$group": {
+                        "_id": {
+                            "x": {"$floor": {"$divide": [longitude, cell_size]}},
+                            "y": {"$floor": {"$divide": [latitude, cell_size]}},
+                        },
+                        "count": {"$sum": 1},
+                        "latitude": {"$avg": latitude},
+                        "longitude": {"$avg": longitude},
+                        "form_data_id": {"$first": "$_id"},
+                        "city": {"$first": "$location.city"},
+                    }
+                },
+                {
+                    "$facet": {
+                        "clusters": [{"$sort": {"count": -1}}, {"$limit": FormDatas.MAP_MAX_CLUSTERS}],
+                        "total": [{"$group": {"_id": None, "total": {"$sum": "$count"}}}],
+                    }
+                },
+            ],
+        )
 
-            location = Location(
-                latitude=zipcode_info["latitude"],  # type: ignore
-                longitude=zipcode_info["longitude"],  # type: ignore
-                city=zipcode_info["place_name"] + " " + zipcode_info["state_name"] + " " + zipcode_info["country_code"],  # type: ignore
-            )
-            form_data_location_list.append(
-                FormDataLocation(form_data_id=zipcode["_id"], zipcode=zipcode["zipcode"], location=location)
+        result = response[0]
+        clusters = []
+        for cluster in result["clusters"]:
+            single = cluster["count"] == 1
+            clusters.append(
+                FormDataCluster(
+                    latitude=cluster["latitude"],
+                    longitude=cluster["longitude"],
+                    count=cluster["count"],
+                    form_data_id=cluster["form_data_id"] if single else None,
+                    city=cluster["city"] if single else None,
+                )
             )
-
-        return form_data_location_list
+        total = result["total"][0]["total"] if result["total"] else 0
+        return GetFormDataClusters_Out(clusters=clusters, total=total, cell_size=cell_size)
@@ -20,8 +20,10 @@ from fastapi import HTTPException, status
 from fastapi.encoders import jsonable_encoder
 from pydantic import Field, StrictStr
 
+from app.data.indexes import MongoIndex, register_indexes
 from app.data.operations import DatabaseOperations
 from app.models.common import PyObjectId, SailBaseModel
+from app.utils.entity_cache import EntityCache
 
 
 class FormFieldTypes(Enum):
@@ -151,6 +153,13 @@ class FormTemplateData_Db(FormTemplateData_Base):
 class FormTemplates:
     DB_COLLECTION_FORM_TEMPLATES = "form_templates"
     data_service = DatabaseOperations()
+    cache = EntityCache(DB_COLLECTION_FORM_TEMPLATES)
+    DB_INDEXES = register_indexes(
+        DB_COLLECTION_FORM_TEMPLATES,
+        [
+            MongoIndex(keys=[("organization_id", 1), ("state", 1)]),
+        ],
+    )
 
     @staticmethod
     async def create(
@@ -180,10 +189,14 @@ class FormTemplates:
         else:
             query["state"] = {"$ne": FormTemplateState.DELETED.value}
 
-        response = await FormTemplates.data_service.find_by_query(
-            collection=FormTemplates.DB_COLLECTION_FORM_TEMPLATES,
-            query=jsonable_encoder(query),
-        )
+        if "_id" in query:
+            # The reads by id are served from the cache, these are made on almost every request
+            response = await FormTemplates.cache.find_by_id(jsonable_encoder(query))
+        else:
+            response = await FormTemplates.data_service.find_by_query(
+                collection=FormTemplates.DB_COLLECTION_FORM_TEMPLATES,
+                query=jsonable_encoder(query),
+            )
 
         if response:
             for form_template in response:
@@ -243,6 +256,8 @@ class FormTemplates:
             query=query,
             data=jsonable_encoder(update_request),
         )
+        # Drop the cached copies on all the replicas
+        await FormTemplates.cache.invalidate_query(query)
 
         if update_response.modified_count == 0:
             raise HTTPException(
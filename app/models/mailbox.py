@@ -20,6 +20,7 @@ from fastapi import HTTPException, status
 from fastapi.encoders import jsonable_encoder
 from pydantic import EmailStr, Field, StrictStr
 
+from app.data.indexes import MongoIndex, register_indexes
 from app.data.operations import DatabaseOperations
 from app.models.common import PyObjectId, SailBaseModel
 
@@ -70,6 +71,12 @@ class GetMultipleMailboxes_Out(SailBaseModel):
 class Mailboxes:
     DB_COLLECTION_MAILBOXES = "mailboxes"
     data_service = DatabaseOperations()
+    DB_INDEXES = register_indexes(
+        DB_COLLECTION_MAILBOXES,
+        [
+            MongoIndex(keys=[("user_id", 1)]),
+        ],
+    )
 
     @staticmethod
     async def create(
@@ -22,6 +22,7 @@ from pydantic import EmailStr, Field, StrictStr
 
 from app.data.operations import DatabaseOperations
 from app.models.common import PyObjectId, SailBaseModel
+from app.utils.entity_cache import EntityCache
 
 
 class ExportState(Enum):
@@ -75,6 +76,7 @@ class ExportData_Out(ExportData_Base):
 class Organizations:
     DB_COLLECTION_ORGANIZATION = "organizations"
     data_service = DatabaseOperations()
+    cache = EntityCache(DB_COLLECTION_ORGANIZATION)
 
     @staticmethod
     async def create(
@@ -99,10 +101,14 @@ class Organizations:
         if organization_id:
             query["_id"] = str(organization_id)
 
-        response = await Organizations.data_service.find_by_query(
-            collection=Organizations.DB_COLLECTION_ORGANIZATION,
-            query=query,
-        )
+        if "_id" in query:
+            # The reads by id are served from the cache, these are made on almost every request
+            response = await Organizations.cache.find_by_id(jsonable_encoder(query))
+        else:
+            response = await Organizations.data_service.find_by_query(
+                collection=Organizations.DB_COLLECTION_ORGANIZATION,
+                query=query,
+            )
 
         if response:
             for organization in response:
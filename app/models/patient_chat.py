@@ -15,15 +15,17 @@
 
 from datetime import datetime
 from enum import Enum
-from typing import Dict, List, Optional
+from typing import Dict, List, Optional, Tuple
 
 from fastapi import HTTPException, status
 from fastapi.encoders import jsonable_encoder
 from pydantic import Field, StrictStr
 
+from app.data.indexes import MongoIndex, reconcile_collection_indexes, register_indexes
 from app.data.operations import DatabaseOperations
 from app.models.common import PyObjectId, SailBaseModel
 from app.models.content_generation_template import Context
+from app.models.form_data import FormDatas, FormDataState, GetFormData_Out
 from app.utils.secrets import secret_store
 
 
@@ -47,6 +49,9 @@ class PatientChat_Db(PatientChat_Base):
     creation_time: datetime = Field(default_factory=datetime.utcnow)
     updated_time: Optional[datetime] = Field(default_factory=datetime.utcnow)
     chat: Optional[List[Context]] = Field(default=None)
+    # Rolling summary of the oldest messages of the chat, which are no longer sent to the model verbatim
+    summary: Optional[StrictStr] = Field(default=None)
+    summarized_messages: int = Field(default=0)
 
 
 # class Context(SailBaseModel):
@@ -99,6 +104,13 @@ class PatientChatTemplates:
 class PatientChat:
     DB_PATIENT_CHAT = "patient-chat"
     data_service = DatabaseOperations()
+    DB_INDEXES = register_indexes(
+        DB_PATIENT_CHAT,
+        [
+            MongoIndex(keys=[("user_id", 1), ("form_data_id", 1)], unique=True),
+            MongoIndex(keys=[("user_id", 1), ("organization_id", 1), ("updated_time", -1)]),
+        ],
+    )
 
     @staticmethod
     async def create(
@@ -126,9 +138,7 @@ class PatientChat:
         # await PatientChatTemplates.create(template)
 
         # Add Indexes
-        await PatientChat.data_service.create_index(
-            collection=PatientChat.DB_PATIENT_CHAT, index=[("user_id", 1), ("form_data_id", 1)], unique=True
-        )
+        await reconcile_collection_indexes(collection=PatientChat.DB_PATIENT_CHAT, indexes=PatientChat.DB_INDEXES)
 
     @staticmethod
     async def get_chat(
@@ -181,6 +191,66 @@ class PatientChat:
         )
         return [PatientChat_Db(**chat) for chat in chats]
 
+    @staticmethod
+    async def get_chats_with_form_data(
+        user_id: PyObjectId,
+        organization_id: PyObjectId,
+        skip: int = 0,
+        limit: int = 1000,
+    ) -> Tuple[List[GetFormData_Out], int]:
+        # The page of chats joined with their form data and the total number of chats, in a single query. The chats
+        # of deleted form data are counted but not listed.
+        response = await PatientChat.data_service.aggregate(
+            collection=PatientChat.DB_PATIENT_CHAT,
+            pipeline=[
+                {"$match": {"user_id": str(user_id), "organization_id": str(organization_id)}},
+                {
+                    "$facet": {
+                        "form_data": [
+                            {"$sort": {"updated_time": -1}},
+                            {"$skip": skip},
+                            {"$limit": limit},
+                            {
+                                "$lookup": {
+                                    "from": FormDatas.DB_COLLECTION_FORM_DATA,
+                                    "let": {"form_data_id": "$form_data_id"},
+                                    "pipeline": [
+                                        {
+                                            "$match": {
+                                                "$expr": {"$eq": ["$_id", "$$form_data_id"]},
+                                                "state": FormDataState.ACTIVE.value,
+                                            }
+                                        },
+                                        # Only the fields of the list view
+                                        {
+                                            "$project": {
+                                                "_id": 0,
+                                                "id": "$_id",
+                                                "form_template_id": 1,
+                                                "values": 1,
+                                                "state": 1,
+                                                "themes": 1,
+                                                "metadata": 1,
+                                                "creation_time": 1,
+                                            }
+                                        },
+                                    ],
+                                    "as": "form_data",
+                                }
+                            },
+                            {"$unwind": "$form_data"},
+                            {"$replaceRoot": {"newRoot": "$form_data"}},
+                        ],
+                        "count": [{"$count": "count"}],
+                    }
+                },
+            ],
+        )
+        result = response[0]
+        form_data = [GetFormData_Out(**form) for form in result["form_data"]]
+        count = result["count"][0]["count"] if result["count"] else 0
+        return form_data, count
+
     @staticmethod
     async def get_chat_by_id(
         chat_id: PyObjectId,
@@ -202,6 +272,8 @@ class PatientChat:
     ):
         update_request = {"$set": {}}
         update_request["$set"]["chat"] = patient_chat.chat
+        update_request["$set"]["summary"] = patient_chat.summary
+        update_request["$set"]["summarized_messages"] = patient_chat.summarized_messages
         update_request["$set"]["updated_time"] = datetime.utcnow()
         return await PatientChat.data_service.update_one(
             collection=PatientChat.DB_PATIENT_CHAT,
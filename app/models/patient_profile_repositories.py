@@ -23,6 +23,7 @@ from pydantic import Field, StrictStr
 from app.data.operations import DatabaseOperations
 from app.models.common import PyObjectId, SailBaseModel
 from app.models.form_templates import CardLayout
+from app.utils.entity_cache import EntityCache
 
 
 class PatientProfileRepositoryState(Enum):
@@ -72,6 +73,7 @@ class UpdatePatientProfileRepository_In(SailBaseModel):
 class PatientProfileRepositories:
     DB_COLLECTION_PATIENT_PROFILE_REPOSITORY = "patient-profile-repository"
     data_service = DatabaseOperations()
+    cache = EntityCache(DB_COLLECTION_PATIENT_PROFILE_REPOSITORY)
 
     @staticmethod
     async def create(
@@ -102,10 +104,14 @@ class PatientProfileRepositories:
         # Read only active patient profile repositories
         query["state"] = PatientProfileRepositoryState.ACTIVE.value
 
-        response = await PatientProfileRepositories.data_service.find_by_query(
-            collection=PatientProfileRepositories.DB_COLLECTION_PATIENT_PROFILE_REPOSITORY,
-            query=jsonable_encoder(query),
-        )
+        if "_id" in query:
+            # The reads by id are served from the cache, these are made on almost every request
+            response = await PatientProfileRepositories.cache.find_by_id(jsonable_encoder(query))
+        else:
+            response = await PatientProfileRepositories.data_service.find_by_query(
+                collection=PatientProfileRepositories.DB_COLLECTION_PATIENT_PROFILE_REPOSITORY,
+                query=jsonable_encoder(query),
+            )
 
         if response:
             for patient_profile_repository in response:
@@ -145,6 +151,8 @@ class PatientProfileRepositories:
             query=query,
             data=jsonable_encoder(update_request),
         )
+        # Drop the cached copies on all the replicas
+        await PatientProfileRepositories.cache.invalidate_query(query)
 
         if update_response.modified_count == 0:
             raise HTTPException(
@@ -21,6 +21,7 @@ from fastapi import HTTPException, status
 from fastapi.encoders import jsonable_encoder
 from pydantic import Field, StrictStr
 
+from app.data.indexes import MongoIndex, register_indexes
 from app.data.operations import DatabaseOperations
 from app.models.common import PyObjectId, SailBaseModel
 
@@ -106,6 +107,13 @@ class PostTagUpdate(SailBaseModel):
 class SearchHistory:
     DB_COLLECTION_SEARCH_HISTORY = "search_history"
     data_service = DatabaseOperations()
+    DB_INDEXES = register_indexes(
+        DB_COLLECTION_SEARCH_HISTORY,
+        [
+            MongoIndex(keys=[("user_id", 1), ("search_time", -1)]),
+            MongoIndex(keys=[("organization_id", 1), ("search_time", -1)]),
+        ],
+    )
 
     @staticmethod
     async def create(
@@ -166,6 +174,12 @@ class SearchHistory:
 class RedditPosts:
     DB_COLLECTION_REDDIT_POSTS = "reddit_posts"
     data_service = DatabaseOperations()
+    DB_INDEXES = register_indexes(
+        DB_COLLECTION_REDDIT_POSTS,
+        [
+            MongoIndex(keys=[("organization_id", 1), ("status", 1), ("added_time", -1)]),
+        ],
+    )
 
     @staticmethod
     async def create(
@@ -0,0 +1,117 @@
+# -------------------------------------------------------------------------------
+# Engineering
+# content_generation.py
+# -------------------------------------------------------------------------------
+"""Leased worker pool generating the queued content"""
+# -------------------------------------------------------------------------------
+# Copyright (C) 2024 Array Insights, Inc. All Rights Reserved.
+# Private and Confidential. Internal Use Only.
+#     This software contains proprietary information which shall not
+#     be reproduced or transferred to other documents and shall not
+#     be disclosed to others for any purpose without
+#     prior written permission of Array Insights, Inc.
+# -------------------------------------------------------------------------------
+
+import asyncio
+import os
+import traceback
+from typing import Dict, List
+
+from app.models.content_generation import ContentGeneration_Db, ContentGenerations, ContentGenerationState
+from app.models.content_generation_template import ContentGenerationTemplates, Context
+from app.utils import log_manager
+from app.utils.azure_openai import OpenAiGenerator, OpenAiPriority
+from app.utils.secrets import secret_store
+
+# Number of generations running at the same time in this instance of the service
+CONTENT_GENERATION_CONCURRENCY = int(os.getenv("CONTENT_GENERATION_CONCURRENCY", "4"))
+# A claimed record goes back to the queue if it is not completed before the lease expires
+CONTENT_GENERATION_LEASE_SECONDS = int(os.getenv("CONTENT_GENERATION_LEASE_SECONDS", "300"))
+CONTENT_GENERATION_MAX_ATTEMPTS = 3
+CONTENT_GENERATION_IDLE_SECONDS = 1
+CONTENT_GENERATION_RECOVERY_SECONDS = 60
+
+
+async def build_messages(content_generation: ContentGeneration_Db) -> List[Dict]:
+    content_generation_template = await ContentGenerationTemplates.read(
+        content_generation_template_id=content_generation.template_id
+    )
+
+    messages = content_generation_template[0].context
+    prompt = content_generation_template[0].prompt.format(**content_generation.values)
+
+    messages.append(Context(role="user", content=prompt))
+    return [message.dict() for message in messages]
+
+
+async def generate_content(content_generation: ContentGeneration_Db):
+    try:
+        messages = await build_messages(content_generation)
+
+        openai = OpenAiGenerator(secret_store.OPENAI_API_BASE, secret_store.OPENAI_API_KEY)
+        generated_content = await openai.get_response(messages=messages, priority=OpenAiPriority.NORMAL)
+
+        completed = await ContentGenerations.complete_claim(
+            content_generation_id=content_generation.id,
+            lease_id=content_generation.lease_id,
+            state=ContentGenerationState.DONE,
+            generated_content=generated_content,
+        )
+    except Exception as exception:
+        completed = await ContentGenerations.complete_claim(
+            content_generation_id=content_generation.id,
+            lease_id=content_generation.lease_id,
+            state=ContentGenerationState.ERROR,
+            error_message=str(exception),
+        )
+
+    if not completed:
+        log_manager.WARNING(
+            {"message": f"Lease of content generation {content_generation.id} expired before it was completed"}
+        )
+
+
+async def content_generation_worker(worker_id: int):
+    while True:
+        try:
+            content_generation = await ContentGenerations.claim(lease_seconds=CONTENT_GENERATION_LEASE_SECONDS)
+            if not content_generation:
+                await asyncio.sleep(CONTENT_GENERATION_IDLE_SECONDS)
+                continue
+
+            await generate_content(content_generation)
+        except Exception as exception:
+            log_manager.ERROR(
+                {
+                    "message": f"Error: in content generation worker {worker_id}: {exception}",
+                    "stack_trace": f"{traceback.format_exc()}",
+                }
+            )
+            await asyncio.sleep(10)
+
+
+async def recover_expired_leases():
+    # Every instance runs this, the updates are idempotent so there is no need for a lock
+    while True:
+        try:
+            recovered = await ContentGenerations.recover_expired_leases(max_attempts=CONTENT_GENERATION_MAX_ATTEMPTS)
+            if recovered:
+                log_manager.WARNING({"message": f"Recovered {recovered} content generations with an expired lease"})
+        except Exception as exception:
+            log_manager.ERROR(
+                {
+                    "message": f"Error: while recovering content generation leases: {exception}",
+                    "stack_trace": f"{traceback.format_exc()}",
+                }
+            )
+        await asyncio.sleep(CONTENT_GENERATION_RECOVERY_SECONDS)
+
+
+async def run_content_generation():
+    log_manager.INFO(
+        {"message": f"Starting {CONTENT_GENERATION_CONCURRENCY} content generation workers"},
+    )
+    await asyncio.gather(
+        recover_expired_leases(),
+        *[content_generation_worker(worker_id) for worker_id in range(CONTENT_GENERATION_CONCURRENCY)],
+    )
@@ -0,0 +1,244 @@
+import asyncio
+import time
+import traceback
+from typing import Any, Dict, List, Optional, Tuple
+
+from fastapi.encoders import jsonable_encoder
+from pydantic import BaseModel
+from pymongo.errors import OperationFailure
+
+from app.data.operations import DatabaseOperations
+from app.models.etapestry_data import ETapestryDatas
+from app.models.form_data import FormDatas
+from app.models.patient_profile import PatientProfiles
+from app.utils import log_manager
+from app.utils.elastic_search import ElasticsearchClient
+from app.utils.lock_store import RedisLockStore
+
+# The resume token of every watched collection is stored here, keyed by the collection name
+SEARCH_INDEXER_STATE_COLLECTION = "search_indexer_state"
+# The changes elasticsearch keeps rejecting are recorded here, keyed by the index and the document id
+SEARCH_INDEXER_DEAD_LETTER_COLLECTION = "search_indexer_dead_letters"
+SEARCH_INDEXER_LOCK_EXPIRY = 60
+SEARCH_INDEXER_BATCH_SIZE = 500
+SEARCH_INDEXER_MAX_AWAIT_TIME_MS = 1000
+# A batch with failed documents is sent again this many times, backing off from SEARCH_INDEXER_RETRY_BACKOFF seconds
+SEARCH_INDEXER_MAX_RETRIES = 3
+SEARCH_INDEXER_RETRY_BACKOFF = 2
+# Without changes to index the resume token is still saved, at most this often
+SEARCH_INDEXER_IDLE_SAVE_SECONDS = 60
+
+# Mongo error codes for a resume token that has fallen off the oplog
+CHANGE_STREAM_HISTORY_LOST = 286
+CHANGE_STREAM_FATAL_ERROR = 280
+
+
+class SearchIndexSource(BaseModel):
+    collection: str
+    # The elasticsearch index of a document is the value of this field
+    index_field: str
+
+
+SEARCH_INDEX_SOURCES = [
+    SearchIndexSource(collection=FormDatas.DB_COLLECTION_FORM_DATA, index_field="form_template_id"),
+    SearchIndexSource(collection=PatientProfiles.DB_COLLECTION_PATIENT_PROFILES, index_field="repository_id"),
+    SearchIndexSource(collection=ETapestryDatas.DB_COLLECTION_ETAPESTRY_DATA, index_field="repository_id"),
+]
+
+
+def change_to_action(source: SearchIndexSource, change: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    # The documents are only ever soft deleted by the API, a hard delete does not carry the index name and
+    # a missing full document means it has been removed since the change, both are left to a reindex
+    document = change.get("fullDocument")
+    if not document or source.index_field not in document:
+        return None
+
+    index_name = str(document[source.index_field])
+    if document.get("state") == "DELETED":
+        return ElasticsearchClient.delete_action(index_name=index_name, id=str(document["_id"]))
+
+    return ElasticsearchClient.index_action(
+        index_name=index_name,
+        id=str(document["_id"]),
+        document=jsonable_encoder(document, exclude=set(["_id", "id"])),
+    )
+
+
+def is_retriable(error: Dict[str, Any]) -> bool:
+    # A failed chunk has no document, it and the throttled or server side errors are worth another try. Any other
+    # document error, a mapping conflict for one, fails the same way every time.
+    status = error.get("status")
+    return not error.get("id") or status is None or status == 429 or status >= 500
+
+
+async def save_dead_letters(source: SearchIndexSource, errors: List[Dict[str, Any]]):
+    # One record per document, the latest error of a document that keeps failing replaces the previous one
+    data_service = DatabaseOperations()
+    for error in errors:
+        await data_service.update_one(
+            collection=SEARCH_INDEXER_DEAD_LETTER_COLLECTION,
+            query={"_id": f"{error['index']}:{error['id']}"},
+            data={
+                "$set": {
+                    "collection": source.collection,
+                    "index": error["index"],
+                    "document_id": error["id"],
+                    "op_type": error.get("op_type"),
+                    "status": error.get("status"),
+                    "error": jsonable_encoder(error.get("error")),
+                    "updated_time": time.time(),
+                }
+            },
+            upsert=True,
+        )
+
+
+async def flush_changes(source: SearchIndexSource, batch: Dict[Tuple[str, str], Dict[str, Any]]):
+    async def actions(pending: Dict[Tuple[str, str], Dict[str, Any]]):
+        for action in pending.values():
+            yield action
+
+    elastic_client = ElasticsearchClient()
+    pending = batch
+    for attempt in range(SEARCH_INDEXER_MAX_RETRIES + 1):
+        if attempt:
+            await asyncio.sleep(SEARCH_INDEXER_RETRY_BACKOFF * 2 ** (attempt - 1))
+
+        result = await elastic_client.bulk(
+            actions(pending),
+            chunk_size=SEARCH_INDEXER_BATCH_SIZE,
+            concurrency=1,
+            max_reported_errors=len(pending),
+        )
+        if not result.failed:
+            return
+
+        # Only the failed documents are sent again, unless a whole chunk failed
+        if all(error.get("id") for error in result.errors):
+            pending = {(error["index"], error["id"]): pending[(error["index"], error["id"])] for error in result.errors}
+
+    if any(is_retriable(error) for error in result.errors):
+        # Most likely elasticsearch is down or overloaded. Raise so the batch is replayed from the last persisted
+        # resume token instead of being skipped.
+        raise Exception(f"Failed to index {result.failed} of the changes from {source.collection}: {result.errors[:1]}")
+
+    # The documents elasticsearch rejects are set aside so they do not hold back the rest of the changes
+    for error in result.errors:
+        log_manager.ERROR({"message": f"Failed to index change from {source.collection}", "error": error})
+    await save_dead_letters(source, result.errors)
+
+
+async def save_resume_token(source: SearchIndexSource, resume_token: Any):
+    data_service = DatabaseOperations()
+    await data_service.update_one(
+        collection=SEARCH_INDEXER_STATE_COLLECTION,
+        query={"_id": source.collection},
+        data={"$set": {"resume_token": resume_token, "updated_time": time.time()}},
+        upsert=True,
+    )
+
+
+async def index_collection_changes(source: SearchIndexSource, lock_name: str):
+    data_service = DatabaseOperations()
+    lock_store = RedisLockStore()
+
+    state = await data_service.find_one(
+        collection=SEARCH_INDEXER_STATE_COLLECTION,
+        query={"_id": source.collection},
+    )
+    resume_token = state["resume_token"] if state else None
+
+    change_stream = await data_service.get_change_stream(
+        collection_name=source.collection,
+        pipeline=[{"$match": {"operationType": {"$in": ["insert", "update", "replace"]}}}],
+        resume_token=resume_token,
+        full_document="updateLookup",
+        max_await_time_ms=SEARCH_INDEXER_MAX_AWAIT_TIME_MS,
+    )
+    log_manager.INFO({"message": f"Search indexer watching {source.collection}", "resumed": bool(resume_token)})
+
+    async with change_stream as stream:
+        # Keyed by (index, id) so that only the latest change of a document is sent in a batch
+        batch: Dict[Tuple[str, str], Dict[str, Any]] = {}
+        saved_resume_token = resume_token
+        last_save = time.monotonic()
+        last_lock_extension = time.monotonic()
+
+        while True:
+            # Waits at most SEARCH_INDEXER_MAX_AWAIT_TIME_MS and returns None if there are no new changes
+            change = await stream.try_next()
+            if change:
+                action = change_to_action(source, change)
+                if action:
+                    batch[(action["_index"], action["_id"])] = action
+
+            # The token of the last change, or the postBatchResumeToken when there were none. It keeps moving
+            # with the oplog, so a quiet collection does not resume from a token that has fallen off it.
+            if batch and (change is None or len(batch) >= SEARCH_INDEXER_BATCH_SIZE):
+                await flush_changes(source, batch)
+                batch = {}
+                saved_resume_token = stream.resume_token
+                await save_resume_token(source, saved_resume_token)
+                last_save = time.monotonic()
+            elif (
+                not batch
+                and stream.resume_token != saved_resume_token
+                and time.monotonic() - last_save > SEARCH_INDEXER_IDLE_SAVE_SECONDS
+            ):
+                saved_resume_token = stream.resume_token
+                await save_resume_token(source, saved_resume_token)
+                last_save = time.monotonic()
+
+            if time.monotonic() - last_lock_extension > SEARCH_INDEXER_LOCK_EXPIRY / 3:
+                if not await lock_store.extend(lock_name, SEARCH_INDEXER_LOCK_EXPIRY):
+                    raise Exception(f"Lost the search indexer lock for {source.collection}")
+                last_lock_extension = time.monotonic()
+
+
+async def run_collection_indexer(source: SearchIndexSource):
+    # Only one instance of the service indexes a collection at a time, the others wait for the lock
+    lock_store = RedisLockStore()
+    lock_name = f"search_indexer_{source.collection}"
+
+    while True:
+        lock_acquired = False
+        try:
+            lock_acquired = await lock_store.acquire(lock_name, expiry=SEARCH_INDEXER_LOCK_EXPIRY)
+            if not lock_acquired:
+                await asyncio.sleep(SEARCH_INDEXER_LOCK_EXPIRY / 2)
+                continue
+
+            await index_collection_changes(source, lock_name)
+        except OperationFailure as exception:
+            if exception.code in [CHANGE_STREAM_HISTORY_LOST, CHANGE_STREAM_FATAL_ERROR]:
+                # The changes since the saved token are gone, start from now. The index has to be rebuilt
+                # with the reindex endpoint to pick up what was missed.
+                log_manager.CRITICAL(
+                    {"message": f"Search indexer resume token for {source.collection} has expired, reindex needed"}
+                )
+                await DatabaseOperations().delete(
+                    collection=SEARCH_INDEXER_STATE_COLLECTION, query={"_id": source.collection}
+                )
+            else:
+                log_manager.ERROR(
+                    {
+                        "message": f"Error: while indexing changes from {source.collection}: {exception}",
+                        "stack_trace": f"{traceback.format_exc()}",
+                    }
+                )
+                await asyncio.sleep(10)
+        except Exception as exception:
+            log_manager.ERROR(
+                {
+                    "message": f"Error: while indexing changes from {source.collection}: {exception}",
+                    "stack_trace": f"{traceback.format_exc()}",
+                }
+            )
+            await asyncio.sleep(10)
+        finally:
+            if lock_acquired:
+                await lock_store.release(lock_name)
+
+
+async def run_search_indexer():
+    await asyncio.gather(*[run_collection_indexer(source) for source in SEARCH_INDEX_SOURCES])
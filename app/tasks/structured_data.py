@@ -1,6 +1,8 @@
+import asyncio
 import json
+import os
 import traceback
-from typing import Dict, List
+from typing import Dict, List, TypeVar
 
 from aio_pika.abc import AbstractIncomingMessage
 
@@ -15,13 +17,24 @@ from app.models.form_data import (
     VideoMetadata,
 )
 from app.utils import log_manager
-from app.utils.azure_openai import OpenAiGenerator
+from app.utils.azure_openai import OpenAiGenerator, OpenAiPriority
 from app.utils.lock_store import RedisLockStore
 from app.utils.secrets import secret_store
 from app.utils.transcribe_audio import transcribe_audio_from_id
 from app.utils.transcribe_image import describe_image_from_id
 from app.utils.transcribe_video import transcribe_video_from_id
 
+T = TypeVar("T")
+
+# Maximum number of attachments of each media type transcribed at the same time across all the forms. Videos
+# and audio are downloaded and converted with ffmpeg locally, the requests to the whisper and vision deployments
+# are limited separately by the OpenAiGenerator.
+MEDIA_SEMAPHORES = {
+    "VIDEO": asyncio.Semaphore(int(os.getenv("STRUCTURED_DATA_VIDEO_CONCURRENCY", "2"))),
+    "AUDIO": asyncio.Semaphore(int(os.getenv("STRUCTURED_DATA_AUDIO_CONCURRENCY", "4"))),
+    "IMAGE": asyncio.Semaphore(int(os.getenv("STRUCTURED_DATA_IMAGE_CONCURRENCY", "8"))),
+}
+
 
 async def generate_structured_data(metadata: FormDataMetadata, form_values: Dict):
     system_message = """
@@ -58,11 +71,41 @@ async def generate_structured_data(metadata: FormDataMetadata, form_values: Dict
 
     # generate structured data
     openai_generator = OpenAiGenerator(api_base=secret_store.OPENAI_API_BASE, api_key=secret_store.OPENAI_API_KEY)
-    structured_data = await openai_generator.get_response(messages=conversation, response_model=StructuredData)
+    structured_data = await openai_generator.get_response(
+        messages=conversation, response_model=StructuredData, priority=OpenAiPriority.BATCH
+    )
 
     return structured_data
 
 
+async def return_transcribed(attachment_metadata: T) -> T:
+    return attachment_metadata
+
+
+async def transcribe_video_attachment(form_data_id: PyObjectId, video_id: PyObjectId, file_name: str) -> VideoMetadata:
+    async with MEDIA_SEMAPHORES["VIDEO"]:
+        video_transcript = await transcribe_video_from_id(video_id, file_name)
+    video_metadata = VideoMetadata(video_id=video_id, transcript=video_transcript)
+    await FormDatas.add_attachment_metadata(form_data_id, video_metadata)
+    return video_metadata
+
+
+async def transcribe_audio_attachment(form_data_id: PyObjectId, audio_id: PyObjectId, file_name: str) -> AudioMetadata:
+    async with MEDIA_SEMAPHORES["AUDIO"]:
+        audio_transcript = await transcribe_audio_from_id(audio_id, file_name)
+    audio_metadata = AudioMetadata(audio_id=audio_id, transcript=audio_transcript)
+    await FormDatas.add_attachment_metadata(form_data_id, audio_metadata)
+    return audio_metadata
+
+
+async def describe_image_attachment(form_data_id: PyObjectId, image_id: PyObjectId) -> ImageMetadata:
+    async with MEDIA_SEMAPHORES["IMAGE"]:
+        image_description = await describe_image_from_id(image_id)
+    image_metadata = ImageMetadata(image_id=image_id, transcript=image_description)
+    await FormDatas.add_attachment_metadata(form_data_id, image_metadata)
+    return image_metadata
+
+
 async def on_generate_structured_data(message: AbstractIncomingMessage) -> None:
     log_manager.DEBUG({"message": "Received message to generate structured data for form data"})
     form_data_id = None
@@ -92,46 +135,50 @@ async def on_generate_structured_data(message: AbstractIncomingMessage) -> None:
                 transcribed_audio = {audio.audio_id: audio for audio in form_data.metadata.audio_metadata}
                 transcribed_image = {image.image_id: image for image in form_data.metadata.image_metadata}
 
-            # Generate metadata for audio, video and image that are not transcribed
+            # Transcribe the audio, video and image attachments that are not transcribed yet concurrently.
+            # Each transcription is saved as soon as it finishes so a retry only redoes the failed ones.
             form_metadata = FormDataMetadata()
             user_provided_data = {}
+            video_tasks = []
+            audio_tasks = []
+            image_tasks = []
             for data in form_data.values:
                 if form_data.values[data]["type"] == "VIDEO":
                     for video in form_data.values[data]["value"]:
                         video_id = PyObjectId(video["id"])
-                        if video_id in transcribed_video and form_data.metadata:
-                            form_metadata.video_metadata.append(transcribed_video[video_id])
+                        if video_id in transcribed_video:
+                            video_tasks.append(return_transcribed(transcribed_video[video_id]))
                             continue
-                        video_transcript = await transcribe_video_from_id(video_id, video["name"])
-                        form_metadata.video_metadata.append(
-                            VideoMetadata(video_id=video_id, transcript=video_transcript)
-                        )
+                        video_tasks.append(transcribe_video_attachment(form_data_id, video_id, video["name"]))
 
                 elif form_data.values[data]["type"] == "IMAGE":
                     for image in form_data.values[data]["value"]:
                         image_id = PyObjectId(image["id"])
                         if image_id in transcribed_image:
-                            form_metadata.image_metadata.append(transcribed_image[image_id])
+                            image_tasks.append(return_transcribed(transcribed_image[image_id]))
                             continue
-                        image_description = await describe_image_from_id(image_id)
-                        form_metadata.image_metadata.append(
-                            ImageMetadata(image_id=image_id, transcript=image_description)
-                        )
+                        image_tasks.append(describe_image_attachment(form_data_id, image_id))
 
                 elif form_data.values[data]["type"] == "AUDIO":
                     for audio in form_data.values[data]["value"]:
                         audio_id = PyObjectId(audio["id"])
                         if audio_id in transcribed_audio:
-                            form_metadata.audio_metadata.append(transcribed_audio[audio_id])
+                            audio_tasks.append(return_transcribed(transcribed_audio[audio_id]))
                             continue
-                        audio_transcript = await transcribe_audio_from_id(audio_id, audio["name"])
-                        form_metadata.audio_metadata.append(
-                            AudioMetadata(audio_id=audio_id, transcript=audio_transcript)
-                        )
+                        audio_tasks.append(transcribe_audio_attachment(form_data_id, audio_id, audio["name"]))
 
                 else:
                     user_provided_data[data] = form_data.values[data]["value"]
 
+            # Let every transcription finish before failing so the finished ones are all saved
+            results = await asyncio.gather(*video_tasks, *audio_tasks, *image_tasks, return_exceptions=True)
+            for result in results:
+                if isinstance(result, BaseException):
+                    raise result
+            form_metadata.video_metadata = results[: len(video_tasks)]
+            form_metadata.audio_metadata = results[len(video_tasks) : len(video_tasks) + len(audio_tasks)]
+            form_metadata.image_metadata = results[len(video_tasks) + len(audio_tasks) :]
+
             # After the audio, video and image metadata is generated, we can extract the structured data
             structured_data = await generate_structured_data(form_metadata, user_provided_data)
             # check if the structured data is a StructuredData object
@@ -0,0 +1,177 @@
+# -------------------------------------------------------------------------------
+# Engineering
+# audit_log.py
+# -------------------------------------------------------------------------------
+"""ASGI middleware recording an audit log entry for every request"""
+# -------------------------------------------------------------------------------
+# Copyright (C) 2024 Array Insights, Inc. All Rights Reserved.
+# Private and Confidential. Internal Use Only.
+#     This software contains proprietary information which shall not
+#     be reproduced or transferred to other documents and shall not
+#     be disclosed to others for any purpose without
+#     prior written permission of Array Insights, Inc.
+# -------------------------------------------------------------------------------
+
+import asyncio
+import json
+import random
+import re
+import time
+import traceback
+from typing import Any, Dict, List, Optional
+
+from starlette.datastructures import MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from app.utils import log_manager
+
+REDACTED = "****"
+# Values of any json key or form field with password in its name, for a json body cut short by the size cap. A string
+# may be cut short too, and an object or an array is redacted up to the end of the body.
+JSON_PASSWORD_PATTERN = re.compile(
+    rb'("[^"]*password[^"]*"\s*:\s*)(?:"(?:[^"\\]|\\.)*(?:"|$)|[{\[].*|[^\s,}\]]+)', re.IGNORECASE | re.DOTALL
+)
+FORM_PASSWORD_PATTERN = re.compile(rb"((?:^|&)[^=&]*password[^=&]*=)[^&]*", re.IGNORECASE)
+
+
+def redact_json(value: Any) -> Any:
+    # The whole value of a password key is redacted, whatever its type
+    if isinstance(value, dict):
+        return {key: REDACTED if "password" in str(key).lower() else redact_json(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [redact_json(item) for item in value]
+    return value
+
+
+def redact_body(content_type: str, body: bytes) -> str:
+    if content_type.startswith("application/json"):
+        try:
+            return json.dumps(redact_json(json.loads(body)))
+        except ValueError:
+            body = JSON_PASSWORD_PATTERN.sub(rb'\1"****"', body)
+    elif content_type.startswith("application/x-www-form-urlencoded"):
+        body = FORM_PASSWORD_PATTERN.sub(rb"\1****", body)
+    return body.decode("utf-8", errors="replace")
+
+
+class AuditLogMiddleware:
+    def __init__(
+        self,
+        app: ASGIApp,
+        max_body_size: int = 4096,
+        skip_body_paths: Optional[List[str]] = None,
+        skip_body_content_types: Optional[List[str]] = None,
+        sample_rates: Optional[Dict[str, float]] = None,
+        max_queue_size: int = 10000,
+    ):
+        # Paths match a configured prefix on whole segments, "/api/media" matches "/api/media/123" but not
+        # "/api/medias", and "/" only matches the root. Requests that are not sampled are still logged, without the
+        # body, if they fail.
+        self.app = app
+        self.max_body_size = max_body_size
+        self.skip_body_paths = skip_body_paths or []
+        self.skip_body_content_types = skip_body_content_types or []
+        self.sample_rates = sorted((sample_rates or {}).items(), key=lambda item: len(item[0]), reverse=True)
+        # The entries are formatted and written by a background task, off the path of the request
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=max_queue_size)
+        self.worker: Optional[asyncio.Task] = None
+        self.dropped = 0
+
+    @staticmethod
+    def path_matches(path: str, prefix: str) -> bool:
+        if path == prefix:
+            return True
+        # The root only matches itself, as a prefix it would match every path
+        prefix = prefix.rstrip("/")
+        return bool(prefix) and path.startswith(prefix + "/")
+
+    def sample_rate(self, path: str) -> float:
+        for prefix, rate in self.sample_rates:
+            if self.path_matches(path, prefix):
+                return rate
+        return 1.0
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        if self.worker is None:
+            self.worker = asyncio.create_task(self.write_entries())
+
+        path = scope["path"]
+        sampled = random.random() < self.sample_rate(path)
+        content_type = ""
+        for name, value in scope["headers"]:
+            if name == b"content-type":
+                content_type = value.decode("latin-1").lower()
+                break
+        capture_body = (
+            sampled
+            and not any(self.path_matches(path, prefix) for prefix in self.skip_body_paths)
+            and not any(content_type.startswith(skipped) for skipped in self.skip_body_content_types)
+        )
+
+        body = bytearray()
+        start_time = time.perf_counter()
+        status_code = 500
+        process_time = 0.0
+
+        async def receive_and_capture() -> Message:
+            message = await receive()
+            if capture_body and message["type"] == "http.request" and len(body) < self.max_body_size:
+                body.extend(message.get("body", b"")[: self.max_body_size - len(body)])
+            return message
+
+        async def send_with_process_time(message: Message):
+            nonlocal status_code, process_time
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                process_time = (time.perf_counter() - start_time) * 1000
+                MutableHeaders(scope=message).append("X-Process-Time", f"{process_time}ms")
+            await send(message)
+
+        try:
+            await self.app(scope, receive_and_capture, send_with_process_time)
+        finally:
+            if sampled or status_code >= 400:
+                self.enqueue(scope, content_type, bytes(body), status_code, process_time)
+
+    def enqueue(self, scope: Scope, content_type: str, body: bytes, status_code: int, process_time: float):
+        # The user is set on the request state by get_current_user, unauthenticated requests have none
+        token_data = scope.get("state", {}).get("token_data")
+        client = scope.get("client")
+        entry = {
+            "user_id": token_data.id if token_data else None,
+            "host": client[0] if client else None,
+            "method": scope["method"],
+            "url": scope["path"],
+            "content_type": content_type,
+            "request_body": body,
+            "response": status_code,
+            "response_time": process_time,
+        }
+        try:
+            self.queue.put_nowait(entry)
+        except asyncio.QueueFull:
+            # Rather lose audit entries than hold up the requests while the log output is backed up
+            self.dropped += 1
+
+    async def write_entries(self):
+        while True:
+            entry: Dict[str, Any] = await self.queue.get()
+            try:
+                content_type = entry.pop("content_type")
+                entry["user_id"] = str(entry["user_id"]) if entry["user_id"] else None
+                entry["request_body"] = redact_body(content_type, entry["request_body"])
+                if self.dropped:
+                    entry["dropped_entries"] = self.dropped
+                    self.dropped = 0
+                log_manager.INFO(entry)
+            except Exception as exception:
+                log_manager.ERROR(
+                    {
+                        "message": f"Error: while writing the audit log: {exception}",
+                        "stack_trace": f"{traceback.format_exc()}",
+                    }
+                )
@@ -1,27 +1,279 @@
-from typing import Any, Dict, List, Optional, Union
+import asyncio
+import hashlib
+import json
+import os
+import random
+import time
+from enum import Enum
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple, Union
 
-from openai import NOT_GIVEN, AsyncAzureOpenAI
+from openai import (
+    NOT_GIVEN,
+    APIConnectionError,
+    APIStatusError,
+    APITimeoutError,
+    AsyncAzureOpenAI,
+    InternalServerError,
+    RateLimitError,
+)
 from pydantic import BaseModel
+from redis.exceptions import RedisError
+
+from app.utils import log_manager
+from app.utils.metrics import timed, track_call
+from app.utils.rate_limiter import RedisRateLimiter
+from app.utils.redis_client import redis_client
+
+
+class OpenAiPriority(Enum):
+    # Interactive requests have a user waiting on them, batch requests are backfills and background processing
+    INTERACTIVE = "INTERACTIVE"
+    NORMAL = "NORMAL"
+    BATCH = "BATCH"
+
+
+# Share of the per minute budget each priority may use, the rest is left for the higher priorities
+OPENAI_PRIORITY_SHARE = {
+    OpenAiPriority.INTERACTIVE: 1.0,
+    OpenAiPriority.NORMAL: 0.8,
+    OpenAiPriority.BATCH: 0.5,
+}
+OPENAI_MAX_RETRIES = 5
+OPENAI_INITIAL_BACKOFF = 1
+OPENAI_MAX_BACKOFF = 60
+# Tokens reserved for the completion on top of the prompt, corrected with the actual usage after the call
+OPENAI_COMPLETION_TOKENS = 1000
+# Images are billed by their size which is not known here, this is the cost of a large image at high detail
+OPENAI_IMAGE_TOKENS = 1000
+
+
+def estimate_tokens(messages: List[Dict]) -> int:
+    # Roughly 4 characters per token for english text, good enough to pace the requests
+    characters = 0
+    images = 0
+    for message in messages:
+        if isinstance(message["content"], str):
+            characters += len(message["content"])
+            continue
+        for part in message["content"]:
+            if part["type"] == "text":
+                characters += len(part["text"])
+            else:
+                images += 1
+    return characters // 4 + images * OPENAI_IMAGE_TOKENS + OPENAI_COMPLETION_TOKENS
+
+
+def get_retry_after(exception: Exception) -> float:
+    if not isinstance(exception, APIStatusError):
+        return 0
+    headers = exception.response.headers
+    try:
+        if "retry-after-ms" in headers:
+            return float(headers["retry-after-ms"]) / 1000
+        if "retry-after" in headers:
+            return float(headers["retry-after"])
+    except ValueError:
+        pass
+    return 0
+
+
+class OpenAiResponseCache:
+    KEY_PREFIX = "openai_cache"
+
+    def __init__(self, ttl_seconds: int, max_entries: int):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        # Last access time of every entry, used to evict the least recently used ones once the cache is full
+        self.index_key = f"{self.KEY_PREFIX}:index"
+        # Hits and misses of all the instances of the service
+        self.stats_key = f"{self.KEY_PREFIX}:stats"
+
+    @staticmethod
+    def request_key(model: str, messages: Union[List[Dict], str], response_model: Optional[type[BaseModel]]) -> str:
+        # The schema is part of the key so that a change to the response model does not return stale responses
+        return hashlib.sha256(
+            json.dumps(
+                [model, messages, response_model.model_json_schema() if response_model else None],
+                sort_keys=True,
+                default=str,
+            ).encode()
+        ).hexdigest()
+
+    @timed("redis", "openai_cache_get")
+    async def get(self, key: str, response_model: Optional[type[BaseModel]]) -> Optional[Union[str, Any]]:
+        try:
+            cached = await redis_client.get(f"{self.KEY_PREFIX}:{key}")
+            async with redis_client.pipeline(transaction=False) as pipeline:
+                pipeline.hincrby(self.stats_key, "hits" if cached is not None else "misses", 1)
+                if cached is not None:
+                    pipeline.zadd(self.index_key, {key: time.time()})
+                await pipeline.execute()
+        except RedisError as exception:
+            log_manager.WARNING({"message": f"OpenAI response cache is not available: {exception}"})
+            return None
+
+        if cached is None:
+            return None
+        if response_model:
+            return response_model.model_validate_json(cached)
+        return json.loads(cached)
+
+    @timed("redis", "openai_cache_set")
+    async def set(self, key: str, response: Union[str, Any]):
+        value = response.model_dump_json() if isinstance(response, BaseModel) else json.dumps(response)
+        try:
+            async with redis_client.pipeline(transaction=False) as pipeline:
+                pipeline.set(f"{self.KEY_PREFIX}:{key}", value, ex=self.ttl_seconds)
+                pipeline.zadd(self.index_key, {key: time.time()})
+                pipeline.zcard(self.index_key)
+                entries = (await pipeline.execute())[-1]
+
+            if entries > self.max_entries:
+                evicted = await redis_client.zpopmin(self.index_key, entries - self.max_entries)
+                if evicted:
+                    await redis_client.delete(*[f"{self.KEY_PREFIX}:{evicted_key}" for evicted_key, _ in evicted])
+                    await redis_client.hincrby(self.stats_key, "evictions", len(evicted))
+        except RedisError as exception:
+            log_manager.WARNING({"message": f"OpenAI response cache is not available: {exception}"})
+
+    async def stats(self) -> Dict[str, int]:
+        stats = await redis_client.hgetall(self.stats_key)
+        return {
+            "hits": int(stats.get("hits", 0)),
+            "misses": int(stats.get("misses", 0)),
+            "evictions": int(stats.get("evictions", 0)),
+            "entries": await redis_client.zcard(self.index_key),
+        }
 
 
 class OpenAiGenerator:
     def __new__(cls, api_base, api_key) -> "OpenAiGenerator":
         if not hasattr(cls, "instance"):
-            cls.client = AsyncAzureOpenAI(azure_endpoint=api_base, api_key=api_key, api_version="2024-10-21")
+            # The retries are done here so that they go through the rate limiter
+            cls.client = AsyncAzureOpenAI(
+                azure_endpoint=api_base, api_key=api_key, api_version="2024-10-21", max_retries=0
+            )
             cls.model = "gpt-4o"
+            # Process wide limits on the concurrent requests to the whisper and vision deployments
+            cls.transcription_semaphore = asyncio.Semaphore(int(os.getenv("OPENAI_TRANSCRIPTION_CONCURRENCY", "4")))
+            cls.vision_semaphore = asyncio.Semaphore(int(os.getenv("OPENAI_VISION_CONCURRENCY", "8")))
+            # Budgets of the deployments, shared by all the instances of the service
+            cls.rate_limiters = {
+                cls.model: RedisRateLimiter(
+                    name=f"openai_{cls.model}",
+                    requests_per_minute=int(os.getenv("OPENAI_CHAT_REQUESTS_PER_MINUTE", "300")),
+                    tokens_per_minute=int(os.getenv("OPENAI_CHAT_TOKENS_PER_MINUTE", "50000")),
+                ),
+                "whisper": RedisRateLimiter(
+                    name="openai_whisper",
+                    requests_per_minute=int(os.getenv("OPENAI_WHISPER_REQUESTS_PER_MINUTE", "3")),
+                    tokens_per_minute=0,
+                ),
+            }
+            cls.response_cache = OpenAiResponseCache(
+                ttl_seconds=int(os.getenv("OPENAI_CACHE_TTL_SECONDS", str(7 * 24 * 60 * 60))),
+                max_entries=int(os.getenv("OPENAI_CACHE_MAX_ENTRIES", "100000")),
+            )
+            # Identical cacheable requests made at the same time share a single call to OpenAI, keyed by
+            # (request, priority)
+            cls.in_flight: Dict[Tuple[str, OpenAiPriority], asyncio.Future] = {}
             cls.instance = super(OpenAiGenerator, cls).__new__(cls)
         return cls.instance
 
+    async def _call_with_retries(self, deployment: str, call, tokens: int, priority: OpenAiPriority):
+        rate_limiter = self.rate_limiters[deployment]
+        backoff = OPENAI_INITIAL_BACKOFF
+        for attempt in range(OPENAI_MAX_RETRIES + 1):
+            window = await rate_limiter.acquire(tokens=tokens, share=OPENAI_PRIORITY_SHARE[priority])
+            try:
+                async with track_call("openai", deployment):
+                    response = await call()
+            except (RateLimitError, APITimeoutError, APIConnectionError, InternalServerError) as exception:
+                if attempt == OPENAI_MAX_RETRIES:
+                    raise
+                # Full jitter, but never sooner than the service asked for
+                delay = max(get_retry_after(exception), random.uniform(0, backoff))
+                log_manager.WARNING(
+                    {
+                        "message": f"OpenAI {deployment} request failed, retrying in {delay:.1f}s",
+                        "error": str(exception),
+                        "attempt": attempt + 1,
+                    }
+                )
+                await asyncio.sleep(delay)
+                backoff = min(backoff * 2, OPENAI_MAX_BACKOFF)
+                continue
+
+            usage = getattr(response, "usage", None)
+            if tokens and usage:
+                await rate_limiter.record_usage(window, tokens, usage.total_tokens)
+            return response, window
+
     async def get_response(
         self,
         messages: List[Dict],
         response_model: Optional[type[BaseModel]] = None,
+        priority: OpenAiPriority = OpenAiPriority.NORMAL,
+        use_cache: bool = False,
+        cache_key: Optional[str] = None,
     ) -> Union[str, Any]:
-        response = await self.client.beta.chat.completions.parse(
+        # Only deterministic uses of the model opt in to the cache, and only those share a call with identical
+        # requests made at the same time. The others are not expected to get the same response twice.
+        if not use_cache:
+            return await self._get_response(messages, response_model, priority)
+
+        # cache_key replaces the messages in the key when they hold something that changes between identical
+        # requests, like a signed url
+        key = OpenAiResponseCache.request_key(
             model=self.model,
-            messages=messages,  # type: ignore
-            stop=NOT_GIVEN,
-            response_format=response_model if response_model else NOT_GIVEN,
+            messages=cache_key if cache_key else messages,
+            response_model=response_model,
+        )
+
+        cached = await self.response_cache.get(key, response_model)
+        if cached is not None:
+            return cached
+
+        # Only a call of the same or a higher priority is joined, a batch call is throttled to a smaller share of
+        # the budget and would hold back an interactive caller waiting on it
+        in_flight = None
+        for joined_priority in OpenAiPriority:
+            if OPENAI_PRIORITY_SHARE[joined_priority] < OPENAI_PRIORITY_SHARE[priority]:
+                break
+            in_flight = self.in_flight.get((key, joined_priority))
+            if in_flight:
+                break
+
+        if not in_flight:
+            in_flight = asyncio.ensure_future(self._get_response(messages, response_model, priority))
+            self.in_flight[(key, priority)] = in_flight
+            in_flight.add_done_callback(lambda _: self.in_flight.pop((key, priority), None))
+
+        # Shielded so that a cancelled caller does not cancel the call for the others waiting on it
+        response = await asyncio.shield(in_flight)
+
+        # Refusals are not cached, they come back as a string instead of the response model
+        if not response_model or isinstance(response, response_model):
+            await self.response_cache.set(key, response)
+
+        return response
+
+    async def _get_response(
+        self,
+        messages: List[Dict],
+        response_model: Optional[type[BaseModel]],
+        priority: OpenAiPriority,
+    ) -> Union[str, Any]:
+        response, _ = await self._call_with_retries(
+            deployment=self.model,
+            call=lambda: self.client.beta.chat.completions.parse(
+                model=self.model,
+                messages=messages,  # type: ignore
+                stop=NOT_GIVEN,
+                response_format=response_model if response_model else NOT_GIVEN,
+            ),
+            tokens=estimate_tokens(messages),
+            priority=priority,
         )
 
         if not hasattr(response.choices[0], "message"):
@@ -39,19 +291,60 @@ class OpenAiGenerator:
         else:
             return response.choices[0].message.content
 
-    async def generate_transcript(self, audio_path: str) -> str:
+    async def stream_response(
+        self,
+        messages: List[Dict],
+        priority: OpenAiPriority = OpenAiPriority.INTERACTIVE,
+    ) -> AsyncIterator[str]:
+        # Yields the content as the model produces it. Only opening the stream is retried, a failure after the
+        # first token has been sent can not be hidden from the caller.
+        tokens = estimate_tokens(messages)
+        stream, window = await self._call_with_retries(
+            deployment=self.model,
+            call=lambda: self.client.chat.completions.create(
+                model=self.model,
+                messages=messages,  # type: ignore
+                stream=True,
+                stream_options={"include_usage": True},
+            ),
+            tokens=tokens,
+            priority=priority,
+        )
+
+        async for chunk in stream:
+            # The last chunk only carries the usage, azure also sends chunks with only the content filter results
+            if chunk.usage:
+                await self.rate_limiters[self.model].record_usage(window, tokens, chunk.usage.total_tokens)
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+
+    async def generate_transcript(self, audio_path: str, priority: OpenAiPriority = OpenAiPriority.NORMAL) -> str:
         with open(audio_path, "rb") as audio_file:
-            response = await self.client.audio.transcriptions.create(
-                model="whisper",
-                file=audio_file,
-            )
+            async with self.transcription_semaphore:
+
+                async def transcribe():
+                    # The file is read again from the start on a retry
+                    audio_file.seek(0)
+                    return await self.client.audio.transcriptions.create(
+                        model="whisper",
+                        file=audio_file,
+                    )
+
+                response, _ = await self._call_with_retries(
+                    deployment="whisper", call=transcribe, tokens=0, priority=priority
+                )
 
             if not hasattr(response, "text"):
                 raise Exception("No transcription from OpenAI. Response: ", response)
 
             return response.text
 
-    async def describe_image(self, image_url: str) -> str:
+    async def describe_image(
+        self,
+        image_url: str,
+        priority: OpenAiPriority = OpenAiPriority.NORMAL,
+        cache_key: Optional[str] = None,
+    ) -> str:
         prompt = [
             {
                 "role": "user",
@@ -67,7 +360,8 @@ class OpenAiGenerator:
             }
         ]
 
-        return await self.get_response(prompt)
+        async with self.vision_semaphore:
+            return await self.get_response(prompt, priority=priority, use_cache=bool(cache_key), cache_key=cache_key)
 
 
 # test the OpenAiGenerator
@@ -88,6 +382,4 @@ async def test_openai_generator():
 
 
 if __name__ == "__main__":
-    import asyncio
-
     asyncio.run(test_openai_generator())
@@ -12,30 +12,21 @@
 #     prior written permission of Array Insights, Inc.
 # -------------------------------------------------------------------------------
 
-from typing import Dict
-
-from app import data
 from app.data.operations import DatabaseOperations
 from app.models.common import BasicObjectInfo, PyObjectId
-
-GLOBAL_CACHE: Dict[PyObjectId, BasicObjectInfo] = {}
+from app.utils.entity_cache import EntityCache
 
 DB_COLLECTION_USERS = "users"
 
 
 async def get_basic_object(id: PyObjectId, collection_name: str) -> BasicObjectInfo:
-    if id in GLOBAL_CACHE:
-        return GLOBAL_CACHE[id]
-    else:
-        # Get the user from the database
-        data_service = DatabaseOperations()
-        object = await data_service.find_one(collection_name, {"_id": str(id)})
-        if not object:
-            raise Exception(f"{str(id)} in {collection_name} not found")
-        basic_object = BasicObjectInfo(id=id, name=object["name"])
-        # Add the user to the cache
-        GLOBAL_CACHE[id] = basic_object
-    return basic_object
+    # Shares the cache of the collection, so the updates made through the models invalidate it
+    object = await EntityCache(collection_name).get(
+        id, lambda: DatabaseOperations().find_one(collection_name, {"_id": str(id)})
+    )
+    if not object:
+        raise Exception(f"{str(id)} in {collection_name} not found")
+    return BasicObjectInfo(id=id, name=object["name"])
 
 
 async def get_basic_user(id: PyObjectId) -> BasicObjectInfo:
@@ -0,0 +1,84 @@
+# -------------------------------------------------------------------------------
+# Engineering
+# chat_context.py
+# -------------------------------------------------------------------------------
+"""Keep the context sent to the model for a patient chat within a token budget"""
+# -------------------------------------------------------------------------------
+# Copyright (C) 2024 Array Insights, Inc. All Rights Reserved.
+# Private and Confidential. Internal Use Only.
+#     This software contains proprietary information which shall not
+#     be reproduced or transferred to other documents and shall not
+#     be disclosed to others for any purpose without
+#     prior written permission of Array Insights, Inc.
+# -------------------------------------------------------------------------------
+
+import os
+from typing import Dict, List
+
+from app.models.content_generation_template import Context
+from app.models.patient_chat import PatientChat_Db
+from app.utils.azure_openai import OpenAiGenerator, OpenAiPriority, estimate_tokens
+from app.utils.secrets import secret_store
+
+# Tokens of the prompt, including the reserve for the completion
+PATIENT_CHAT_CONTEXT_TOKENS = int(os.getenv("PATIENT_CHAT_CONTEXT_TOKENS", "16000"))
+# Number of the most recent messages always sent verbatim, as long as they fit in the budget
+PATIENT_CHAT_RECENT_MESSAGES = int(os.getenv("PATIENT_CHAT_RECENT_MESSAGES", "8"))
+
+SUMMARY_PROMPT = """
+    You summarize a conversation between a user and an assistant about a patient. Keep the requests of the user,
+    the decisions made and the facts established, in particular anything the user asked to change or avoid.
+    Do not repeat the patient information, it is provided separately. Be concise.
+"""
+
+
+async def summarize(summary: str, messages: List[Context]) -> str:
+    conversation = "\n\n".join(f"{message.role}: {message.content}" for message in messages)
+    if summary:
+        conversation = f"Summary of the conversation so far:\n{summary}\n\nContinuation:\n{conversation}"
+
+    openai = OpenAiGenerator(secret_store.OPENAI_API_BASE, secret_store.OPENAI_API_KEY)
+    # Cached, so that the same window is only summarized once even if the chat fails to be saved
+    return await openai.get_response(
+        messages=[
+            {"role": "system", "content": SUMMARY_PROMPT},
+            {"role": "user", "content": conversation},
+        ],
+        priority=OpenAiPriority.INTERACTIVE,
+        use_cache=True,
+    )
+
+
+def context_messages(system_prompt: str, chat: PatientChat_Db, start: int, query: str) -> List[Dict]:
+    # The first message of the chat holds the patient facts, the history starts after it
+    context = [Context(role="system", content=system_prompt), chat.chat[0]]
+    if chat.summary:
+        context.append(Context(role="system", content=f"Summary of the earlier conversation:\n{chat.summary}"))
+    context.extend(chat.chat[1 + start :])
+    context.append(Context(role="user", content=query))
+    return [message.dict() for message in context]
+
+
+async def build_chat_context(system_prompt: str, chat: PatientChat_Db, query: str) -> List[Dict]:
+    # Sends the system prompt, the patient facts, a summary of the older messages and the most recent messages.
+    # The summary on the chat is updated when messages leave the window, the caller saves it with the chat.
+    # The older messages are summarized in chunks, once twice PATIENT_CHAT_RECENT_MESSAGES are not summarized yet,
+    # so that most turns do not wait on a summary before the answer starts streaming.
+    history = chat.chat[1:]
+
+    start = chat.summarized_messages
+    if len(history) - start > 2 * PATIENT_CHAT_RECENT_MESSAGES:
+        start = len(history) - PATIENT_CHAT_RECENT_MESSAGES
+    # Drop more of the history if the recent messages alone are over the budget, but always keep the last exchange
+    while start < len(history) - 2:
+        if estimate_tokens(context_messages(system_prompt, chat, start, query)) <= PATIENT_CHAT_CONTEXT_TOKENS:
+            break
+        start += 2
+    # Windows start on a question, so that an answer is never separated from it
+    start += start % 2
+
+    if start > chat.summarized_messages:
+        chat.summary = await summarize(chat.summary or "", history[chat.summarized_messages : start])
+        chat.summarized_messages = start
+
+    return context_messages(system_prompt, chat, start, query)
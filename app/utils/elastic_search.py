@@ -1,4 +1,20 @@
-from elasticsearch import AsyncElasticsearch
+import asyncio
+from typing import Any, AsyncIterable, Dict, List
+
+from elasticsearch import AsyncElasticsearch, helpers
+from pydantic import BaseModel, Field
+
+from app.utils.metrics import timed
+
+
+class BulkIndexResult(BaseModel):
+    total: int = Field(default=0)
+    failed: int = Field(default=0)
+    errors: List[Dict[str, Any]] = Field(default=[])
+
+    @property
+    def succeeded(self) -> int:
+        return self.total - self.failed
 
 
 class ElasticsearchClient:
@@ -12,6 +28,7 @@ class ElasticsearchClient:
             cls.client = AsyncElasticsearch(hosts=cloud_endpoint, basic_auth=("elastic", password))
         return cls._instance
 
+    @timed("elasticsearch", "create_index")
     async def create_index(self, index_name: str, raise_on_already_exist: bool = False):
         resp = await self.client.indices.exists(index=index_name)
         if resp:
@@ -25,10 +42,12 @@ class ElasticsearchClient:
 
         return resp
 
+    @timed("elasticsearch", "index_exists")
     async def index_exists(self, index_name: str):
         resp = await self.client.indices.exists(index=index_name)
         return resp
 
+    @timed("elasticsearch", "delete_index")
     async def delete_index(self, index_name: str):
         resp = await self.client.indices.exists(index=index_name)
         if not resp:
@@ -38,24 +57,29 @@ class ElasticsearchClient:
         resp = await self.client.indices.delete(index=index_name)
         return resp
 
+    @timed("elasticsearch", "insert_document")
     async def insert_document(self, index_name: str, id: str, document: dict):
         resp = await self.client.index(index=index_name, document=document, id=id)
         return resp
 
+    @timed("elasticsearch", "delete_document")
     async def delete_document(self, index_name: str, id: str):
         resp = await self.client.delete(index=index_name, id=id)
         return resp
 
+    @timed("elasticsearch", "search")
     async def search(self, index_name: str, search_query: str, size: int = 10, skip: int = 0):
         resp = await self.client.search(
             index=index_name, size=size, from_=skip, query={"query_string": {"query": search_query}}
         )
         return resp
 
+    @timed("elasticsearch", "update_document")
     async def update_document(self, index_name: str, id: str, document: dict):
         resp = await self.client.index(index=index_name, document=document, id=id)
         return resp
     
+    @timed("elasticsearch", "get_document")
     async def get_document(self, index_name: str, id: str):
         try:
             resp = await self.client.get(index=index_name, id=id)
@@ -64,6 +88,115 @@ class ElasticsearchClient:
             print(f"Error retrieving document with id {id} from index {index_name}: {e}")
             return None
 
+    @timed("elasticsearch", "run_aggregation_query")
     async def run_aggregation_query(self, index_name: str, query: dict):
         resp = await self.client.search(index=index_name, size=0, body=query)  # type: ignore
         return resp
+
+    @staticmethod
+    def index_action(index_name: str, id: str, document: dict) -> Dict[str, Any]:
+        return {"_op_type": "index", "_index": index_name, "_id": id, "_source": document}
+
+    @staticmethod
+    def delete_action(index_name: str, id: str) -> Dict[str, Any]:
+        return {"_op_type": "delete", "_index": index_name, "_id": id}
+
+    @timed("elasticsearch", "bulk")
+    async def bulk(
+        self,
+        actions: AsyncIterable[Dict[str, Any]],
+        chunk_size: int = 500,
+        concurrency: int = 4,
+        max_retries: int = 5,
+        initial_backoff: float = 2,
+        max_backoff: float = 60,
+        max_reported_errors: int = 100,
+    ) -> BulkIndexResult:
+        # The actions are fanned out to `concurrency` streaming bulk workers through a bounded queue, so the
+        # source is only read as fast as elasticsearch accepts the chunks. Documents rejected with a 429 are
+        # retried with an exponential backoff by the helper, every other failure is reported per document.
+        result = BulkIndexResult()
+        queue: asyncio.Queue = asyncio.Queue(maxsize=chunk_size * concurrency)
+        # Workers still taking actions from the queue, the source is only read while there is one left
+        live_workers = [concurrency]
+
+        def add_error(error: Dict[str, Any], count: int = 1):
+            result.failed += count
+            if len(result.errors) < max_reported_errors:
+                result.errors.append(error)
+
+        async def produce():
+            try:
+                async for action in actions:
+                    await queue.put(action)
+            finally:
+                # Wake up the workers left, a worker that failed no longer reads the queue
+                for _ in range(live_workers[0]):
+                    await queue.put(None)
+
+        async def queued_actions(taken: List[int]):
+            while True:
+                action = await queue.get()
+                if action is None:
+                    return
+                result.total += 1
+                taken[0] += 1
+                yield action
+
+        async def consume():
+            # Actions taken from the queue and actions the helper reported on, the difference is the chunk in flight
+            taken = [0]
+            reported = 0
+            try:
+                async for ok, item in helpers.async_streaming_bulk(
+                    self.client,
+                    queued_actions(taken),
+                    chunk_size=chunk_size,
+                    max_retries=max_retries,
+                    initial_backoff=initial_backoff,
+                    max_backoff=max_backoff,
+                    raise_on_error=False,
+                    raise_on_exception=False,
+                ):
+                    reported += 1
+                    if ok:
+                        continue
+                    op_type, info = next(iter(item.items()))
+                    # Deleting a document that is already gone is not an error
+                    if op_type == "delete" and info.get("status") == 404:
+                        continue
+                    add_error(
+                        {
+                            "op_type": op_type,
+                            "index": info.get("_index"),
+                            "id": info.get("_id"),
+                            "status": info.get("status"),
+                            "error": info.get("error"),
+                        }
+                    )
+            except Exception as exception:
+                # None of the actions of the failed chunk were reported, they all count as failed. The rest of the
+                # queue is left to the other workers.
+                add_error({"error": str(exception)}, count=max(taken[0] - reported, 1))
+                live_workers[0] -= 1
+                if live_workers[0] == 0:
+                    producer.cancel()
+
+        producer = asyncio.create_task(produce())
+        await asyncio.gather(*[consume() for _ in range(concurrency)])
+        await asyncio.wait([producer])
+
+        # With every worker gone the actions already read from the source were never sent
+        unsent = 0
+        while not queue.empty():
+            if queue.get_nowait() is not None:
+                unsent += 1
+        if unsent:
+            result.total += unsent
+            add_error({"error": "Every bulk worker failed, the remaining actions were not sent"}, count=unsent)
+
+        # An error reading the source is raised once the workers are done with what was queued
+        if not producer.cancelled():
+            producer.result()
+
+        return result
@@ -1,10 +1,10 @@
 from typing import List, Optional, Union
 
-import aiohttp
 from azure.communication.email.aio import EmailClient
 from pydantic import BaseModel, validator
 from tenacity import retry, stop_after_attempt, wait_fixed
 
+from app.utils.http_clients import Upstream, http_clients
 from app.utils.secrets import secret_store
 
 
@@ -112,13 +112,13 @@ class OutlookClient:
             "code": code,
             "scope": "Mail.Read Mail.Send",
         }
-        async with aiohttp.ClientSession() as session:
-            async with session.post(self.token_url, data=token_data) as response:
-                token_response = await response.json()
-                self.token = token_response.get("access_token")
-                self.refresh_token = token_response.get("refresh_token")
-                if not self.token:
-                    raise Exception("Authorization failed. Invalid code. Message: " + str(token_response))
+        session = http_clients.get(Upstream.OUTLOOK)
+        async with session.post(self.token_url, data=token_data) as response:
+            token_response = await response.json()
+            self.token = token_response.get("access_token")
+            self.refresh_token = token_response.get("refresh_token")
+            if not self.token:
+                raise Exception("Authorization failed. Invalid code. Message: " + str(token_response))
 
     @retry(stop=stop_after_attempt(3), wait=wait_fixed(5), reraise=True)
     async def connect_with_refresh_token(self, refresh_token: str):
@@ -134,13 +134,13 @@ class OutlookClient:
             "refresh_token": refresh_token,
             "scope": "Mail.Read Mail.Send",
         }
-        async with aiohttp.ClientSession() as session:
-            async with session.post(self.token_url, data=token_data) as response:
-                token_response = await response.json()
-                self.token = token_response.get("access_token")
-                self.refresh_token = token_response.get("refresh_token")
-                if not self.token:
-                    raise Exception("Authorization failed. Invalid code. Message: " + str(token_response))
+        session = http_clients.get(Upstream.OUTLOOK)
+        async with session.post(self.token_url, data=token_data) as response:
+            token_response = await response.json()
+            self.token = token_response.get("access_token")
+            self.refresh_token = token_response.get("refresh_token")
+            if not self.token:
+                raise Exception("Authorization failed. Invalid code. Message: " + str(token_response))
 
     async def reauthenticate(self):
         if not self.refresh_token:
@@ -159,9 +159,9 @@ class OutlookClient:
         endpoint_url = f"{self.resource_url}/{self.api_version}/me"
         headers = {"Authorization": f"Bearer {self.token}"}
 
-        async with aiohttp.ClientSession() as session:
-            async with session.get(endpoint_url, headers=headers) as response:
-                return await response.json()
+        session = http_clients.get(Upstream.OUTLOOK)
+        async with session.get(endpoint_url, headers=headers) as response:
+            return await response.json()
 
     @retry(stop=stop_after_attempt(3), wait=wait_fixed(5), reraise=True)
     async def reply_email(self, email_id: str, message: MessageResponse):
@@ -172,12 +172,12 @@ class OutlookClient:
         headers = {"Authorization": f"Bearer {self.token}", "Content-Type": "application/json"}
         email_body = message.dict(exclude_none=True)
 
-        async with aiohttp.ClientSession() as session:
-            async with session.post(endpoint_url, headers=headers, json=email_body) as response:
-                if response.status >= 200 and response.status < 300:
-                    pass
-                else:
-                    raise Exception(f"{response.status} " + (await response.text()))
+        session = http_clients.get(Upstream.OUTLOOK)
+        async with session.post(endpoint_url, headers=headers, json=email_body) as response:
+            if response.status >= 200 and response.status < 300:
+                pass
+            else:
+                raise Exception(f"{response.status} " + (await response.text()))
 
     @retry(stop=stop_after_attempt(3), wait=wait_fixed(5), reraise=True)
     async def send_email(self, message: MessageResponse):
@@ -188,12 +188,12 @@ class OutlookClient:
         headers = {"Authorization": f"Bearer {self.token}", "Content-Type": "application/json"}
         email_body = message.dict(exclude_none=True)
 
-        async with aiohttp.ClientSession() as session:
-            async with session.post(endpoint_url, headers=headers, json=email_body) as response:
-                if response.status >= 200 and response.status < 300:
-                    pass
-                else:
-                    raise Exception(f"{response.status} " + (await response.text()))
+        session = http_clients.get(Upstream.OUTLOOK)
+        async with session.post(endpoint_url, headers=headers, json=email_body) as response:
+            if response.status >= 200 and response.status < 300:
+                pass
+            else:
+                raise Exception(f"{response.status} " + (await response.text()))
 
     @retry(stop=stop_after_attempt(3), wait=wait_fixed(5), reraise=True)
     async def receive_email(
@@ -212,12 +212,12 @@ class OutlookClient:
 
         headers = {"Authorization": f"Bearer {self.token}", "Content-Type": "application/json"}
 
-        async with aiohttp.ClientSession() as session:
-            async with session.get(f"{self.email_endpoint}{query}", headers=headers) as response:
-                if response.status >= 200 and response.status < 300:
-                    email_r = await response.json()
-                    if "value" not in email_r:
-                        raise Exception("Unexpected response: ", email_r)
-                    return email_r.get("value")
-                else:
-                    raise Exception(f"{response.status} " + (await response.text()))
+        session = http_clients.get(Upstream.OUTLOOK)
+        async with session.get(f"{self.email_endpoint}{query}", headers=headers) as response:
+            if response.status >= 200 and response.status < 300:
+                email_r = await response.json()
+                if "value" not in email_r:
+                    raise Exception("Unexpected response: ", email_r)
+                return email_r.get("value")
+            else:
+                raise Exception(f"{response.status} " + (await response.text()))
@@ -0,0 +1,224 @@
+# -------------------------------------------------------------------------------
+# Engineering
+# entity_cache.py
+# -------------------------------------------------------------------------------
+"""Two tier cache of the documents read by id, invalidated across the replicas"""
+# -------------------------------------------------------------------------------
+# Copyright (C) 2024 Array Insights, Inc. All Rights Reserved.
+# Private and Confidential. Internal Use Only.
+#     This software contains proprietary information which shall not
+#     be reproduced or transferred to other documents and shall not
+#     be disclosed to others for any purpose without
+#     prior written permission of Array Insights, Inc.
+# -------------------------------------------------------------------------------
+
+import asyncio
+import json
+import os
+import random
+import time
+import traceback
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Sequence, Tuple
+
+from fastapi.encoders import jsonable_encoder
+from redis.exceptions import RedisError
+
+from app.data.operations import DatabaseOperations
+from app.utils import log_manager
+from app.utils.metrics import timed
+from app.utils.redis_client import redis_client
+
+# Shared by the replicas, an update on one of them removes the entry here and tells the others to drop their copy
+ENTITY_CACHE_TTL_SECONDS = int(os.getenv("ENTITY_CACHE_TTL_SECONDS", "600"))
+# Kept short, it bounds how stale a replica can be if it misses an invalidation while reconnecting to redis
+ENTITY_CACHE_LOCAL_TTL_SECONDS = int(os.getenv("ENTITY_CACHE_LOCAL_TTL_SECONDS", "60"))
+ENTITY_CACHE_MAX_ENTRIES = int(os.getenv("ENTITY_CACHE_MAX_ENTRIES", "10000"))
+ENTITY_CACHE_KEY_PREFIX = "entity_cache"
+ENTITY_CACHE_CHANNEL = "entity_cache:invalidate"
+
+Document = Dict[str, Any]
+
+
+def matches(document: Document, query: Dict[str, Any]) -> bool:
+    # The part of the mongo query language used by the reads by id: equality, a value in an array and $ne
+    for key, expected in query.items():
+        value = document.get(key)
+        if isinstance(expected, dict) and "$ne" in expected:
+            if value == expected["$ne"]:
+                return False
+        elif isinstance(value, list):
+            if expected not in value:
+                return False
+        elif value != expected:
+            return False
+    return True
+
+
+def with_jitter(seconds: int) -> int:
+    # Spread the expiry of the entries cached together, so that they are not all reloaded at the same time
+    return max(1, int(seconds * random.uniform(0.9, 1.1)))
+
+
+class EntityCache:
+    _caches: Dict[str, "EntityCache"] = {}
+
+    # Make a singleton class for every cached collection, named after the collection
+    def __new__(cls, name: str, excluded_fields: Sequence[str] = ()) -> "EntityCache":
+        if name not in cls._caches:
+            cache = super(EntityCache, cls).__new__(cls)
+            cache.name = name
+            # Fields never copied into the cache, like the credentials, the reads that need them go to the database
+            cache.excluded_fields = ()
+            # id -> (document, expiry), in least recently used order
+            cache.entries: OrderedDict[str, Tuple[Document, float]] = OrderedDict()
+            # Concurrent misses on the same id share a single read of the database
+            cache.in_flight: Dict[str, asyncio.Future] = {}
+            # Bumped on every invalidation, so that a read started before it does not cache the old document
+            cache.generation = 0
+            cls._caches[name] = cache
+        if excluded_fields:
+            cls._caches[name].excluded_fields = tuple(excluded_fields)
+        return cls._caches[name]
+
+    def redis_key(self, entity_id: str) -> str:
+        return f"{ENTITY_CACHE_KEY_PREFIX}:{self.name}:{entity_id}"
+
+    def get_local(self, entity_id: str) -> Optional[Document]:
+        cached = self.entries.get(entity_id)
+        if not cached:
+            return None
+        if cached[1] < time.monotonic():
+            del self.entries[entity_id]
+            return None
+        self.entries.move_to_end(entity_id)
+        return cached[0]
+
+    def set_local(self, entity_id: str, document: Document):
+        self.entries[entity_id] = (document, time.monotonic() + with_jitter(ENTITY_CACHE_LOCAL_TTL_SECONDS))
+        self.entries.move_to_end(entity_id)
+        while len(self.entries) > ENTITY_CACHE_MAX_ENTRIES:
+            self.entries.popitem(last=False)
+
+    def drop_local(self, entity_ids: Optional[list] = None):
+        # The reads in flight would return the old document, the callers after this one start a new read instead
+        self.generation += 1
+        if entity_ids is None:
+            self.entries.clear()
+            self.in_flight.clear()
+            return
+        for entity_id in entity_ids:
+            self.entries.pop(entity_id, None)
+            self.in_flight.pop(entity_id, None)
+
+    def done_loading(self, entity_id: str, in_flight: asyncio.Future):
+        # A read dropped by an invalidation must not remove the one started after it
+        if self.in_flight.get(entity_id) is in_flight:
+            del self.in_flight[entity_id]
+
+    @timed("redis", "entity_cache_get")
+    async def get_shared(self, entity_id: str) -> Optional[Document]:
+        try:
+            cached = await redis_client.get(self.redis_key(entity_id))
+        except RedisError as exception:
+            log_manager.WARNING({"message": f"Entity cache is not available: {exception}"})
+            return None
+        return json.loads(cached) if cached is not None else None
+
+    @timed("redis", "entity_cache_set")
+    async def set_shared(self, entity_id: str, document: Document):
+        try:
+            await redis_client.set(
+                self.redis_key(entity_id), json.dumps(document), ex=with_jitter(ENTITY_CACHE_TTL_SECONDS)
+            )
+        except RedisError as exception:
+            log_manager.WARNING({"message": f"Entity cache is not available: {exception}"})
+
+    async def load(self, entity_id: str, loader: Callable[[], Awaitable[Optional[Document]]]) -> Optional[Document]:
+        generation = self.generation
+        document = await self.get_shared(entity_id)
+        from_database = document is None
+        if from_database:
+            document = await loader()
+            # Documents that are not found are not cached, they would hide the ones created right after
+            if document is None:
+                return None
+            # Stored the way it would come out of redis, so that both tiers return the same thing
+            document = jsonable_encoder(document, exclude=set(self.excluded_fields))
+
+        if self.generation == generation:
+            self.set_local(entity_id, document)
+            if from_database:
+                await self.set_shared(entity_id, document)
+        return document
+
+    async def get(self, entity_id: Any, loader: Callable[[], Awaitable[Optional[Document]]]) -> Optional[Document]:
+        # Returns a copy, the callers build models out of it and must not change the cached document
+        entity_id = str(entity_id)
+        document = self.get_local(entity_id)
+        if document is None:
+            in_flight = self.in_flight.get(entity_id)
+            if not in_flight:
+                in_flight = asyncio.ensure_future(self.load(entity_id, loader))
+                self.in_flight[entity_id] = in_flight
+                in_flight.add_done_callback(lambda future: self.done_loading(entity_id, future))
+
+            # Shielded so that a cancelled caller does not cancel the read for the others waiting on it
+            document = await asyncio.shield(in_flight)
+        return dict(document) if document is not None else None
+
+    async def find_by_id(self, query: Dict[str, Any]) -> List[Document]:
+        # Same result as a find with the query, which has to have the _id, served from the cache
+        document = await self.get(
+            query["_id"], lambda: DatabaseOperations().find_one(collection=self.name, query={"_id": query["_id"]})
+        )
+        return [document] if document is not None and matches(document, query) else []
+
+    async def invalidate_query(self, query: Dict[str, Any]):
+        # Drops the documents an update with the query could have changed
+        if "_id" in query:
+            await self.invalidate(query["_id"])
+        else:
+            await self.invalidate()
+
+    async def invalidate(self, *entity_ids: Any):
+        # Without ids every document of the collection is dropped, for the updates that are not made by id
+        ids = [str(entity_id) for entity_id in entity_ids] if entity_ids else None
+        self.drop_local(ids)
+        try:
+            if ids:
+                await redis_client.delete(*[self.redis_key(entity_id) for entity_id in ids])
+            else:
+                keys = [key async for key in redis_client.scan_iter(match=self.redis_key("*"))]
+                if keys:
+                    await redis_client.delete(*keys)
+            await redis_client.publish(ENTITY_CACHE_CHANNEL, json.dumps({"cache": self.name, "ids": ids}))
+        except RedisError as exception:
+            log_manager.WARNING({"message": f"Failed to invalidate the entity cache {self.name}: {exception}"})
+
+
+async def listen_for_invalidations():
+    # Drops the documents changed by the other replicas, the messages of this replica come back too and are harmless
+    while True:
+        try:
+            async with redis_client.pubsub() as pubsub:
+                await pubsub.subscribe(ENTITY_CACHE_CHANNEL)
+                # The invalidations sent while not subscribed are lost, anything cached before is dropped instead
+                for cache in EntityCache._caches.values():
+                    cache.drop_local()
+                async for message in pubsub.listen():
+                    if message["type"] != "message":
+                        continue
+                    invalidation = json.loads(message["data"])
+                    # Only the caches used by this replica, an unknown name must not create an empty one
+                    cache = EntityCache._caches.get(invalidation["cache"])
+                    if cache:
+                        cache.drop_local(invalidation["ids"])
+        except Exception as exception:
+            log_manager.ERROR(
+                {
+                    "message": f"Error: while listening for entity cache invalidations: {exception}",
+                    "stack_trace": f"{traceback.format_exc()}",
+                }
+            )
+            await asyncio.sleep(5)
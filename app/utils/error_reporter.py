@@ -0,0 +1,165 @@
+# -------------------------------------------------------------------------------
+# Engineering
+# error_reporter.py
+# -------------------------------------------------------------------------------
+"""Report the unhandled exceptions to slack and the database in the background"""
+# -------------------------------------------------------------------------------
+# Copyright (C) 2024 Array Insights, Inc. All Rights Reserved.
+# Private and Confidential. Internal Use Only.
+#     This software contains proprietary information which shall not
+#     be reproduced or transferred to other documents and shall not
+#     be disclosed to others for any purpose without
+#     prior written permission of Array Insights, Inc.
+# -------------------------------------------------------------------------------
+
+import asyncio
+import hashlib
+import json
+import time
+import traceback
+from typing import Any, Dict, List, Optional
+
+from app.data.indexes import MongoIndex, register_indexes
+from app.data.operations import DatabaseOperations
+from app.utils import log_manager
+from app.utils.http_clients import Upstream, http_clients
+from app.utils.rate_limiter import TokenBucket
+from app.utils.secrets import secret_store
+
+ERRORS_COLLECTION = "errors"
+ERRORS_RETENTION_SECONDS = 30 * 24 * 60 * 60
+ERRORS_INDEXES = register_indexes(
+    ERRORS_COLLECTION,
+    [
+        MongoIndex(keys=[("created_at", 1)], expire_after_seconds=ERRORS_RETENTION_SECONDS),
+        MongoIndex(keys=[("fingerprint", 1), ("created_at", -1)]),
+    ],
+)
+
+ERROR_REPORTER_MAX_PENDING = 10000
+ERROR_REPORTER_BATCH_SIZE = 100
+ERROR_REPORTER_FLUSH_SECONDS = 2
+# Every fingerprint is posted to slack at most once per window, the repeats are posted as a count at the end of it
+ERROR_REPORTER_WINDOW_SECONDS = 60
+SLACK_POSTS_PER_MINUTE = 10
+
+
+def fingerprint(exception: BaseException) -> str:
+    # The type and the code of the frames, not the line numbers, so that the same error is grouped across releases
+    frames = traceback.extract_tb(exception.__traceback__)
+    parts = [type(exception).__module__, type(exception).__qualname__]
+    parts.extend(f"{frame.filename}:{frame.name}:{frame.line}" for frame in frames)
+    return hashlib.sha1("\n".join(parts).encode()).hexdigest()
+
+
+class ErrorWindow:
+    def __init__(self, error: Dict[str, Any]):
+        self.first_error = error
+        self.started = time.monotonic()
+        self.count = 1
+        self.posted = False
+
+
+class ErrorReporter:
+    def __new__(cls) -> "ErrorReporter":
+        if not hasattr(cls, "instance"):
+            cls.queue: asyncio.Queue = asyncio.Queue(maxsize=ERROR_REPORTER_MAX_PENDING)
+            cls.worker: Optional[asyncio.Task] = None
+            cls.windows: Dict[str, ErrorWindow] = {}
+            cls.slack_budget = TokenBucket(rate=SLACK_POSTS_PER_MINUTE / 60, capacity=SLACK_POSTS_PER_MINUTE)
+            cls.dropped = 0
+            cls.instance = super(ErrorReporter, cls).__new__(cls)
+        return cls.instance
+
+    def report(self, exception: BaseException, error: Dict[str, Any]):
+        # Returns immediately, the error is written and posted by the background task
+        if self.worker is None or self.worker.done():
+            self.worker = asyncio.create_task(self.process_errors())
+
+        error["fingerprint"] = fingerprint(exception)
+        try:
+            self.queue.put_nowait(error)
+        except asyncio.QueueFull:
+            self.dropped += 1
+
+    async def process_errors(self):
+        pending: List[Dict[str, Any]] = []
+        while True:
+            try:
+                try:
+                    error = await asyncio.wait_for(self.queue.get(), timeout=ERROR_REPORTER_FLUSH_SECONDS)
+                    pending.append(error)
+                    await self.count_error(error)
+                except asyncio.TimeoutError:
+                    pass
+
+                if pending and (len(pending) >= ERROR_REPORTER_BATCH_SIZE or self.queue.empty()):
+                    batch, pending = pending, []
+                    await self.save_errors(batch)
+
+                await self.close_windows()
+            except Exception as exception:
+                log_manager.ERROR(
+                    {
+                        "message": f"Error: while reporting errors: {exception}",
+                        "stack_trace": f"{traceback.format_exc()}",
+                    }
+                )
+                await asyncio.sleep(ERROR_REPORTER_FLUSH_SECONDS)
+
+    async def count_error(self, error: Dict[str, Any]):
+        window = self.windows.get(error["fingerprint"])
+        if window:
+            window.count += 1
+            return
+
+        window = ErrorWindow(error)
+        self.windows[error["fingerprint"]] = window
+        window.posted = await self.post_to_slack(
+            {"id": error["_id"], "fingerprint": error["fingerprint"], "exception": error["exception"]}
+        )
+
+    async def close_windows(self):
+        now = time.monotonic()
+        for error_fingerprint, window in list(self.windows.items()):
+            if now - window.started < ERROR_REPORTER_WINDOW_SECONDS:
+                continue
+            del self.windows[error_fingerprint]
+            # The first occurrence has already been posted, only the repeats are left to report
+            repeats = window.count - 1 if window.posted else window.count
+            if repeats > 0:
+                await self.post_to_slack(
+                    {
+                        "fingerprint": error_fingerprint,
+                        "exception": window.first_error["exception"],
+                        "occurrences": repeats,
+                        "window_seconds": ERROR_REPORTER_WINDOW_SECONDS,
+                    }
+                )
+
+        if self.dropped:
+            log_manager.CRITICAL({"message": f"Dropped {self.dropped} errors, the error reporter is backed up"})
+            self.dropped = 0
+
+    async def post_to_slack(self, text: Dict[str, Any]) -> bool:
+        if not secret_store.SLACK_WEBHOOK:
+            return False
+
+        # Over the budget the post is skipped instead of waiting, it is counted in the window summary instead
+        if not self.slack_budget.try_acquire():
+            return False
+
+        try:
+            async with http_clients.get(Upstream.SLACK).post(
+                secret_store.SLACK_WEBHOOK,
+                headers={"Content-type": "application/json"},
+                json={"text": json.dumps(text, indent=2)},
+            ) as response:
+                return response.status < 400
+        except Exception as exception:
+            log_manager.WARNING({"message": f"Failed to post the error to slack: {exception}"})
+            return False
+
+    async def save_errors(self, errors: List[Dict[str, Any]]):
+        data_service = DatabaseOperations()
+        await data_service.insert_many(collection=ERRORS_COLLECTION, data=errors)
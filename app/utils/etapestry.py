@@ -4,9 +4,10 @@ import asyncio
 import xml.etree.ElementTree as ET
 from typing import Callable, Dict, Optional
 
-import aiohttp
 from pydantic import BaseModel
 
+from app.utils.http_clients import Upstream, http_clients
+
 
 class AccountInfo(BaseModel):
     id: Optional[str] = None
@@ -71,12 +72,13 @@ class Etapestry:
         payload = f"""<?xml version="1.0" encoding="UTF-8"?>\n<SOAP-ENV:Envelope SOAP-ENV:encodingStyle="http://schemas.xmlsoap.org/soap/encoding/" xmlns:SOAP-ENV="http://schemas.xmlsoap.org/soap/envelope/" xmlns:xsd="http://www.w3.org/2001/XMLSchema" xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" xmlns:SOAP-ENC="http://schemas.xmlsoap.org/soap/encoding/" xmlns:tns="etapestryAPI/service">\n    <SOAP-ENV:Body>\n        <tns:apiKeyLogin xmlns:tns="etapestryAPI/service">\n            <String_1 xsi:type="xsd:string">{self.database_id}</String_1>\n            <String_2 xsi:type="xsd:string">{self.api_key}</String_2>\n        </tns:apiKeyLogin>\n    </SOAP-ENV:Body>\n</SOAP-ENV:Envelope>"""
         headers = {"Content-Type": "text/xml; charset=UTF-8", "User-Agent": "NuSOAP/0.9.5 (1.123)", "SOAPAction": '""'}
 
-        async with aiohttp.ClientSession() as session:
-            async with session.post(self.url, headers=headers, data=payload) as response:
-                cookies = response.cookies
-                if "JSESSIONID" not in cookies and "NSC_WJQ-FUBQFTUSZ-ENA" not in cookies:
-                    raise Exception("Login failed")
-                self.cookies = f"JSESSIONID={cookies["JSESSIONID"].value}; NSC_WJQ-FUBQFTUSZ-ENA={cookies["NSC_WJQ-FUBQFTUSZ-ENA"].value}"
+        # The session cookies are read from the response and sent in a header, the shared session keeps no cookies
+        session = http_clients.get(Upstream.ETAPESTRY)
+        async with session.post(self.url, headers=headers, data=payload) as response:
+            cookies = response.cookies
+            if "JSESSIONID" not in cookies and "NSC_WJQ-FUBQFTUSZ-ENA" not in cookies:
+                raise Exception("Login failed")
+            self.cookies = f"JSESSIONID={cookies["JSESSIONID"].value}; NSC_WJQ-FUBQFTUSZ-ENA={cookies["NSC_WJQ-FUBQFTUSZ-ENA"].value}"
 
     async def get_accounts(self, callback: Callable, *args, **kwargs):
         if not hasattr(self, "cookies"):
@@ -92,36 +94,36 @@ class Etapestry:
         while True:
             payload = f"""<?xml version="1.0" encoding="UTF-8"?>\n<SOAP-ENV:Envelope SOAP-ENV:encodingStyle="http://schemas.xmlsoap.org/soap/encoding/" xmlns:SOAP-ENV="http://schemas.xmlsoap.org/soap/envelope/" xmlns:xsd="http://www.w3.org/2001/XMLSchema" xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" xmlns:SOAP-ENC="http://schemas.xmlsoap.org/soap/encoding/" xmlns:tns="etapestryAPI/service">\n    <SOAP-ENV:Body>\n        <tns:getExistingQueryResults xmlns:tns="etapestryAPI/service">\n            <PagedExistingQueryResultsRequest_1 xsi:type="tns:PagedExistingQueryResultsRequest">\n                <count xsi:type="xsd:int">{count}</count>\n                <start xsi:type="xsd:int">{skip}</start>\n                <query xsi:type="xsd:string">Recipients::Recipients</query>\n            </PagedExistingQueryResultsRequest_1>\n        </tns:getExistingQueryResults>\n    </SOAP-ENV:Body>\n</SOAP-ENV:Envelope>"""
 
-            async with aiohttp.ClientSession() as session:
-                async with session.post(self.url, headers=headers, data=payload) as response:
-                    tasks = []
-
-                    xml_data = await response.text()
-                    root = ET.fromstring(xml_data)
-
-                    result_count_respose = root.find('.//ns0:PagedQueryResultsResponse', namespaces={'ns0': 'etapestryAPI/service'})
-                    if not result_count_respose:
-                        break
-                    result_count = result_count_respose.find('count').text
-                    if result_count == '0':
-                        break
-
-                    for account in root.findall('.//ns0:Account', namespaces={'ns0': 'etapestryAPI/service'}):
-                        id = account.attrib.get('id')
-                        account_defined_values_id=account.find('accountDefinedValues').attrib.get('href'),
-                        array_of_defined_values = root.find(f'.//ns0:ArrayOfDefinedValue[@id="{account_defined_values_id[0][1:]}"]', namespaces={'ns0': 'etapestryAPI/service'})
-                        defined_values = {}
-                        for defined_value_item in array_of_defined_values.findall('item'):
-                            defined_value_id = defined_value_item.attrib.get('href')
-                            defined_value = root.find(f'.//ns0:DefinedValue[@id="{defined_value_id[1:]}"]', namespaces={'ns0': 'etapestryAPI/service'})
-                            defined_values[defined_value.find('fieldName').text] = defined_value.find('value').text
-
-                        tasks.append(self.process_accounts(account, defined_values, callback, *args, **kwargs))
-
-                    count = 200
-                    skip += 200
-
-                    await asyncio.gather(*tasks)
+            session = http_clients.get(Upstream.ETAPESTRY)
+            async with session.post(self.url, headers=headers, data=payload) as response:
+                tasks = []
+
+                xml_data = await response.text()
+                root = ET.fromstring(xml_data)
+
+                result_count_respose = root.find('.//ns0:PagedQueryResultsResponse', namespaces={'ns0': 'etapestryAPI/service'})
+                if not result_count_respose:
+                    break
+                result_count = result_count_respose.find('count').text
+                if result_count == '0':
+                    break
+
+                for account in root.findall('.//ns0:Account', namespaces={'ns0': 'etapestryAPI/service'}):
+                    id = account.attrib.get('id')
+                    account_defined_values_id=account.find('accountDefinedValues').attrib.get('href'),
+                    array_of_defined_values = root.find(f'.//ns0:ArrayOfDefinedValue[@id="{account_defined_values_id[0][1:]}"]', namespaces={'ns0': 'etapestryAPI/service'})
+                    defined_values = {}
+                    for defined_value_item in array_of_defined_values.findall('item'):
+                        defined_value_id = defined_value_item.attrib.get('href')
+                        defined_value = root.find(f'.//ns0:DefinedValue[@id="{defined_value_id[1:]}"]', namespaces={'ns0': 'etapestryAPI/service'})
+                        defined_values[defined_value.find('fieldName').text] = defined_value.find('value').text
+
+                    tasks.append(self.process_accounts(account, defined_values, callback, *args, **kwargs))
+
+                count = 200
+                skip += 200
+
+                await asyncio.gather(*tasks)
 
 
     async def process_accounts(self, account: ET.Element, defined_values: Dict[str, str], callback: Callable, *args, **kwargs):
@@ -0,0 +1,128 @@
+# -------------------------------------------------------------------------------
+# Engineering
+# firebase_auth.py
+# -------------------------------------------------------------------------------
+"""Verify Firebase ID tokens without blocking the event loop"""
+# -------------------------------------------------------------------------------
+# Copyright (C) 2024 Array Insights, Inc. All Rights Reserved.
+# Private and Confidential. Internal Use Only.
+#     This software contains proprietary information which shall not
+#     be reproduced or transferred to other documents and shall not
+#     be disclosed to others for any purpose without
+#     prior written permission of Array Insights, Inc.
+# -------------------------------------------------------------------------------
+
+import asyncio
+import hashlib
+import re
+import time
+from typing import Any, Dict, Optional, Tuple
+
+from fastapi.concurrency import run_in_threadpool
+from jose import jwt
+
+from app.utils.http_clients import Upstream, http_clients
+
+# Public certificates of the keys the ID tokens are signed with
+FIREBASE_CERTIFICATES_URL = "https://www.googleapis.com/robot/v1/metadata/x509/securetoken@system.gserviceaccount.com"
+FIREBASE_CERTIFICATES_DEFAULT_MAX_AGE = 60 * 60
+# Tolerated clock difference with the Firebase servers, in seconds
+FIREBASE_CLOCK_SKEW = 60
+FIREBASE_VERIFIED_TOKENS_MAX_ENTRIES = 10000
+
+
+class FirebaseTokenError(Exception):
+    pass
+
+
+class FirebaseTokenVerifier:
+    def __new__(cls, project_id: str) -> "FirebaseTokenVerifier":
+        if not hasattr(cls, "instance"):
+            cls.project_id = project_id
+            cls.certificates: Dict[str, str] = {}
+            cls.certificates_expiry = 0.0
+            cls.certificates_lock = asyncio.Lock()
+            # sha256 of the token -> (claims, expiry) of the tokens already verified
+            cls.verified_tokens: Dict[str, Tuple[Dict[str, Any], float]] = {}
+            cls.instance = super(FirebaseTokenVerifier, cls).__new__(cls)
+        return cls.instance
+
+    async def get_certificates(self) -> Dict[str, str]:
+        if time.time() < self.certificates_expiry:
+            return self.certificates
+
+        async with self.certificates_lock:
+            # Another request may have refreshed them while this one was waiting for the lock
+            if time.time() < self.certificates_expiry:
+                return self.certificates
+
+            session = http_clients.get(Upstream.FIREBASE)
+            async with session.get(FIREBASE_CERTIFICATES_URL) as response:
+                response.raise_for_status()
+                certificates = await response.json()
+                cache_control = response.headers.get("Cache-Control", "")
+
+            max_age = re.search(r"max-age=(\d+)", cache_control)
+            self.certificates = certificates
+            self.certificates_expiry = time.time() + (
+                int(max_age.group(1)) if max_age else FIREBASE_CERTIFICATES_DEFAULT_MAX_AGE
+            )
+            return self.certificates
+
+    def remember(self, key: str, claims: Dict[str, Any]):
+        now = time.time()
+        if len(self.verified_tokens) >= FIREBASE_VERIFIED_TOKENS_MAX_ENTRIES:
+            # Drop the expired tokens first, and everything if that is not enough
+            self.verified_tokens = {
+                token: verified for token, verified in self.verified_tokens.items() if verified[1] > now
+            }
+            if len(self.verified_tokens) >= FIREBASE_VERIFIED_TOKENS_MAX_ENTRIES:
+                self.verified_tokens = {}
+        self.verified_tokens[key] = (claims, claims["exp"])
+
+    async def verify(self, token: str) -> Dict[str, Any]:
+        # Same checks as firebase_admin.auth.verify_id_token, without the revocation check
+        key = hashlib.sha256(token.encode()).hexdigest()
+        verified: Optional[Tuple[Dict[str, Any], float]] = self.verified_tokens.get(key)
+        if verified:
+            if verified[1] > time.time():
+                return verified[0]
+            del self.verified_tokens[key]
+
+        try:
+            header = jwt.get_unverified_header(token)
+        except Exception as exception:
+            raise FirebaseTokenError(f"Malformed token: {exception}")
+        if header.get("alg") != "RS256":
+            raise FirebaseTokenError("Unexpected token algorithm")
+
+        certificate = (await self.get_certificates()).get(header.get("kid", ""))
+        if not certificate:
+            raise FirebaseTokenError("Token signed with an unknown key")
+
+        try:
+            claims = await run_in_threadpool(
+                jwt.decode,
+                token,
+                certificate,
+                algorithms=["RS256"],
+                audience=self.project_id,
+                issuer=f"https://securetoken.google.com/{self.project_id}",
+                options={"leeway": FIREBASE_CLOCK_SKEW},
+            )
+        except Exception as exception:
+            raise FirebaseTokenError(f"Invalid token: {exception}")
+
+        if not claims.get("sub") or len(claims["sub"]) > 128:
+            raise FirebaseTokenError("Invalid token subject")
+        # jose only checks that iat is a number, a token issued or authenticated later than now is forged or
+        # comes from a badly skewed clock
+        now = time.time()
+        if not isinstance(claims.get("iat"), (int, float)) or claims["iat"] > now + FIREBASE_CLOCK_SKEW:
+            raise FirebaseTokenError("Token issued in the future")
+        if claims.get("auth_time", 0) > now + FIREBASE_CLOCK_SKEW:
+            raise FirebaseTokenError("Token authenticated in the future")
+        claims["uid"] = claims["sub"]
+
+        self.remember(key, claims)
+        return claims
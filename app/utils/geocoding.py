@@ -0,0 +1,58 @@
+# -------------------------------------------------------------------------------
+# Engineering
+# geocoding.py
+# -------------------------------------------------------------------------------
+"""Location of the US zip codes"""
+# -------------------------------------------------------------------------------
+# Copyright (C) 2024 Array Insights, Inc. All Rights Reserved.
+# Private and Confidential. Internal Use Only.
+#     This software contains proprietary information which shall not
+#     be reproduced or transferred to other documents and shall not
+#     be disclosed to others for any purpose without
+#     prior written permission of Array Insights, Inc.
+# -------------------------------------------------------------------------------
+
+import threading
+from typing import Any, Dict, Iterable, Optional
+
+import pgeocode
+from fastapi.concurrency import run_in_threadpool
+
+
+class ZipCodes:
+    def __new__(cls) -> "ZipCodes":
+        if not hasattr(cls, "instance"):
+            cls.nominatim: Optional[pgeocode.Nominatim] = None
+            cls.lock = threading.Lock()
+            cls.instance = super(ZipCodes, cls).__new__(cls)
+        return cls.instance
+
+    def get_nominatim(self) -> pgeocode.Nominatim:
+        # Loaded once for the process, the table is downloaded on first use and parsed into pandas
+        with self.lock:
+            if self.nominatim is None:
+                self.nominatim = pgeocode.Nominatim("us")
+            return self.nominatim
+
+    def lookup(self, zipcodes: Iterable[str]) -> Dict[str, Dict[str, Any]]:
+        # All the zip codes are looked up in one vectorized query of the table, the ones that are not found or
+        # have no coordinates are left out of the result
+        unique_zipcodes = list({str(zipcode).strip() for zipcode in zipcodes if zipcode and str(zipcode).strip()})
+        if not unique_zipcodes:
+            return {}
+
+        found = self.get_nominatim().query_postal_code(unique_zipcodes)
+        found = found[found["latitude"].notna() & found["longitude"].notna()]
+
+        locations = {}
+        for zipcode, row in zip(found["postal_code"], found.itertuples(index=False)):
+            locations[zipcode] = {
+                "latitude": float(row.latitude),
+                "longitude": float(row.longitude),
+                "city": f"{row.place_name} {row.state_name} {row.country_code}",
+            }
+        return locations
+
+    async def geocode(self, zipcodes: Iterable[str]) -> Dict[str, Dict[str, Any]]:
+        # Loading the table and querying it are blocking, both run on the thread pool
+        return await run_in_threadpool(self.lookup, list(zipcodes))
@@ -0,0 +1,85 @@
+# -------------------------------------------------------------------------------
+# Engineering
+# http_clients.py
+# -------------------------------------------------------------------------------
+"""Long lived HTTP sessions shared by the integrations with the external services"""
+# -------------------------------------------------------------------------------
+# Copyright (C) 2024 Array Insights, Inc. All Rights Reserved.
+# Private and Confidential. Internal Use Only.
+#     This software contains proprietary information which shall not
+#     be reproduced or transferred to other documents and shall not
+#     be disclosed to others for any purpose without
+#     prior written permission of Array Insights, Inc.
+# -------------------------------------------------------------------------------
+
+import os
+from enum import Enum
+from typing import Dict, NamedTuple
+
+import aiohttp
+from aiohttp.resolver import AsyncResolver
+
+HTTP_DNS_CACHE_SECONDS = int(os.getenv("HTTP_DNS_CACHE_SECONDS", "300"))
+HTTP_KEEPALIVE_SECONDS = int(os.getenv("HTTP_KEEPALIVE_SECONDS", "60"))
+
+
+class Upstream(Enum):
+    OUTLOOK = "outlook"
+    ETAPESTRY = "etapestry"
+    REDDIT = "reddit"
+    RECAPTCHA = "recaptcha"
+    SLACK = "slack"
+    FIREBASE = "firebase"
+
+
+class UpstreamSettings(NamedTuple):
+    # Total time for a request, including reading the response
+    timeout_seconds: float
+    limit_per_host: int
+
+
+UPSTREAM_SETTINGS: Dict[Upstream, UpstreamSettings] = {
+    Upstream.OUTLOOK: UpstreamSettings(timeout_seconds=30, limit_per_host=20),
+    # The pages of accounts are large and slow to generate
+    Upstream.ETAPESTRY: UpstreamSettings(timeout_seconds=120, limit_per_host=4),
+    Upstream.REDDIT: UpstreamSettings(timeout_seconds=15, limit_per_host=10),
+    Upstream.RECAPTCHA: UpstreamSettings(timeout_seconds=10, limit_per_host=20),
+    Upstream.SLACK: UpstreamSettings(timeout_seconds=10, limit_per_host=2),
+    Upstream.FIREBASE: UpstreamSettings(timeout_seconds=10, limit_per_host=2),
+}
+
+
+class HttpClients:
+    def __new__(cls) -> "HttpClients":
+        if not hasattr(cls, "instance"):
+            cls.sessions: Dict[Upstream, aiohttp.ClientSession] = {}
+            cls.instance = super(HttpClients, cls).__new__(cls)
+        return cls.instance
+
+    def get(self, upstream: Upstream) -> aiohttp.ClientSession:
+        # Created on first use, a session has to be created inside the running event loop
+        session = self.sessions.get(upstream)
+        if session is None or session.closed:
+            settings = UPSTREAM_SETTINGS[upstream]
+            connector = aiohttp.TCPConnector(
+                limit_per_host=settings.limit_per_host,
+                keepalive_timeout=HTTP_KEEPALIVE_SECONDS,
+                ttl_dns_cache=HTTP_DNS_CACHE_SECONDS,
+                resolver=AsyncResolver(),
+            )
+            session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=aiohttp.ClientTimeout(total=settings.timeout_seconds),
+                # The sessions are shared by all the users and organizations, no cookie can be carried between requests
+                cookie_jar=aiohttp.DummyCookieJar(),
+            )
+            self.sessions[upstream] = session
+        return session
+
+    async def close(self):
+        sessions, self.sessions = self.sessions, {}
+        for session in sessions.values():
+            await session.close()
+
+
+http_clients = HttpClients()
@@ -1,8 +1,10 @@
 import abc
 import threading
 import time
-from typing import Dict
+import uuid
+from typing import Dict, List
 
+from app.utils.metrics import timed
 from app.utils.redis_client import redis_client
 
 
@@ -58,25 +60,69 @@ class LocalLockStore(LockStore):
             return name in self._locks and self._locks[name].locked()
 
 
+# The lock holds the token of its owner, it is only deleted or extended by the owner. Without the check an owner
+# whose lock has expired during a long task would delete or extend the lock acquired by someone else since.
+RELEASE_LOCK_SCRIPT = """
+if redis.call("get", KEYS[1]) == ARGV[1] then
+    return redis.call("del", KEYS[1])
+end
+return 0
+"""
+EXTEND_LOCK_SCRIPT = """
+if redis.call("get", KEYS[1]) == ARGV[1] then
+    return redis.call("expire", KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+
 class RedisLockStore(LockStore):
     def __new__(cls) -> "RedisLockStore":
         if not hasattr(cls, "_instance"):
             cls._instance = super(RedisLockStore, cls).__new__(cls)
             cls.redis_client = redis_client
+            # Lock name -> token of the locks held by this process
+            cls.tokens: Dict[str, str] = {}
+            cls.release_script = redis_client.register_script(RELEASE_LOCK_SCRIPT)
+            cls.extend_script = redis_client.register_script(EXTEND_LOCK_SCRIPT)
         return cls._instance
 
+    @timed("redis", "lock_acquire")
     async def acquire(self, name, expiry=None):
         if not expiry:
             expiry = self.expiry
 
         # Try to acquire the lock
-        lock_acquired = await self.redis_client.set(name, "LOCKED", ex=expiry, nx=True)
+        token = uuid.uuid4().hex
+        lock_acquired = await self.redis_client.set(name, token, ex=expiry, nx=True)
+        if lock_acquired:
+            self.tokens[name] = token
 
         # return True if lock is acquired else False
         return lock_acquired
 
+    @timed("redis", "lock_release")
     async def release(self, name):
-        await self.redis_client.delete(name)
-
+        token = self.tokens.pop(name, None)
+        if token:
+            await self.release_script(keys=[name], args=[token])
+
+    @timed("redis", "lock_extend")
+    async def extend(self, name, expiry):
+        # Returns False if the lock has expired or has been acquired by someone else and can no longer be extended
+        token = self.tokens.get(name)
+        if not token:
+            return False
+        return bool(await self.extend_script(keys=[name], args=[token, expiry]))
+
+    @timed("redis", "lock_is_locked")
     async def is_locked(self, name):
         return await self.redis_client.exists(name)
+
+    @timed("redis", "lock_are_locked")
+    async def are_locked(self, names: List[str]) -> List[bool]:
+        # Checks all the names in a single round trip instead of one EXISTS per name
+        async with self.redis_client.pipeline(transaction=False) as pipeline:
+            for name in names:
+                pipeline.exists(name)
+            return [bool(exists) for exists in await pipeline.execute()]
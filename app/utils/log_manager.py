@@ -1,12 +1,37 @@
-import json
+import atexit
 import logging
+import os
+import queue
+import threading
+import time
+from collections import deque
 from datetime import datetime, timezone
 from enum import Enum
-from typing import Dict
+from logging.handlers import QueueHandler, QueueListener
+from typing import Callable, Dict, List, Union
+
+import orjson
 
 logger = logging.getLogger("uvicorn")
 logger.setLevel(logging.DEBUG)
 
+# The messages are put on a queue as they are and are serialized and written by a background thread, so that the
+# callers only pay for the level check and the enqueue
+_log_queue: queue.SimpleQueue = queue.SimpleQueue()
+_queue_logger = logging.getLogger("tallulah.log_manager")
+_queue_logger.setLevel(logging.DEBUG)
+_queue_logger.propagate = False
+
+# Ship the logs to the audit-logs index directly instead of through filebeat and logstash
+LOG_SHIPPING_ENABLED = os.getenv("LOG_SHIPPING_ENABLED", "false").lower() == "true"
+LOG_SHIPPING_INDEX = "audit-logs"
+LOG_SHIPPING_BATCH_SIZE = 500
+LOG_SHIPPING_INTERVAL_SECONDS = 5
+LOG_SHIPPING_MAX_PENDING = 50000
+
+# A message is a dict, or a function returning the dict when building it is only worth it if it is logged
+LogMessage = Union[Dict, Callable[[], Dict]]
+
 
 class LogLevel(Enum):
     DEBUG = "DEBUG"
@@ -16,43 +41,119 @@ class LogLevel(Enum):
     CRITICAL = "CRITICAL"
 
 
+class _DeferredQueueHandler(QueueHandler):
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # QueueHandler formats the record on the calling thread, here that is left to the writer thread
+        return record
+
+
+def _serialize(record: logging.LogRecord) -> str:
+    # Called on the writer thread, only once per record even with several handlers
+    if not getattr(record, "serialized", False):
+        message = record.msg
+        if callable(message):
+            message = message()
+        message["timestamp"] = datetime.fromtimestamp(record.created, timezone.utc).isoformat()
+        record.msg = orjson.dumps(message, default=str).decode()
+        record.args = None
+        record.serialized = True
+    return record.msg
+
+
+class _ForwardingHandler(logging.Handler):
+    def emit(self, record: logging.LogRecord):
+        # Writes through the uvicorn logger so the output keeps the format and destination configured by uvicorn
+        _serialize(record)
+        if logger.isEnabledFor(record.levelno):
+            logger.handle(record)
+
+
+class _ElasticsearchShipper(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        # The oldest logs are dropped if elasticsearch can not keep up, rather than running out of memory
+        self.pending: deque = deque(maxlen=LOG_SHIPPING_MAX_PENDING)
+        threading.Thread(target=self._ship_forever, name="log-shipper", daemon=True).start()
+
+    def emit(self, record: logging.LogRecord):
+        self.pending.append(_serialize(record))
+
+    def _ship_forever(self):
+        # Imported here, the secrets are only needed when shipping is enabled
+        from elasticsearch import Elasticsearch, helpers
+
+        from app.utils.secrets import secret_store
+
+        client = Elasticsearch(hosts=secret_store.ELASTIC_HOST, basic_auth=("elastic", secret_store.ELASTIC_PASSWORD))
+        while True:
+            time.sleep(LOG_SHIPPING_INTERVAL_SECONDS)
+            while True:
+                batch = []
+                while self.pending and len(batch) < LOG_SHIPPING_BATCH_SIZE:
+                    batch.append(self.pending.popleft())
+                if not batch:
+                    break
+                try:
+                    # Same shape as the documents logstash writes, with the json fields parsed out of message
+                    helpers.bulk(
+                        client,
+                        ({"_index": LOG_SHIPPING_INDEX, "_source": message} for message in batch),
+                        raise_on_error=False,
+                    )
+                except Exception as exception:
+                    # Not logged through log_manager, it would feed back into the shipper
+                    logger.warning(f"Failed to ship {len(batch)} logs to {LOG_SHIPPING_INDEX}: {exception}")
+                    break
+
+
+_handlers: List[logging.Handler] = [_ForwardingHandler()]
+if LOG_SHIPPING_ENABLED:
+    _handlers.append(_ElasticsearchShipper())
+_queue_logger.addHandler(_DeferredQueueHandler(_log_queue))
+_listener = QueueListener(_log_queue, *_handlers, respect_handler_level=False)
+_listener.start()
+# Writes what is still in the queue when the process exits
+atexit.register(_listener.stop)
+
+_LEVELS = {
+    LogLevel.DEBUG: logging.DEBUG,
+    LogLevel.INFO: logging.INFO,
+    LogLevel.WARNING: logging.WARNING,
+    LogLevel.ERROR: logging.ERROR,
+    LogLevel.CRITICAL: logging.CRITICAL,
+}
+
+
 def _add_log_message(
     level: LogLevel,
-    message: Dict,
+    message: LogMessage,
 ):
-    message["timestamp"] = datetime.now(timezone.utc).isoformat()
-    message_str = json.dumps(message)
-
-    if level == LogLevel.DEBUG:
-        logger.debug(message_str)
-    elif level == LogLevel.INFO:
-        logger.info(message_str)
-    elif level == LogLevel.WARNING:
-        logger.warning(message_str)
-    elif level == LogLevel.ERROR:
-        logger.error(message_str)
-    elif level == LogLevel.CRITICAL:
-        logger.critical(message_str)
-    else:
+    if level not in _LEVELS:
         raise ValueError("Invalid log level")
-    pass
+
+    # Nothing is built or formatted for a message below the level of the logger
+    levelno = _LEVELS[level]
+    if not logger.isEnabledFor(levelno):
+        return
+
+    _queue_logger.log(levelno, message)
 
 
-def DEBUG(message: Dict):
+def DEBUG(message: LogMessage):
     _add_log_message(LogLevel.DEBUG, message)
 
 
-def INFO(message: Dict):
+def INFO(message: LogMessage):
     _add_log_message(LogLevel.INFO, message)
 
 
-def WARNING(message: Dict):
+def WARNING(message: LogMessage):
     _add_log_message(LogLevel.WARNING, message)
 
 
-def ERROR(message: Dict):
+def ERROR(message: LogMessage):
     _add_log_message(LogLevel.ERROR, message)
 
 
-def CRITICAL(message: Dict):
+def CRITICAL(message: LogMessage):
     _add_log_message(LogLevel.CRITICAL, message)
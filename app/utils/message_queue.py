@@ -1,12 +1,13 @@
 from abc import ABC, abstractmethod
 from collections import deque
 from enum import Enum
-from typing import Callable
+from typing import Callable, List
 
 from aio_pika import DeliveryMode, Message, connect
 from aio_pika.abc import AbstractIncomingMessage
 
 from app.utils import log_manager
+from app.utils.metrics import timed
 
 
 class MessageQueueTypes(Enum):
@@ -92,9 +93,10 @@ class RabbitMQProducerConsumer(AbstractMessageQueue):
     async def connect(self):
         if not self.is_connected():
             self.connection = await connect(self.url, loop=asyncio.get_event_loop())
-            self.channel = await self.connection.channel()
+            self.channel = await self.connection.channel(publisher_confirms=True)
             self.queue = await self.channel.declare_queue(self.queue_name.value, durable=True)
 
+    @timed("rabbitmq", "push_message")
     async def push_message(self, message: str):
         if not self.is_connected():
             await self.connect()
@@ -104,6 +106,23 @@ class RabbitMQProducerConsumer(AbstractMessageQueue):
             routing_key=self.queue.name,
         )
 
+    @timed("rabbitmq", "push_messages")
+    async def push_messages(self, messages: List[str]):
+        # Every publish on the channel resolves when the broker confirms it, publishing the whole batch
+        # at once waits for all the confirms together instead of one round trip per message
+        if not self.is_connected():
+            await self.connect()
+
+        await asyncio.gather(
+            *[
+                self.channel.default_exchange.publish(
+                    Message(message.encode(), delivery_mode=DeliveryMode.PERSISTENT),
+                    routing_key=self.queue.name,
+                )
+                for message in messages
+            ]
+        )
+
     async def consume_messages(self, on_message: Callable):
         if not self.is_connected():
             await self.connect()
@@ -111,9 +130,25 @@ class RabbitMQProducerConsumer(AbstractMessageQueue):
         log_manager.DEBUG({"message": f"{self.queue_name} is waiting for messages"})
         async with self.queue.iterator() as queue_iter:
             async for message in queue_iter:
-                log_manager.DEBUG({"message": f"{self.queue_name} Received message: {message.body}"})
+                # Only the size of the body, the bodies can be large and hold patient data
+                log_manager.DEBUG(
+                    lambda message=message: {
+                        "message": f"{self.queue_name} Received message",
+                        "body_size": len(message.body),
+                    }
+                )
                 await on_message(message)
 
+    async def message_count(self) -> int:
+        if not self.is_connected():
+            await self.connect()
+
+        # A passive declare only reads the state of the queue. It is made on a channel of its own that is closed
+        # afterwards, a failed declare closes its channel and would stop the consumer of the queue.
+        async with await self.connection.channel() as channel:
+            queue = await channel.declare_queue(self.queue_name.value, durable=True, passive=True)
+            return queue.declaration_result.message_count
+
     async def disconnect(self):
         if not self.is_connected():
             raise Exception("Not connected")
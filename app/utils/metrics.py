@@ -0,0 +1,165 @@
+# -------------------------------------------------------------------------------
+# Engineering
+# metrics.py
+# -------------------------------------------------------------------------------
+"""Service metrics exposed to Prometheus"""
+# -------------------------------------------------------------------------------
+# Copyright (C) 2024 Array Insights, Inc. All Rights Reserved.
+# Private and Confidential. Internal Use Only.
+#     This software contains proprietary information which shall not
+#     be reproduced or transferred to other documents and shall not
+#     be disclosed to others for any purpose without
+#     prior written permission of Array Insights, Inc.
+# -------------------------------------------------------------------------------
+
+import asyncio
+import functools
+import os
+import time
+import traceback
+from contextlib import asynccontextmanager
+from typing import Awaitable, Callable, List
+
+from prometheus_client import REGISTRY, Counter, Gauge, Histogram, start_http_server
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from app.utils import log_manager
+
+# The metrics are served on their own port, which is not exposed by the ingress of the public API
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9100"))
+METRICS_COLLECT_INTERVAL = 15
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+EVENT_LOOP_LAG_INTERVAL = 0.5
+
+# Called periodically to update the metrics that are read from somewhere else, like the queue depths. The scrapes
+# are served from a thread of prometheus_client, which can not await the reads.
+COLLECTORS: List[Callable[[], Awaitable[None]]] = []
+
+HTTP_REQUESTS_IN_FLIGHT = Gauge("http_requests_in_flight", "Requests being processed")
+HTTP_REQUEST_DURATION = Histogram(
+    "http_request_duration_seconds",
+    "Time to the response headers by route",
+    ["method", "route", "status"],
+    buckets=DEFAULT_BUCKETS,
+)
+EVENT_LOOP_LAG = Histogram(
+    "event_loop_lag_seconds",
+    "Delay of a scheduled wake up of the event loop",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5),
+)
+DEPENDENCY_CALL_DURATION = Histogram(
+    "dependency_call_duration_seconds",
+    "Duration of the calls to the services used",
+    ["system", "operation"],
+    buckets=DEFAULT_BUCKETS,
+)
+DEPENDENCY_CALL_ERRORS = Counter("dependency_call_errors", "Failed calls to the services used", ["system", "operation"])
+QUEUE_DEPTH = Gauge("queue_depth", "Jobs waiting to be processed", ["queue"])
+# Read from redis, the counts are shared by all the instances of the service
+OPENAI_CACHE_STATS = Gauge(
+    "openai_response_cache", "Hits, misses, evictions and entries of the OpenAI response cache", ["stat"]
+)
+
+
+def register_collector(collector: Callable[[], Awaitable[None]]):
+    COLLECTORS.append(collector)
+
+
+async def collect_metrics():
+    while True:
+        for collector in COLLECTORS:
+            try:
+                await collector()
+            except Exception as exception:
+                log_manager.WARNING({"message": f"Metrics collector {collector.__name__} failed: {exception}"})
+        await asyncio.sleep(METRICS_COLLECT_INTERVAL)
+
+
+def start_metrics_server():
+    start_http_server(METRICS_PORT, registry=REGISTRY)
+
+
+def record_call(system: str, operation: str, seconds: float, failed: bool):
+    DEPENDENCY_CALL_DURATION.labels(system=system, operation=operation).observe(seconds)
+    if failed:
+        DEPENDENCY_CALL_ERRORS.labels(system=system, operation=operation).inc()
+
+
+@asynccontextmanager
+async def track_call(system: str, operation: str):
+    start_time = time.perf_counter()
+    failed = True
+    try:
+        yield
+        failed = False
+    finally:
+        record_call(system, operation, time.perf_counter() - start_time, failed)
+
+
+def timed(system: str, operation: str):
+    # Decorator for the async methods of the clients of the services used
+    def decorator(function):
+        @functools.wraps(function)
+        async def wrapper(*args, **kwargs):
+            async with track_call(system, operation):
+                return await function(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+async def monitor_event_loop_lag():
+    # A busy loop wakes the sleep up late, the delay is how long every other task waits too
+    while True:
+        try:
+            start_time = time.perf_counter()
+            await asyncio.sleep(EVENT_LOOP_LAG_INTERVAL)
+            EVENT_LOOP_LAG.observe(max(0.0, time.perf_counter() - start_time - EVENT_LOOP_LAG_INTERVAL))
+        except Exception as exception:
+            log_manager.ERROR(
+                {
+                    "message": f"Error: while monitoring the event loop lag: {exception}",
+                    "stack_trace": f"{traceback.format_exc()}",
+                }
+            )
+            await asyncio.sleep(EVENT_LOOP_LAG_INTERVAL)
+
+
+class MetricsMiddleware:
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start_time = time.perf_counter()
+        status_code = 500
+        recorded = False
+
+        def record():
+            # The route template instead of the path, so that ids in the path do not make a series per request
+            route = scope.get("route")
+            HTTP_REQUEST_DURATION.labels(
+                method=scope["method"],
+                route=route.path if route else "unmatched",
+                status=str(status_code),
+            ).observe(time.perf_counter() - start_time)
+
+        async def send_and_record(message: Message):
+            nonlocal status_code, recorded
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                record()
+                recorded = True
+            await send(message)
+
+        HTTP_REQUESTS_IN_FLIGHT.inc()
+        try:
+            await self.app(scope, receive, send_and_record)
+        finally:
+            HTTP_REQUESTS_IN_FLIGHT.dec()
+            if not recorded:
+                record()
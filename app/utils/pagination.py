@@ -0,0 +1,88 @@
+# -------------------------------------------------------------------------------
+# Engineering
+# pagination.py
+# -------------------------------------------------------------------------------
+"""Opaque cursor tokens for keyset pagination"""
+# -------------------------------------------------------------------------------
+# Copyright (C) 2024 Array Insights, Inc. All Rights Reserved.
+# Private and Confidential. Internal Use Only.
+#     This software contains proprietary information which shall not
+#     be reproduced or transferred to other documents and shall not
+#     be disclosed to others for any purpose without
+#     prior written permission of Array Insights, Inc.
+# -------------------------------------------------------------------------------
+
+import base64
+import binascii
+from datetime import datetime
+from typing import Any, Dict
+
+from bson import ObjectId, json_util
+from pydantic import BaseModel, ValidationError, field_validator
+
+SORT_VALUE_TYPES = (str, int, float, datetime, ObjectId)
+
+
+class PageCursor(BaseModel):
+    sort_key: str
+    sort_direction: int
+    sort_value: Any = None
+    id: str
+
+    @field_validator("sort_value")
+    @classmethod
+    def check_sort_value(cls, sort_value: Any) -> Any:
+        # The tokens come back from the clients and the value is put in the query as is. Anything else than a plain
+        # value, like a document or a bson regex, would be read by mongo as a condition instead of a value to compare
+        if sort_value is not None and not isinstance(sort_value, SORT_VALUE_TYPES):
+            raise ValueError("The sort value of a page cursor must be a single value")
+        return sort_value
+
+    def encode(self) -> str:
+        # bson's json_util is used so that datetimes and other bson types survive the round trip
+        token = json_util.dumps(self.model_dump())
+        return base64.urlsafe_b64encode(token.encode("utf-8")).decode("utf-8").rstrip("=")
+
+    @staticmethod
+    def decode(token: str) -> "PageCursor":
+        try:
+            padded_token = token + "=" * (-len(token) % 4)
+            return PageCursor(**json_util.loads(base64.urlsafe_b64decode(padded_token).decode("utf-8")))
+        except (binascii.Error, UnicodeDecodeError, ValueError, TypeError, ValidationError) as exception:
+            raise ValueError(f"Invalid page cursor: {exception}")
+
+    @staticmethod
+    def from_document(document: Dict[str, Any], sort_key: str, sort_direction: int) -> "PageCursor":
+        return PageCursor(
+            sort_key=sort_key,
+            sort_direction=sort_direction,
+            sort_value=get_nested_value(document, sort_key),
+            id=str(document["_id"]),
+        )
+
+    def keyset_filter(self) -> Dict[str, Any]:
+        # Documents strictly after the cursor in (sort_key, _id) order. Documents where the sort key is
+        # missing or null sort before every other value in mongo, so they need to be handled separately.
+        operator = "$lt" if self.sort_direction < 0 else "$gt"
+        if self.sort_value is None:
+            after_null = {self.sort_key: None, "_id": {operator: self.id}}
+            if self.sort_direction < 0:
+                return after_null
+            return {"$or": [after_null, {self.sort_key: {"$ne": None}}]}
+
+        keyset = [
+            {self.sort_key: {operator: self.sort_value}},
+            {self.sort_key: self.sort_value, "_id": {operator: self.id}},
+        ]
+        if self.sort_direction < 0:
+            keyset.append({self.sort_key: None})
+        return {"$or": keyset}
+
+
+def get_nested_value(document: Dict[str, Any], key: str) -> Any:
+    value: Any = document
+    for part in key.split("."):
+        if not isinstance(value, dict) or part not in value:
+            return None
+        value = value[part]
+    return value
@@ -0,0 +1,125 @@
+# -------------------------------------------------------------------------------
+# Engineering
+# rate_limiter.py
+# -------------------------------------------------------------------------------
+"""Rate limiters used to pace work against upstream quotas"""
+# -------------------------------------------------------------------------------
+# Copyright (C) 2024 Array Insights, Inc. All Rights Reserved.
+# Private and Confidential. Internal Use Only.
+#     This software contains proprietary information which shall not
+#     be reproduced or transferred to other documents and shall not
+#     be disclosed to others for any purpose without
+#     prior written permission of Array Insights, Inc.
+# -------------------------------------------------------------------------------
+
+import asyncio
+import random
+import time
+from typing import List
+
+from redis.exceptions import RedisError
+
+from app.utils import log_manager
+from app.utils.metrics import track_call
+from app.utils.redis_client import redis_client
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float):
+        # rate is the number of tokens added per second, capacity the largest burst allowed
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self, tokens: float = 1):
+        # A request larger than the bucket would never be served, so it is capped to a full bucket
+        tokens = min(tokens, self.capacity)
+        async with self.lock:
+            self._refill()
+            while self.tokens < tokens:
+                await asyncio.sleep((tokens - self.tokens) / self.rate)
+                self._refill()
+            self.tokens -= tokens
+
+    def try_acquire(self, tokens: float = 1) -> bool:
+        # Takes the tokens only if they are available now, for the callers that rather skip the work than wait
+        self._refill()
+        if self.tokens < tokens:
+            return False
+        self.tokens -= tokens
+        return True
+
+
+# Reserves one request and the tokens in the current window only if both fit in the budget, atomically so the
+# replicas sharing the budget can not overshoot it together
+RESERVE_SCRIPT = """
+local requests = tonumber(redis.call("GET", KEYS[1]) or "0")
+local tokens = tonumber(redis.call("GET", KEYS[2]) or "0")
+if requests + 1 > tonumber(ARGV[1]) or tokens + tonumber(ARGV[3]) > tonumber(ARGV[2]) then
+    return 0
+end
+redis.call("INCR", KEYS[1])
+redis.call("EXPIRE", KEYS[1], ARGV[4])
+redis.call("INCRBY", KEYS[2], ARGV[3])
+redis.call("EXPIRE", KEYS[2], ARGV[4])
+return 1
+"""
+
+
+class RedisRateLimiter:
+    WINDOW_SECONDS = 60
+
+    def __init__(self, name: str, requests_per_minute: int, tokens_per_minute: int):
+        # The budget is shared by every instance of the service through redis, in fixed one minute windows
+        self.name = name
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.reserve_script = redis_client.register_script(RESERVE_SCRIPT)
+
+    def _keys(self, window: int) -> List[str]:
+        return [f"rate_limit:{self.name}:{window}:requests", f"rate_limit:{self.name}:{window}:tokens"]
+
+    async def acquire(self, tokens: int = 0, share: float = 1.0) -> int:
+        # share is the fraction of the budget the caller may use, lower priority work leaves the rest for the
+        # higher priority work. Returns the window the tokens were reserved in.
+        request_limit = max(1, int(self.requests_per_minute * share))
+        token_limit = max(1, int(self.tokens_per_minute * share))
+        # A request larger than the budget would never be served, so it is capped to a full window
+        tokens = min(tokens, token_limit)
+
+        while True:
+            now = time.time()
+            window = int(now // self.WINDOW_SECONDS)
+            try:
+                async with track_call("redis", "rate_limit_reserve"):
+                    reserved = await self.reserve_script(
+                        keys=self._keys(window),
+                        args=[request_limit, token_limit, tokens, self.WINDOW_SECONDS * 2],
+                    )
+            except RedisError as exception:
+                # Rather keep serving without a budget than fail every request while redis is down
+                log_manager.WARNING({"message": f"Rate limiter {self.name} is not available: {exception}"})
+                return window
+
+            if reserved:
+                return window
+
+            # Spread the waiting requests over the start of the next window instead of waking them all at once
+            next_window = (window + 1) * self.WINDOW_SECONDS
+            await asyncio.sleep(next_window - now + random.uniform(0, 1))
+
+    async def record_usage(self, window: int, estimated_tokens: int, used_tokens: int):
+        # Corrects the reservation with the actual usage once it is known
+        if used_tokens == estimated_tokens:
+            return
+        try:
+            await redis_client.incrby(self._keys(window)[1], used_tokens - estimated_tokens)
+        except RedisError as exception:
+            log_manager.WARNING({"message": f"Rate limiter {self.name} is not available: {exception}"})
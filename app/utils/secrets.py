@@ -12,8 +12,10 @@
 #     prior written permission of Array Insights, Inc.
 # -------------------------------------------------------------------------------
 
+import asyncio
 import os
-from typing import Union
+import time
+from typing import Dict, Optional, Tuple, Union
 
 from azure.identity.aio import DefaultAzureCredential
 from azure.keyvault.secrets.aio import SecretClient
@@ -96,32 +98,96 @@ secret_store = SecretStore(
 )
 
 
+# The secrets are cached for this long after they are read or written by this process, a secret changed by another
+# replica is seen here once the cached value expires
+KEYVAULT_CACHE_TTL_SECONDS = int(os.getenv("KEYVAULT_CACHE_TTL_SECONDS", "900"))
+KEYVAULT_CACHE_MAX_ENTRIES = 10000
+
+
+class KeyVaultSecrets:
+    def __new__(cls) -> "KeyVaultSecrets":
+        if not hasattr(cls, "instance"):
+            cls.credential: Optional[DefaultAzureCredential] = None
+            cls.client: Optional[SecretClient] = None
+            # secret name -> (value, expiry)
+            cls.cache: Dict[str, Tuple[Union[str, None], float]] = {}
+            # Concurrent reads of the same secret share a single call to the key vault
+            cls.in_flight: Dict[str, asyncio.Future] = {}
+            # Bumped on every write, so that a read started before the write does not cache the old value
+            cls.generations: Dict[str, int] = {}
+            cls.instance = super(KeyVaultSecrets, cls).__new__(cls)
+        return cls.instance
+
+    def get_client(self) -> SecretClient:
+        # One credential and client for the process, the credential keeps its access token until it expires
+        if self.client is None:
+            self.credential = DefaultAzureCredential()
+            self.client = SecretClient(
+                vault_url=secret_store.AZURE_KEYVAULT_URL, credential=self.credential  # type: ignore
+            )
+        return self.client
+
+    def remember(self, secret_name: str, value: Union[str, None]):
+        now = time.monotonic()
+        if len(self.cache) >= KEYVAULT_CACHE_MAX_ENTRIES:
+            self.cache = {name: cached for name, cached in self.cache.items() if cached[1] > now}
+            if len(self.cache) >= KEYVAULT_CACHE_MAX_ENTRIES:
+                self.cache = {}
+        self.cache[secret_name] = (value, now + KEYVAULT_CACHE_TTL_SECONDS)
+
+    def forget(self, secret_name: str):
+        self.cache.pop(secret_name, None)
+        self.generations[secret_name] = self.generations.get(secret_name, 0) + 1
+
+    async def read(self, secret_name: str) -> Union[str, None]:
+        generation = self.generations.get(secret_name, 0)
+        secret = await self.get_client().get_secret(secret_name)
+        if self.generations.get(secret_name, 0) == generation:
+            self.remember(secret_name, secret.value)
+        return secret.value
+
+    async def get(self, secret_name: str) -> Union[str, None]:
+        cached = self.cache.get(secret_name)
+        if cached and cached[1] > time.monotonic():
+            return cached[0]
+
+        in_flight = self.in_flight.get(secret_name)
+        if not in_flight:
+            in_flight = asyncio.ensure_future(self.read(secret_name))
+            self.in_flight[secret_name] = in_flight
+            in_flight.add_done_callback(lambda _: self.in_flight.pop(secret_name, None))
+
+        # Shielded so that a cancelled caller does not cancel the read for the others waiting on it
+        return await asyncio.shield(in_flight)
+
+    async def set(self, secret_name: str, secret_value: str):
+        self.forget(secret_name)
+        await self.get_client().set_secret(secret_name, secret_value)
+        self.remember(secret_name, secret_value)
+
+    async def delete(self, secret_name: str):
+        self.forget(secret_name)
+        await self.get_client().delete_secret(secret_name)
+
+    async def close(self):
+        client, credential = self.client, self.credential
+        self.client, self.credential = None, None
+        if client:
+            await client.close()
+        if credential:
+            await credential.close()
+
+
 @retry(stop=stop_after_attempt(3), wait=wait_fixed(5))
 async def get_keyvault_secret(secret_name: str) -> Union[str, None]:
-    credential = DefaultAzureCredential()
-    secret_client = SecretClient(vault_url=secret_store.AZURE_KEYVAULT_URL, credential=credential)  # type: ignore
-
-    async with credential:
-        async with secret_client:
-            secret = await secret_client.get_secret(secret_name)
-            return secret.value
+    return await KeyVaultSecrets().get(secret_name)
 
 
 @retry(stop=stop_after_attempt(3), wait=wait_fixed(5))
 async def set_keyvault_secret(secret_name: str, secret_value: str) -> None:
-    credential = DefaultAzureCredential()
-    secret_client = SecretClient(vault_url=secret_store.AZURE_KEYVAULT_URL, credential=credential)  # type: ignore
-
-    async with credential:
-        async with secret_client:
-            await secret_client.set_secret(secret_name, secret_value)
+    await KeyVaultSecrets().set(secret_name, secret_value)
 
 
 @retry(stop=stop_after_attempt(3), wait=wait_fixed(5))
 async def delete_keyvault_secret(secret_name: str) -> None:
-    credential = DefaultAzureCredential()
-    secret_client = SecretClient(vault_url=secret_store.AZURE_KEYVAULT_URL, credential=credential)  # type: ignore
-
-    async with credential:
-        async with secret_client:
-            await secret_client.delete_secret(secret_name)
+    await KeyVaultSecrets().delete(secret_name)
@@ -18,7 +18,7 @@ import aiofiles
 
 from app.models.common import PyObjectId
 from app.utils.azure_blob_manager import AzureBlobManager
-from app.utils.azure_openai import OpenAiGenerator
+from app.utils.azure_openai import OpenAiGenerator, OpenAiPriority
 from app.utils.secrets import secret_store
 from app.utils.shell_process import run_shell_code
 
@@ -45,7 +45,7 @@ async def transcribe_audio(audio_path: str) -> str:
 
         transcript = ""
         for audio_file in audio_files:
-            transcript += await openai_generator.generate_transcript(audio_file)
+            transcript += await openai_generator.generate_transcript(audio_file, priority=OpenAiPriority.BATCH)
     except Exception as e:
         raise Exception(f"Transcription failed: {str(e)}")
     finally:
@@ -13,7 +13,7 @@
 # -------------------------------------------------------------------------------
 
 from app.utils.azure_blob_manager import AzureBlobManager
-from app.utils.azure_openai import OpenAiGenerator
+from app.utils.azure_openai import OpenAiGenerator, OpenAiPriority
 from app.utils.secrets import secret_store
 
 
@@ -22,6 +22,9 @@ async def describe_image_from_id(image_id) -> str:
     image_file_url = storage_manager.generate_read_sas(file_name=str(image_id), expiry_hours=1)
 
     openai_generator = OpenAiGenerator(api_base=secret_store.OPENAI_API_BASE, api_key=secret_store.OPENAI_API_KEY)
-    image_description = await openai_generator.describe_image(image_url=image_file_url)
+    # The signed url changes on every call, the blob name identifies the image
+    image_description = await openai_generator.describe_image(
+        image_url=image_file_url, priority=OpenAiPriority.BATCH, cache_key=f"form-image:{image_id}"
+    )
 
     return image_description
@@ -0,0 +1,66 @@
+import json
+
+import pytest
+
+from app.main import AUDIT_LOG_SAMPLE_RATES
+from app.utils.audit_log import AuditLogMiddleware, redact_body
+
+
+@pytest.fixture(scope="module")
+def audit_log():
+    return AuditLogMiddleware(app=None, sample_rates=AUDIT_LOG_SAMPLE_RATES)
+
+
+@pytest.mark.parametrize(
+    "path,rate",
+    [
+        ("/", 0.01),
+        ("/api/form-data", 1.0),
+        ("/api/form-data/123", 1.0),
+        ("/api/login", 1.0),
+        ("/api/static/swagger-ui.css", 0.0),
+        ("/api/statics", 1.0),
+    ],
+)
+def test_sample_rate(audit_log, path, rate):
+    assert audit_log.sample_rate(path) == rate
+
+
+def test_path_matches_whole_segments():
+    assert AuditLogMiddleware.path_matches("/api/media/123", "/api/media")
+    assert AuditLogMiddleware.path_matches("/api/media/123", "/api/media/")
+    assert not AuditLogMiddleware.path_matches("/api/medias", "/api/media")
+    assert AuditLogMiddleware.path_matches("/", "/")
+    assert not AuditLogMiddleware.path_matches("/api/form-data", "/")
+
+
+@pytest.mark.parametrize(
+    "body,redacted",
+    [
+        (b'{"username": "jane", "password": "secret"}', {"username": "jane", "password": "****"}),
+        (b'{"password": 123456, "new_password": null}', {"password": "****", "new_password": "****"}),
+        (b'{"password": {"old": "a", "new": "b"}}', {"password": "****"}),
+        (b'{"user": {"name": "jane", "Password": ["a", "b"]}}', {"user": {"name": "jane", "Password": "****"}}),
+        (b'[{"password": true}, {"name": "x"}]', [{"password": "****"}, {"name": "x"}]),
+    ],
+)
+def test_redact_json_body(body, redacted):
+    assert json.loads(redact_body("application/json", body)) == redacted
+
+
+@pytest.mark.parametrize(
+    "body,redacted",
+    [
+        (b'{"name": "jane", "password": "sec', '{"name": "jane", "password": "****"'),
+        (b'{"password": 1234, "name": "ja', '{"password": "****", "name": "ja'),
+        (b'{"user": {"password": {"old": "a", "new": "b"}, "name', '{"user": {"password": "****"'),
+    ],
+)
+def test_redact_truncated_json_body(body, redacted):
+    assert redact_body("application/json", body) == redacted
+
+
+def test_redact_form_body():
+    assert redact_body("application/x-www-form-urlencoded", b"username=jane&password=secret") == (
+        "username=jane&password=****"
+    )
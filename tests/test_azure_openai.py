@@ -0,0 +1,79 @@
+import asyncio
+
+import pytest
+
+from app.utils.azure_openai import OpenAiGenerator, OpenAiPriority
+
+MESSAGES = [{"role": "user", "content": "Summarize the story"}]
+
+
+class FakeResponseCache:
+    def __init__(self):
+        self.saved = {}
+
+    async def get(self, key, response_model):
+        return self.saved.get(key)
+
+    async def set(self, key, response):
+        self.saved[key] = response
+
+
+@pytest.fixture
+def generator(monkeypatch):
+    generator = OpenAiGenerator("https://openai.invalid", "key")
+    calls = []
+    release = asyncio.Event()
+
+    async def get_response(messages, response_model, priority):
+        calls.append(priority)
+        response = f"response {len(calls)}"
+        await release.wait()
+        return response
+
+    monkeypatch.setattr(generator, "_get_response", get_response)
+    monkeypatch.setattr(generator, "response_cache", FakeResponseCache())
+    generator.calls = calls
+    generator.release = release
+    yield generator
+    del generator.calls, generator.release
+
+
+async def run_together(generator, *requests):
+    tasks = [asyncio.ensure_future(generator.get_response(MESSAGES, **request)) for request in requests]
+    await asyncio.sleep(0)
+    generator.release.set()
+    return await asyncio.gather(*tasks)
+
+
+@pytest.mark.asyncio
+async def test_cacheable_requests_share_a_call(generator):
+    responses = await run_together(generator, {"use_cache": True}, {"use_cache": True})
+
+    assert generator.calls == [OpenAiPriority.NORMAL]
+    assert responses == ["response 1", "response 1"]
+    assert list(generator.response_cache.saved.values()) == ["response 1"]
+
+    # The next identical request is answered from the cache
+    assert await generator.get_response(MESSAGES, use_cache=True) == "response 1"
+    assert len(generator.calls) == 1
+
+
+@pytest.mark.asyncio
+async def test_requests_without_cache_are_not_shared(generator):
+    responses = await run_together(generator, {}, {})
+
+    assert len(generator.calls) == 2
+    assert sorted(responses) == ["response 1", "response 2"]
+    assert generator.response_cache.saved == {}
+
+
+@pytest.mark.asyncio
+async def test_only_calls_of_the_same_or_a_higher_priority_are_joined(generator):
+    batch = {"use_cache": True, "priority": OpenAiPriority.BATCH}
+    interactive = {"use_cache": True, "priority": OpenAiPriority.INTERACTIVE}
+
+    # The interactive request does not wait on the batch call, the later batch request joins the interactive one
+    responses = await run_together(generator, batch, interactive, batch)
+
+    assert generator.calls == [OpenAiPriority.BATCH, OpenAiPriority.INTERACTIVE]
+    assert responses == ["response 1", "response 2", "response 2"]
@@ -0,0 +1,95 @@
+import pytest
+
+import app.utils.chat_context as chat_context
+from app.models.common import PyObjectId
+from app.models.content_generation_template import Context
+from app.models.patient_chat import PatientChat_Db
+
+
+def make_chat(exchanges: int, **kwargs) -> PatientChat_Db:
+    chat = [Context(role="system", content="Patient facts")]
+    for i in range(exchanges):
+        chat.append(Context(role="user", content=f"question {i}"))
+        chat.append(Context(role="assistant", content=f"answer {i}"))
+    return PatientChat_Db(
+        form_data_id=PyObjectId(), user_id=PyObjectId(), organization_id=PyObjectId(), chat=chat, **kwargs
+    )
+
+
+@pytest.fixture
+def summaries(monkeypatch):
+    monkeypatch.setattr(chat_context, "PATIENT_CHAT_RECENT_MESSAGES", 4)
+    monkeypatch.setattr(chat_context, "PATIENT_CHAT_CONTEXT_TOKENS", 100000)
+    summaries = []
+
+    async def summarize(summary, messages):
+        summaries.append((summary, [message.content for message in messages]))
+        return f"summary of {len(messages)} after {summary!r}"
+
+    monkeypatch.setattr(chat_context, "summarize", summarize)
+    return summaries
+
+
+def contents(context):
+    return [message["content"] for message in context]
+
+
+@pytest.mark.asyncio
+async def test_short_chat_is_sent_verbatim(summaries):
+    chat = make_chat(4)
+
+    context = await chat_context.build_chat_context("Prompt", chat, "next question")
+
+    assert summaries == []
+    assert chat.summarized_messages == 0
+    assert contents(context) == ["Prompt", "Patient facts"] + [m.content for m in chat.chat[1:]] + ["next question"]
+
+
+@pytest.mark.asyncio
+async def test_older_messages_are_summarized_in_chunks(summaries):
+    # 10 messages, over twice the 4 recent ones, so all but the last 4 are summarized
+    chat = make_chat(5)
+
+    context = await chat_context.build_chat_context("Prompt", chat, "next question")
+
+    assert summaries == [("", ["question 0", "answer 0", "question 1", "answer 1", "question 2", "answer 2"])]
+    assert chat.summarized_messages == 6
+    assert chat.summary == "summary of 6 after ''"
+    assert contents(context) == [
+        "Prompt",
+        "Patient facts",
+        "Summary of the earlier conversation:\nsummary of 6 after ''",
+        "question 3",
+        "answer 3",
+        "question 4",
+        "answer 4",
+        "next question",
+    ]
+
+    # The next turns reuse the summary until twice the recent messages are left out of it again
+    chat.chat += [Context(role="user", content="question 5"), Context(role="assistant", content="answer 5")]
+    await chat_context.build_chat_context("Prompt", chat, "next question")
+    assert len(summaries) == 1
+
+
+@pytest.mark.asyncio
+async def test_summary_is_extended_with_the_messages_leaving_the_window(summaries):
+    chat = make_chat(8, summary="earlier", summarized_messages=6)
+
+    await chat_context.build_chat_context("Prompt", chat, "next question")
+
+    assert summaries == [("earlier", [f"{role} {i}" for i in range(3, 6) for role in ["question", "answer"]])]
+    assert chat.summarized_messages == 12
+
+
+@pytest.mark.asyncio
+async def test_window_shrinks_to_the_token_budget(summaries, monkeypatch):
+    # Only room for about the last exchange
+    monkeypatch.setattr(chat_context, "PATIENT_CHAT_CONTEXT_TOKENS", chat_context.estimate_tokens([]) + 14)
+    chat = make_chat(4)
+
+    context = await chat_context.build_chat_context("Prompt", chat, "next question")
+
+    # Windows start on a question and the last exchange is always kept
+    assert chat.summarized_messages == 6
+    assert contents(context)[-3:] == ["question 3", "answer 3", "next question"]
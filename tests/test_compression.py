@@ -0,0 +1,41 @@
+from starlette.applications import Starlette
+from starlette.responses import PlainTextResponse, StreamingResponse
+from starlette.routing import Route
+from starlette.testclient import TestClient
+
+from app.utils.compression import StreamingAwareGZipMiddleware
+
+BODY = "story " * 1000
+
+
+async def text(request):
+    return PlainTextResponse(BODY)
+
+
+async def events(request):
+    async def stream():
+        for i in range(3):
+            yield f"data: {i}\n\n"
+
+    return StreamingResponse(stream(), media_type="text/event-stream")
+
+
+app = Starlette(routes=[Route("/text", text), Route("/stream", events), Route("/events", events)])
+app.add_middleware(StreamingAwareGZipMiddleware, minimum_size=1000)
+client = TestClient(app)
+
+
+def test_compresses_regular_responses():
+    response = client.get("/text", headers={"Accept-Encoding": "gzip"})
+
+    assert response.headers["content-encoding"] == "gzip"
+    assert response.text == BODY
+
+
+def test_server_sent_events_are_not_compressed():
+    # Decided by the content type, whatever the path of the route
+    for path in ["/stream", "/events"]:
+        response = client.get(path, headers={"Accept-Encoding": "gzip"})
+
+        assert "content-encoding" not in response.headers
+        assert response.text == "data: 0\n\ndata: 1\n\ndata: 2\n\n"
@@ -0,0 +1,86 @@
+import asyncio
+
+import pytest
+
+import app.utils.elastic_search as elastic_search
+from app.utils.elastic_search import ElasticsearchClient
+
+
+class FakeBulkClient:
+    def __init__(self, failing_ids=()):
+        self.failing_ids = set(failing_ids)
+        self.indexed = []
+
+    async def send(self, chunk):
+        await asyncio.sleep(0)
+        if self.failing_ids.intersection(action["_id"] for action in chunk):
+            raise ConnectionError("connection reset")
+        self.indexed.extend(action["_id"] for action in chunk)
+        return [(True, {"index": {"_id": action["_id"], "status": 201}}) for action in chunk]
+
+
+async def fake_streaming_bulk(client, actions, chunk_size, **kwargs):
+    # Sends the actions in chunks the way the elasticsearch helper does
+    chunk = []
+    async for action in actions:
+        chunk.append(action)
+        if len(chunk) == chunk_size:
+            for item in await client.send(chunk):
+                yield item
+            chunk = []
+    if chunk:
+        for item in await client.send(chunk):
+            yield item
+
+
+def make_client(monkeypatch, bulk_client):
+    monkeypatch.setattr(elastic_search.helpers, "async_streaming_bulk", fake_streaming_bulk)
+    client = object.__new__(ElasticsearchClient)
+    client.client = bulk_client
+    return client
+
+
+async def make_actions(count):
+    for i in range(count):
+        yield ElasticsearchClient.index_action("form_data", str(i), {"value": i})
+
+
+@pytest.mark.asyncio
+async def test_bulk_indexes_every_action(monkeypatch):
+    bulk_client = FakeBulkClient()
+    client = make_client(monkeypatch, bulk_client)
+
+    result = await client.bulk(make_actions(100), chunk_size=5, concurrency=4)
+
+    assert result.total == 100
+    assert result.failed == 0
+    assert sorted(bulk_client.indexed, key=int) == [str(i) for i in range(100)]
+
+
+@pytest.mark.asyncio
+async def test_bulk_failed_chunk_leaves_the_other_workers_running(monkeypatch):
+    bulk_client = FakeBulkClient(failing_ids=["7"])
+    client = make_client(monkeypatch, bulk_client)
+
+    result = await asyncio.wait_for(client.bulk(make_actions(100), chunk_size=5, concurrency=4), timeout=5)
+
+    # Only the chunk in flight on the failed worker is lost, the rest is indexed by the other workers
+    assert result.total == 100
+    assert result.failed == 5
+    assert result.succeeded == 95
+    assert len(bulk_client.indexed) == 95
+    assert "7" not in bulk_client.indexed
+    assert result.errors == [{"error": "connection reset"}]
+
+
+@pytest.mark.asyncio
+async def test_bulk_stops_reading_when_every_worker_failed(monkeypatch):
+    bulk_client = FakeBulkClient(failing_ids=[str(i) for i in range(1000)])
+    client = make_client(monkeypatch, bulk_client)
+
+    result = await asyncio.wait_for(client.bulk(make_actions(1000), chunk_size=5, concurrency=2), timeout=5)
+
+    assert bulk_client.indexed == []
+    assert result.failed == result.total
+    # The source is not read past the queue once there is no worker left
+    assert result.total < 1000
@@ -0,0 +1,216 @@
+import asyncio
+import json
+
+import pytest
+
+import app.utils.entity_cache as entity_cache
+from app.utils.entity_cache import EntityCache, listen_for_invalidations
+
+
+class FakePubSub:
+    def __init__(self, messages, on_listen):
+        self.messages = messages
+        self.on_listen = on_listen
+        self.channels = []
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        return False
+
+    async def subscribe(self, channel):
+        self.channels.append(channel)
+
+    async def listen(self):
+        self.on_listen()
+        for message in self.messages:
+            yield message
+        # Stops the listener, which retries on any other error
+        raise asyncio.CancelledError()
+
+
+class FakeRedis:
+    def __init__(self):
+        self.values = {}
+        self.published = []
+        self.messages = []
+        self.on_listen = lambda: None
+
+    async def get(self, key):
+        return self.values.get(key)
+
+    async def set(self, key, value, ex=None):
+        self.values[key] = value
+
+    async def delete(self, *keys):
+        for key in keys:
+            self.values.pop(key, None)
+
+    async def scan_iter(self, match):
+        for key in list(self.values):
+            if key.startswith(match.rstrip("*")):
+                yield key
+
+    async def publish(self, channel, message):
+        self.published.append((channel, json.loads(message)))
+
+    def pubsub(self):
+        return FakePubSub(self.messages, self.on_listen)
+
+
+class Loader:
+    # Reads of the database, counted
+    def __init__(self, document):
+        self.document = document
+        self.reads = 0
+        self.release = asyncio.Event()
+        self.release.set()
+
+    async def __call__(self):
+        self.reads += 1
+        document = dict(self.document)
+        await self.release.wait()
+        return document
+
+
+async def started(loader, reads):
+    # Lets the reads run up to the database
+    for _ in range(10):
+        await asyncio.sleep(0)
+    assert loader.reads == reads
+
+
+@pytest.fixture
+def redis(monkeypatch):
+    redis = FakeRedis()
+    monkeypatch.setattr(entity_cache, "redis_client", redis)
+    monkeypatch.setattr(EntityCache, "_caches", {})
+    return redis
+
+
+@pytest.mark.asyncio
+async def test_miss_then_hit(redis):
+    cache = EntityCache("users")
+    loader = Loader({"_id": "1", "name": "a"})
+
+    assert await cache.get("1", loader) == {"_id": "1", "name": "a"}
+    assert json.loads(redis.values["entity_cache:users:1"]) == {"_id": "1", "name": "a"}
+
+    # Served from the local copy, the callers get a copy they can change
+    document = await cache.get("1", loader)
+    document["name"] = "b"
+    assert await cache.get("1", loader) == {"_id": "1", "name": "a"}
+    assert loader.reads == 1
+
+
+@pytest.mark.asyncio
+async def test_shared_hit_and_missing_document(redis):
+    cache = EntityCache("users")
+    redis.values["entity_cache:users:1"] = json.dumps({"_id": "1", "name": "shared"})
+    loader = Loader({"_id": "1", "name": "database"})
+
+    assert await cache.get("1", loader) == {"_id": "1", "name": "shared"}
+    assert loader.reads == 0
+
+    async def not_found():
+        return None
+
+    # Not cached, a document created right after must be found
+    assert await cache.get("2", not_found) is None
+    assert "2" not in cache.entries
+    assert "entity_cache:users:2" not in redis.values
+
+
+@pytest.mark.asyncio
+async def test_concurrent_misses_share_a_read(redis):
+    cache = EntityCache("users")
+    loader = Loader({"_id": "1"})
+    loader.release.clear()
+
+    reads = [asyncio.ensure_future(cache.get("1", loader)) for _ in range(3)]
+    await asyncio.sleep(0)
+    loader.release.set()
+
+    assert await asyncio.gather(*reads) == [{"_id": "1"}] * 3
+    assert loader.reads == 1
+    assert cache.in_flight == {}
+
+
+@pytest.mark.asyncio
+async def test_excludes_the_password_hash(redis):
+    cache = EntityCache("users", excluded_fields=["hashed_password"])
+    loader = Loader({"_id": "1", "email": "a@b.c", "hashed_password": "secret"})
+
+    assert await cache.get("1", loader) == {"_id": "1", "email": "a@b.c"}
+    assert "hashed_password" not in cache.entries["1"][0]
+    assert "hashed_password" not in json.loads(redis.values["entity_cache:users:1"])
+
+
+@pytest.mark.asyncio
+async def test_invalidate_drops_both_tiers(redis):
+    cache = EntityCache("users")
+    loader = Loader({"_id": "1", "name": "a"})
+    await cache.get("1", loader)
+    await cache.get("2", Loader({"_id": "2"}))
+
+    await cache.invalidate("1")
+    assert "1" not in cache.entries and "2" in cache.entries
+    assert "entity_cache:users:1" not in redis.values
+    assert redis.published == [(entity_cache.ENTITY_CACHE_CHANNEL, {"cache": "users", "ids": ["1"]})]
+
+    loader.document["name"] = "b"
+    assert await cache.get("1", loader) == {"_id": "1", "name": "b"}
+    assert loader.reads == 2
+
+    # Without ids the whole collection is dropped
+    await cache.invalidate()
+    assert cache.entries == {}
+    assert not [key for key in redis.values if key.startswith("entity_cache:users:")]
+
+
+@pytest.mark.asyncio
+async def test_invalidate_during_a_read(redis):
+    cache = EntityCache("users")
+    loader = Loader({"_id": "1", "name": "a"})
+    loader.release.clear()
+    old_read = asyncio.ensure_future(cache.get("1", loader))
+    await started(loader, 1)
+
+    # The callers after the invalidation do not wait on the read of the old document
+    await cache.invalidate("1")
+    loader.document["name"] = "b"
+    new_read = asyncio.ensure_future(cache.get("1", loader))
+    await started(loader, 2)
+    loader.release.set()
+
+    assert await old_read == {"_id": "1", "name": "a"}
+    assert await new_read == {"_id": "1", "name": "b"}
+    assert loader.reads == 2
+    assert cache.entries["1"][0] == {"_id": "1", "name": "b"}
+    assert cache.in_flight == {}
+
+
+@pytest.mark.asyncio
+async def test_listen_for_invalidations(redis):
+    cache = EntityCache("users")
+    await cache.get("1", Loader({"_id": "1"}))
+    redis.messages = [
+        {"type": "subscribe", "data": 1},
+        {"type": "message", "data": json.dumps({"cache": "unknown", "ids": None})},
+        {"type": "message", "data": json.dumps({"cache": "users", "ids": ["2"]})},
+    ]
+
+    def listening():
+        # Whatever was cached before subscribing is dropped
+        assert cache.entries == {}
+        cache.set_local("2", {"_id": "2"})
+        cache.set_local("3", {"_id": "3"})
+
+    redis.on_listen = listening
+    with pytest.raises(asyncio.CancelledError):
+        await listen_for_invalidations()
+
+    assert list(cache.entries) == ["3"]
+    # An unknown name is ignored and does not create a cache
+    assert list(EntityCache._caches) == ["users"]
@@ -0,0 +1,156 @@
+import contextlib
+import time
+from datetime import datetime, timedelta
+
+import pytest
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from cryptography.x509.oid import NameOID
+from jose import jwt
+
+import app.utils.firebase_auth as firebase_auth
+from app.utils.firebase_auth import FirebaseTokenError, FirebaseTokenVerifier
+
+PROJECT_ID = "tallulah-test"
+VERIFIER_ATTRIBUTES = [
+    "instance",
+    "project_id",
+    "certificates",
+    "certificates_expiry",
+    "certificates_lock",
+    "verified_tokens",
+]
+
+
+def make_key():
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, "securetoken")])
+    certificate = (
+        x509.CertificateBuilder()
+        .subject_name(name)
+        .issuer_name(name)
+        .public_key(key.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(datetime.utcnow() - timedelta(days=1))
+        .not_valid_after(datetime.utcnow() + timedelta(days=1))
+        .sign(key, hashes.SHA256())
+    )
+    private_key = key.private_bytes(
+        serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption()
+    ).decode()
+    return private_key, certificate.public_bytes(serialization.Encoding.PEM).decode()
+
+
+PRIVATE_KEY, CERTIFICATE = make_key()
+
+
+def make_token(kid="key-1", **claims):
+    now = int(time.time())
+    payload = {
+        "iss": f"https://securetoken.google.com/{PROJECT_ID}",
+        "aud": PROJECT_ID,
+        "sub": "user-1",
+        "iat": now,
+        "auth_time": now,
+        "exp": now + 3600,
+        **claims,
+    }
+    return jwt.encode(payload, PRIVATE_KEY, algorithm="RS256", headers={"kid": kid})
+
+
+class FakeResponse:
+    headers = {"Cache-Control": "public, max-age=600"}
+
+    def raise_for_status(self):
+        pass
+
+    async def json(self):
+        return {"key-1": CERTIFICATE}
+
+
+class FakeSession:
+    def __init__(self):
+        self.requests = 0
+
+    @contextlib.asynccontextmanager
+    async def get(self, url):
+        self.requests += 1
+        yield FakeResponse()
+
+
+@pytest.fixture
+def session(monkeypatch):
+    session = FakeSession()
+    monkeypatch.setattr(firebase_auth.http_clients, "get", lambda upstream: session)
+    return session
+
+
+@pytest.fixture
+def verifier(monkeypatch, session):
+    # A verifier of its own, the one of the service is put back afterwards
+    present = [name for name in VERIFIER_ATTRIBUTES if hasattr(FirebaseTokenVerifier, name)]
+    for name in present:
+        monkeypatch.delattr(FirebaseTokenVerifier, name)
+    yield FirebaseTokenVerifier(project_id=PROJECT_ID)
+    for name in VERIFIER_ATTRIBUTES:
+        if name not in present and hasattr(FirebaseTokenVerifier, name):
+            delattr(FirebaseTokenVerifier, name)
+
+
+@pytest.mark.asyncio
+async def test_verifies_a_valid_token(verifier):
+    claims = await verifier.verify(make_token())
+
+    assert claims["uid"] == "user-1"
+
+
+@pytest.mark.asyncio
+async def test_certificates_and_tokens_are_cached(verifier, session, monkeypatch):
+    token = make_token()
+    await verifier.verify(token)
+    await verifier.verify(make_token(sub="user-2"))
+    assert session.requests == 1
+
+    # A verified token is not decoded again
+    def decode(*args, **kwargs):
+        raise AssertionError("decoded again")
+
+    monkeypatch.setattr(firebase_auth.jwt, "decode", decode)
+    assert (await verifier.verify(token))["uid"] == "user-1"
+
+
+@pytest.mark.asyncio
+async def test_certificates_are_fetched_again_once_expired(verifier, session):
+    await verifier.verify(make_token())
+    assert verifier.certificates_expiry == pytest.approx(time.time() + 600, abs=5)
+
+    verifier.certificates_expiry = time.time() - 1
+    await verifier.verify(make_token(sub="user-2"))
+    assert session.requests == 2
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    "token",
+    [
+        make_token(kid="key-2"),
+        make_token(aud="other-project"),
+        make_token(exp=int(time.time()) - 3600),
+        make_token(iat=int(time.time()) + 3600),
+        make_token(auth_time=int(time.time()) + 3600),
+        make_token(sub=""),
+        "not a token",
+    ],
+)
+async def test_rejects_invalid_tokens(verifier, token):
+    with pytest.raises(FirebaseTokenError):
+        await verifier.verify(token)
+
+
+@pytest.mark.asyncio
+async def test_tolerates_a_small_clock_skew(verifier):
+    now = int(time.time())
+
+    claims = await verifier.verify(make_token(iat=now + 30, auth_time=now + 30))
+    assert claims["uid"] == "user-1"
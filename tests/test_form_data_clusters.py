@@ -0,0 +1,160 @@
+from uuid import uuid4
+
+import pytest
+
+from app.models.form_data import FormDatas
+
+TEMPLATE_ID = str(uuid4())
+FORM_DATA_ID = str(uuid4())
+
+
+class FakeDataService:
+    # Returns the response of the cluster aggregation, keeps the pipelines that were run
+    def __init__(self):
+        self.response = [{"clusters": [], "total": []}]
+        self.documents = []
+        self.pipelines = []
+
+    async def aggregate(self, collection, pipeline):
+        self.pipelines.append(pipeline)
+        return self.response
+
+    async def aggregate_cursor(self, collection, pipeline, batch_size):
+        self.pipelines.append(pipeline)
+        for document in self.documents:
+            yield document
+
+
+@pytest.fixture
+def data_service(monkeypatch):
+    data_service = FakeDataService()
+    monkeypatch.setattr(FormDatas, "data_service", data_service)
+    return data_service
+
+
+def test_bounding_box_polygon():
+    polygon = FormDatas.bounding_box_polygon(-10, 20, -7.5, 30)
+
+    # A vertex every degree along the top and bottom edges, closed on the first vertex
+    assert polygon == {
+        "type": "Polygon",
+        "coordinates": [
+            [
+                [-10, 20],
+                [-9.166666666666666, 20],
+                [-8.333333333333334, 20],
+                [-7.5, 20],
+                [-7.5, 30],
+                [-8.333333333333334, 30],
+                [-9.166666666666666, 30],
+                [-10, 30],
+                [-10, 20],
+            ]
+        ],
+    }
+    assert FormDatas.bounding_box_polygon(1, 1, 1.5, 2)["coordinates"][0] == [
+        [1, 1],
+        [1.5, 1],
+        [1.5, 2],
+        [1, 2],
+        [1, 1],
+    ]
+
+
+@pytest.mark.asyncio
+async def test_cluster_in_the_bounding_box(data_service):
+    await FormDatas.cluster_locations(TEMPLATE_ID, west=-80, south=30, east=-70, north=45, zoom=5)
+
+    pipeline = data_service.pipelines[0]
+    assert pipeline[0]["$match"] == {
+        "form_template_id": TEMPLATE_ID,
+        "state": "ACTIVE",
+        "geo_point": {"$geoWithin": {"$geometry": FormDatas.bounding_box_polygon(-80, 30, -70, 45)}},
+        "location.longitude": {"$gte": -80, "$lte": -70},
+        "location.latitude": {"$gte": 30, "$lte": 45},
+    }
+    # Four cells per tile, a tile is 360 / 2^zoom degrees wide
+    cell_size = 360 / 32 / 4
+    assert pipeline[1]["$group"]["_id"] == {
+        "x": {"$floor": {"$divide": [{"$arrayElemAt": ["$geo_point.coordinates", 0]}, cell_size]}},
+        "y": {"$floor": {"$divide": [{"$arrayElemAt": ["$geo_point.coordinates", 1]}, cell_size]}},
+    }
+    assert pipeline[2]["$facet"]["clusters"] == [{"$sort": {"count": -1}}, {"$limit": FormDatas.MAP_MAX_CLUSTERS}]
+
+
+@pytest.mark.parametrize("west, east", [(-180, 180), (-100, 90), (170, -170)])
+@pytest.mark.asyncio
+async def test_cluster_across_the_map(data_service, west, east):
+    await FormDatas.cluster_locations(TEMPLATE_ID, west=west, south=-60, east=east, north=60, zoom=1)
+
+    # Not a valid polygon, only the latitude is matched
+    assert data_service.pipelines[0][0]["$match"] == {
+        "form_template_id": TEMPLATE_ID,
+        "state": "ACTIVE",
+        "geo_point": {"$type": "object"},
+        "location.latitude": {"$gte": -60, "$lte": 60},
+    }
+
+
+@pytest.mark.asyncio
+async def test_cluster_response(data_service):
+    data_service.response = [
+        {
+            "clusters": [
+                {
+                    "_id": {"x": -9, "y": 4},
+                    "count": 12,
+                    "latitude": 40.7,
+                    "longitude": -73.9,
+                    "form_data_id": str(uuid4()),
+                    "city": "New York New York US",
+                },
+                {
+                    "_id": {"x": -14, "y": 4},
+                    "count": 1,
+                    "latitude": 37.8,
+                    "longitude": -122.4,
+                    "form_data_id": FORM_DATA_ID,
+                    "city": "San Francisco California US",
+                },
+            ],
+            "total": [{"_id": None, "total": 13}],
+        }
+    ]
+
+    response = await FormDatas.cluster_locations(TEMPLATE_ID, west=-130, south=20, east=-60, north=50, zoom=3)
+
+    assert response.total == 13
+    assert response.cell_size == 360 / 8 / 4
+    # Only a single form data is shown as a marker with its id and city
+    assert [
+        (cluster.count, cluster.form_data_id and str(cluster.form_data_id), cluster.city)
+        for cluster in response.clusters
+    ] == [
+        (12, None, None),
+        (1, FORM_DATA_ID, "San Francisco California US"),
+    ]
+    assert (response.clusters[1].latitude, response.clusters[1].longitude) == (37.8, -122.4)
+
+
+@pytest.mark.asyncio
+async def test_cluster_without_form_data(data_service):
+    response = await FormDatas.cluster_locations(TEMPLATE_ID, west=-10, south=-10, east=10, north=10, zoom=8)
+
+    assert response.clusters == []
+    assert response.total == 0
+
+
+@pytest.mark.asyncio
+async def test_backfill_retries_the_null_geo_points(data_service):
+    await FormDatas.backfill_locations()
+
+    # Saved with a null geo point by a failed geocoding, the form data without a zip code are not read again
+    assert data_service.pipelines[0][0] == {
+        "$match": {
+            "$or": [
+                {"geo_point": {"$exists": False}},
+                {"geo_point": None, "zipcode": {"$ne": None}},
+            ]
+        }
+    }
@@ -0,0 +1,210 @@
+from uuid import uuid4
+
+import pandas
+import pytest
+from pymongo import UpdateOne
+
+from app.models.form_data import FormData_Db, FormDatas, Location
+from app.utils.geocoding import ZipCodes
+
+TEMPLATE_ID = str(uuid4())
+FORM_DATA_ID = str(uuid4())
+KNOWN = {
+    "10001": (40.7484, -73.9967, "New York", "New York"),
+    "94105": (37.7898, -122.3942, "San Francisco", "California"),
+}
+
+
+class FakeNominatim:
+    # Same columns as the pgeocode table, the unknown zip codes come back without coordinates
+    def __init__(self):
+        self.queries = []
+
+    def query_postal_code(self, zipcodes):
+        self.queries.append(sorted(zipcodes))
+        rows = []
+        for zipcode in zipcodes:
+            latitude, longitude, place_name, state_name = KNOWN.get(zipcode, (None, None, None, None))
+            rows.append(
+                {
+                    "postal_code": zipcode,
+                    "country_code": "US",
+                    "place_name": place_name,
+                    "state_name": state_name,
+                    "latitude": latitude,
+                    "longitude": longitude,
+                }
+            )
+        return pandas.DataFrame(rows)
+
+
+class FakeDataService:
+    def __init__(self, documents=()):
+        self.documents = list(documents)
+        self.inserted = []
+        self.updates = []
+        self.bulk_writes = []
+        self.pipelines = []
+
+    async def insert_one(self, collection, data):
+        self.inserted.append(data)
+
+    async def update_one(self, collection, query, data):
+        self.updates.append((query, data))
+        return type("UpdateResult", (), {"modified_count": 1})()
+
+    async def bulk_write(self, collection, requests):
+        self.bulk_writes.append(requests)
+
+    async def aggregate_cursor(self, collection, pipeline, batch_size):
+        self.pipelines.append(pipeline)
+        for document in self.documents:
+            yield document
+
+
+@pytest.fixture
+def nominatim(monkeypatch):
+    nominatim = FakeNominatim()
+    ZipCodes()
+    monkeypatch.setattr(ZipCodes, "nominatim", nominatim)
+    return nominatim
+
+
+@pytest.fixture
+def data_service(monkeypatch):
+    data_service = FakeDataService()
+    monkeypatch.setattr(FormDatas, "data_service", data_service)
+    return data_service
+
+
+def zipcode_values(zipcode):
+    return {
+        "name": {"type": "STRING", "value": "Jane", "label": "Name"},
+        "zip": {"type": "ZIPCODE", "value": zipcode, "label": "Zip code"},
+    }
+
+
+async def fail_geocode(self, zipcodes):
+    raise OSError("table download failed")
+
+
+def test_lookup_in_one_query(nominatim):
+    locations = ZipCodes().lookup(["10001", " 10001 ", "94105", "00000", "", None])
+
+    assert nominatim.queries == [["00000", "10001", "94105"]]
+    assert locations == {
+        "10001": {"latitude": 40.7484, "longitude": -73.9967, "city": "New York New York US"},
+        "94105": {"latitude": 37.7898, "longitude": -122.3942, "city": "San Francisco California US"},
+    }
+    assert ZipCodes().lookup([None, " "]) == {}
+    assert len(nominatim.queries) == 1
+
+
+@pytest.mark.asyncio
+async def test_create_stores_the_location(nominatim, data_service):
+    await FormDatas.create(FormData_Db(form_template_id=TEMPLATE_ID, values=zipcode_values("10001")))
+
+    document = data_service.inserted[0]
+    assert document["zipcode"] == "10001"
+    assert document["location"] == {"latitude": 40.7484, "longitude": -73.9967, "city": "New York New York US"}
+    assert document["geo_point"] == {"type": "Point", "coordinates": [-73.9967, 40.7484]}
+
+
+@pytest.mark.asyncio
+async def test_create_without_a_known_zip_code(nominatim, data_service):
+    await FormDatas.create(FormData_Db(form_template_id=TEMPLATE_ID, values=zipcode_values("00000")))
+    await FormDatas.create(
+        FormData_Db(form_template_id=TEMPLATE_ID, values={"name": {"type": "STRING", "value": "Jane"}})
+    )
+
+    # Saved as null, the backfill does not look them up again
+    assert [
+        (document["zipcode"], document["location"], document["geo_point"]) for document in data_service.inserted
+    ] == [
+        ("00000", None, None),
+        (None, None, None),
+    ]
+
+
+@pytest.mark.asyncio
+async def test_create_when_the_geocoding_fails(nominatim, data_service, monkeypatch):
+    monkeypatch.setattr(ZipCodes, "geocode", fail_geocode)
+
+    await FormDatas.create(FormData_Db(form_template_id=TEMPLATE_ID, values=zipcode_values("10001")))
+
+    # Left unset for the backfill to resolve later
+    document = data_service.inserted[0]
+    assert document["zipcode"] == "10001"
+    assert "location" not in document and "geo_point" not in document
+
+
+@pytest.mark.asyncio
+async def test_update_resolves_the_new_zip_code(nominatim, data_service, monkeypatch):
+    await FormDatas.update(query_form_data_id="f", update_form_data_values=zipcode_values("94105"))
+
+    query, update = data_service.updates[0]
+    assert query == {"_id": "f"}
+    assert update["$set"]["zipcode"] == "94105"
+    assert update["$set"]["location"]["city"] == "San Francisco California US"
+    assert update["$set"]["geo_point"] == {"type": "Point", "coordinates": [-122.3942, 37.7898]}
+    assert "$unset" not in update
+
+    # The location of the previous values is not kept when the new one can not be resolved
+    monkeypatch.setattr(ZipCodes, "geocode", fail_geocode)
+    await FormDatas.update(query_form_data_id="f", update_form_data_values=zipcode_values("10001"))
+    _, update = data_service.updates[1]
+    assert update["$set"]["zipcode"] == "10001"
+    assert update["$unset"] == {"location": "", "geo_point": ""}
+
+
+@pytest.mark.asyncio
+async def test_aggregate_zipcodes_reads_the_stored_locations(nominatim, data_service):
+    data_service.documents = [
+        {
+            "form_data_id": FORM_DATA_ID,
+            "zipcode": "10001",
+            "location": {"latitude": 40.7484, "longitude": -73.9967, "city": "New York New York US"},
+        }
+    ]
+
+    locations = await FormDatas.aggregate_zipcodes(TEMPLATE_ID)
+
+    assert [(str(location.form_data_id), location.zipcode) for location in locations] == [(FORM_DATA_ID, "10001")]
+    assert locations[0].location == Location(latitude=40.7484, longitude=-73.9967, city="New York New York US")
+    assert data_service.pipelines[0][0]["$match"] == {
+        "form_template_id": TEMPLATE_ID,
+        "state": "ACTIVE",
+        "location": {"$type": "object"},
+    }
+    # Nothing is geocoded on a read
+    assert nominatim.queries == []
+
+
+@pytest.mark.asyncio
+async def test_backfill_in_batches(nominatim, data_service):
+    data_service.documents = [
+        {"_id": "f1", "zipcode": "10001"},
+        {"_id": "f2", "zipcode": " 94105 "},
+        {"_id": "f3"},
+        {"_id": "f4", "zipcode": "00000"},
+    ]
+
+    await FormDatas.backfill_locations(batch_size=2)
+
+    # A query of the table per batch, the form data without a zip code are not looked up
+    assert nominatim.queries == [["10001", "94105"], ["00000"]]
+    requests = [request for batch in data_service.bulk_writes for request in batch]
+    assert [len(batch) for batch in data_service.bulk_writes] == [2, 2]
+    assert requests[0] == UpdateOne(
+        {"_id": "f1"},
+        {
+            "$set": {
+                "zipcode": "10001",
+                "location": {"latitude": 40.7484, "longitude": -73.9967, "city": "New York New York US"},
+                "geo_point": {"type": "Point", "coordinates": [-73.9967, 40.7484]},
+            }
+        },
+    )
+    assert requests[1]._doc["$set"]["zipcode"] == "94105"
+    assert requests[2] == UpdateOne({"_id": "f3"}, {"$set": {"zipcode": None, "location": None, "geo_point": None}})
+    assert requests[3] == UpdateOne({"_id": "f4"}, {"$set": {"zipcode": "00000", "location": None, "geo_point": None}})
@@ -0,0 +1,32 @@
+import pytest
+
+from app.utils.http_clients import UPSTREAM_SETTINGS, HttpClients, Upstream
+
+
+@pytest.mark.asyncio
+async def test_sessions_are_shared_per_upstream():
+    clients = HttpClients()
+    try:
+        session = clients.get(Upstream.FIREBASE)
+
+        assert clients.get(Upstream.FIREBASE) is session
+        assert clients.get(Upstream.SLACK) is not session
+        assert session.timeout.total == UPSTREAM_SETTINGS[Upstream.FIREBASE].timeout_seconds
+        assert session.connector.limit_per_host == UPSTREAM_SETTINGS[Upstream.FIREBASE].limit_per_host
+    finally:
+        await clients.close()
+
+
+@pytest.mark.asyncio
+async def test_closed_sessions_are_replaced():
+    clients = HttpClients()
+    try:
+        session = clients.get(Upstream.OUTLOOK)
+        await clients.close()
+
+        assert session.closed
+        replacement = clients.get(Upstream.OUTLOOK)
+        assert replacement is not session
+        assert not replacement.closed
+    finally:
+        await clients.close()
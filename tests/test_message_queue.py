@@ -0,0 +1,59 @@
+from types import SimpleNamespace
+
+import pytest
+
+import app.utils.message_queue as message_queue
+from app.utils.message_queue import MessageQueueTypes, RabbitMQProducerConsumer
+
+
+class FakeChannel:
+    def __init__(self, connection):
+        self.connection = connection
+        self.is_closed = False
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        self.is_closed = True
+
+    async def declare_queue(self, name, durable, passive=False):
+        return SimpleNamespace(name=name, declaration_result=SimpleNamespace(message_count=7))
+
+
+class FakeConnection:
+    def __init__(self):
+        self.is_closed = False
+        self.channels = []
+
+    async def channel(self, publisher_confirms=True):
+        channel = FakeChannel(self)
+        self.channels.append(channel)
+        return channel
+
+
+@pytest.fixture
+def connections(monkeypatch):
+    connections = []
+
+    async def connect(url, loop=None):
+        connections.append(FakeConnection())
+        return connections[-1]
+
+    monkeypatch.setattr(message_queue, "connect", connect)
+    monkeypatch.setattr(RabbitMQProducerConsumer, "_queues", {})
+    return connections
+
+
+@pytest.mark.asyncio
+async def test_message_count_reuses_the_connection(connections):
+    for _ in range(3):
+        task_queue = RabbitMQProducerConsumer(MessageQueueTypes.FORM_DATA_METADATA_GENERATION, "amqp://localhost")
+        assert await task_queue.message_count() == 7
+
+    assert len(connections) == 1
+    # The consuming channel stays open, the channels of the passive declares are closed
+    consuming_channel, *declare_channels = connections[0].channels
+    assert not consuming_channel.is_closed
+    assert len(declare_channels) == 3
+    assert all(channel.is_closed for channel in declare_channels)
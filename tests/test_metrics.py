@@ -0,0 +1,58 @@
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from prometheus_client import REGISTRY
+
+from app.utils.metrics import MetricsMiddleware, track_call
+
+app = FastAPI()
+app.add_middleware(MetricsMiddleware)
+
+
+@app.get("/api/form-data/{form_data_id}")
+async def form_data(form_data_id: str):
+    return form_data_id
+
+
+client = TestClient(app)
+
+
+def sample(name, **labels):
+    return REGISTRY.get_sample_value(name, labels) or 0
+
+
+def test_requests_are_recorded_by_route():
+    labels = {"method": "GET", "route": "/api/form-data/{form_data_id}", "status": "200"}
+    before = sample("http_request_duration_seconds_count", **labels)
+
+    assert client.get("/api/form-data/1").status_code == 200
+    assert client.get("/api/form-data/2").status_code == 200
+
+    # One series for the route, not one per id
+    assert sample("http_request_duration_seconds_count", **labels) == before + 2
+    assert sample("http_requests_in_flight") == 0
+
+
+def test_unmatched_requests_share_a_series():
+    labels = {"method": "GET", "route": "unmatched", "status": "404"}
+    before = sample("http_request_duration_seconds_count", **labels)
+
+    assert client.get("/unknown/path").status_code == 404
+
+    assert sample("http_request_duration_seconds_count", **labels) == before + 1
+
+
+@pytest.mark.asyncio
+async def test_failed_dependency_calls_are_counted():
+    labels = {"system": "test", "operation": "call"}
+    calls_before = sample("dependency_call_duration_seconds_count", **labels)
+    errors_before = sample("dependency_call_errors_total", **labels)
+
+    async with track_call("test", "call"):
+        pass
+    with pytest.raises(ValueError):
+        async with track_call("test", "call"):
+            raise ValueError()
+
+    assert sample("dependency_call_duration_seconds_count", **labels) == calls_before + 2
+    assert sample("dependency_call_errors_total", **labels) == errors_before + 1
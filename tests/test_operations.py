@@ -0,0 +1,28 @@
+import pytest
+
+import app.data.operations as operations
+from app.data.operations import DatabaseOperations, ResultTooLargeError
+
+
+class FakeCursor:
+    def __init__(self, documents):
+        self.documents = documents
+
+    async def to_list(self, length):
+        return self.documents[:length]
+
+
+@pytest.mark.asyncio
+async def test_to_list_within_bound(monkeypatch):
+    monkeypatch.setattr(operations, "MAX_LIST_LENGTH", 3)
+
+    documents = await DatabaseOperations._to_list("form_data", FakeCursor([{"_id": i} for i in range(3)]))
+    assert documents == [{"_id": 0}, {"_id": 1}, {"_id": 2}]
+
+
+@pytest.mark.asyncio
+async def test_to_list_over_bound_raises(monkeypatch):
+    monkeypatch.setattr(operations, "MAX_LIST_LENGTH", 3)
+
+    with pytest.raises(ResultTooLargeError):
+        await DatabaseOperations._to_list("form_data", FakeCursor([{"_id": i} for i in range(4)]))
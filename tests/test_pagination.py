@@ -0,0 +1,75 @@
+import base64
+from datetime import datetime
+
+import pytest
+from bson import json_util
+
+from app.utils.pagination import PageCursor
+
+
+def make_token(cursor: dict) -> str:
+    return base64.urlsafe_b64encode(json_util.dumps(cursor).encode("utf-8")).decode("utf-8").rstrip("=")
+
+
+def test_cursor_round_trip():
+    document = {"_id": "b", "creation_time": datetime(2024, 5, 1, 12, 30), "values": {"name": "x"}}
+    cursor = PageCursor.from_document(document, "creation_time", -1)
+
+    decoded = PageCursor.decode(cursor.encode())
+    assert decoded == cursor
+    assert decoded.sort_value == datetime(2024, 5, 1, 12, 30)
+    assert "=" not in cursor.encode()
+
+
+def test_cursor_nested_sort_key():
+    cursor = PageCursor.from_document({"_id": "a", "values": {"name": "x"}}, "values.name", 1)
+    assert cursor.sort_value == "x"
+
+    missing = PageCursor.from_document({"_id": "a"}, "values.name", 1)
+    assert missing.sort_value is None
+
+
+def test_keyset_filter_breaks_ties_on_id():
+    ascending = PageCursor(sort_key="name", sort_direction=1, sort_value="x", id="b")
+    assert ascending.keyset_filter() == {
+        "$or": [
+            {"name": {"$gt": "x"}},
+            {"name": "x", "_id": {"$gt": "b"}},
+        ]
+    }
+
+    # Descending the missing values come last, after every other value
+    descending = PageCursor(sort_key="name", sort_direction=-1, sort_value="x", id="b")
+    assert descending.keyset_filter() == {
+        "$or": [
+            {"name": {"$lt": "x"}},
+            {"name": "x", "_id": {"$lt": "b"}},
+            {"name": None},
+        ]
+    }
+
+
+def test_keyset_filter_after_missing_value():
+    ascending = PageCursor(sort_key="name", sort_direction=1, sort_value=None, id="b")
+    assert ascending.keyset_filter() == {
+        "$or": [
+            {"name": None, "_id": {"$gt": "b"}},
+            {"name": {"$ne": None}},
+        ]
+    }
+
+    descending = PageCursor(sort_key="name", sort_direction=-1, sort_value=None, id="b")
+    assert descending.keyset_filter() == {"name": None, "_id": {"$lt": "b"}}
+
+
+@pytest.mark.parametrize("token", ["", "not a cursor", "e30", make_token({"sort_key": "name"})])
+def test_bad_cursor(token):
+    with pytest.raises(ValueError):
+        PageCursor.decode(token)
+
+
+@pytest.mark.parametrize("sort_value", [{"$regex": ".*"}, {"$gt": ""}, {"$where": "true"}, ["a", "b"]])
+def test_cursor_rejects_operators(sort_value):
+    token = make_token({"sort_key": "name", "sort_direction": 1, "sort_value": sort_value, "id": "b"})
+    with pytest.raises(ValueError):
+        PageCursor.decode(token)
@@ -0,0 +1,48 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+import app.api.authentication as authentication
+
+
+@pytest.fixture
+def slots(monkeypatch):
+    slots = asyncio.Semaphore(1)
+    monkeypatch.setattr(authentication, "password_hash_slots", slots)
+    monkeypatch.setattr(authentication, "PASSWORD_HASH_WAIT_SECONDS", 0.05)
+    return slots
+
+
+@pytest.mark.asyncio
+async def test_waits_for_a_free_slot(slots):
+    await slots.acquire()
+    asyncio.get_running_loop().call_later(0.01, slots.release)
+
+    assert await authentication.run_password_hash(str.upper, "hashed") == "HASHED"
+    assert not slots.locked()
+
+
+@pytest.mark.asyncio
+async def test_turned_away_when_no_slot_frees_up(slots):
+    await slots.acquire()
+
+    with pytest.raises(HTTPException) as exception:
+        await authentication.run_password_hash(str.upper, "hashed")
+
+    assert exception.value.status_code == 503
+    assert exception.value.detail == "The service is busy, try again later."
+    assert exception.value.headers == {"Retry-After": "1"}
+    # The slot held elsewhere is not released by the request turned away
+    assert slots.locked()
+
+
+@pytest.mark.asyncio
+async def test_slot_is_released_when_the_hash_fails(slots):
+    def fail(value):
+        raise ValueError(value)
+
+    with pytest.raises(ValueError):
+        await authentication.run_password_hash(fail, "not a hash")
+
+    assert not slots.locked()
@@ -0,0 +1,57 @@
+from datetime import datetime
+
+import pytest
+
+from app.models.common import PyObjectId
+from app.models.form_data import FormDatas, FormDataState
+from app.models.patient_chat import PatientChat
+
+
+class FakeDataService:
+    def __init__(self, response):
+        self.response = response
+        self.calls = []
+
+    async def aggregate(self, collection, pipeline):
+        self.calls.append((collection, pipeline))
+        return self.response
+
+
+@pytest.mark.asyncio
+async def test_chats_are_listed_with_their_form_data_in_one_query(monkeypatch):
+    user_id, organization_id, template_id, form_data_id = PyObjectId(), PyObjectId(), PyObjectId(), PyObjectId()
+    form_data = {
+        "id": str(form_data_id),
+        "form_template_id": str(template_id),
+        "values": {"name": "Jane"},
+        "state": "ACTIVE",
+        "creation_time": datetime(2024, 5, 1),
+    }
+    data_service = FakeDataService([{"form_data": [form_data], "count": [{"count": 3}]}])
+    monkeypatch.setattr(PatientChat, "data_service", data_service)
+
+    form_data_list, count = await PatientChat.get_chats_with_form_data(
+        user_id=user_id, organization_id=organization_id, skip=20, limit=10
+    )
+
+    assert count == 3
+    assert [form.id for form in form_data_list] == [form_data_id]
+    assert form_data_list[0].values == {"name": "Jane"}
+
+    [(collection, pipeline)] = data_service.calls
+    assert collection == PatientChat.DB_PATIENT_CHAT
+    assert pipeline[0] == {"$match": {"user_id": str(user_id), "organization_id": str(organization_id)}}
+    page = pipeline[1]["$facet"]["form_data"]
+    # The page is cut before the join, so only its chats look up their form data
+    assert page[:3] == [{"$sort": {"updated_time": -1}}, {"$skip": 20}, {"$limit": 10}]
+    lookup = page[3]["$lookup"]
+    assert lookup["from"] == FormDatas.DB_COLLECTION_FORM_DATA
+    assert lookup["pipeline"][0]["$match"]["state"] == FormDataState.ACTIVE.value
+    assert pipeline[1]["$facet"]["count"] == [{"$count": "count"}]
+
+
+@pytest.mark.asyncio
+async def test_no_chats(monkeypatch):
+    monkeypatch.setattr(PatientChat, "data_service", FakeDataService([{"form_data": [], "count": []}]))
+
+    assert await PatientChat.get_chats_with_form_data(user_id=PyObjectId(), organization_id=PyObjectId()) == ([], 0)
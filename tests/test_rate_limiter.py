@@ -0,0 +1,119 @@
+import asyncio
+
+import pytest
+from redis.exceptions import RedisError
+
+import app.utils.rate_limiter as rate_limiter
+from app.utils.rate_limiter import RedisRateLimiter
+
+
+class FakeRedis:
+    # Counters of the windows, reserved the way RESERVE_SCRIPT does
+    def __init__(self):
+        self.values = {}
+        self.fail = False
+
+    def register_script(self, script):
+        return self.reserve
+
+    async def reserve(self, keys, args):
+        if self.fail:
+            raise RedisError("connection refused")
+        request_limit, token_limit, tokens, _ = args
+        if self.values.get(keys[0], 0) + 1 > request_limit or self.values.get(keys[1], 0) + tokens > token_limit:
+            return 0
+        self.values[keys[0]] = self.values.get(keys[0], 0) + 1
+        self.values[keys[1]] = self.values.get(keys[1], 0) + tokens
+        return 1
+
+    async def incrby(self, key, amount):
+        self.values[key] = self.values.get(key, 0) + amount
+
+
+@pytest.fixture
+def redis(monkeypatch):
+    redis = FakeRedis()
+    monkeypatch.setattr(rate_limiter, "redis_client", redis)
+    return redis
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    # Starts 10 seconds into the first window, sleeping moves the clock instead of waiting
+    clock = {"now": 10.0, "sleeps": []}
+    sleep = asyncio.sleep
+
+    async def fake_sleep(delay):
+        clock["sleeps"].append(delay)
+        clock["now"] += delay
+        await sleep(0)
+
+    monkeypatch.setattr(rate_limiter.time, "time", lambda: clock["now"])
+    monkeypatch.setattr(rate_limiter.asyncio, "sleep", fake_sleep)
+    return clock
+
+
+@pytest.mark.asyncio
+async def test_reserves_in_the_current_window(redis, clock):
+    limiter = RedisRateLimiter("test", requests_per_minute=4, tokens_per_minute=1000)
+
+    assert await limiter.acquire(tokens=100) == 0
+    assert await limiter.acquire(tokens=100) == 0
+    assert redis.values == {"rate_limit:test:0:requests": 2, "rate_limit:test:0:tokens": 200}
+    assert clock["sleeps"] == []
+
+
+@pytest.mark.asyncio
+async def test_waits_for_the_next_window_when_the_budget_is_used(redis, clock):
+    limiter = RedisRateLimiter("test", requests_per_minute=2, tokens_per_minute=1000)
+
+    await limiter.acquire(tokens=100)
+    await limiter.acquire(tokens=100)
+    assert await limiter.acquire(tokens=100) == 1
+
+    assert len(clock["sleeps"]) == 1
+    assert 50 <= clock["sleeps"][0] <= 51
+    assert redis.values["rate_limit:test:1:requests"] == 1
+
+
+@pytest.mark.asyncio
+async def test_lower_priority_share_leaves_budget_for_higher_priority(redis, clock):
+    limiter = RedisRateLimiter("test", requests_per_minute=4, tokens_per_minute=1000)
+
+    # Half the budget for the batch requests, the interactive ones still get the rest of the window
+    await limiter.acquire(tokens=100, share=0.5)
+    await limiter.acquire(tokens=100, share=0.5)
+    assert await limiter.acquire(tokens=100, share=1.0) == 0
+    assert clock["sleeps"] == []
+
+    # The next batch request has to wait for the next window
+    assert await limiter.acquire(tokens=100, share=0.5) == 1
+    assert len(clock["sleeps"]) == 1
+
+
+@pytest.mark.asyncio
+async def test_request_larger_than_the_budget_is_capped(redis, clock):
+    limiter = RedisRateLimiter("test", requests_per_minute=10, tokens_per_minute=1000)
+
+    assert await limiter.acquire(tokens=5000, share=0.5) == 0
+    assert redis.values["rate_limit:test:0:tokens"] == 500
+
+
+@pytest.mark.asyncio
+async def test_usage_corrects_the_reservation(redis, clock):
+    limiter = RedisRateLimiter("test", requests_per_minute=10, tokens_per_minute=1000)
+
+    window = await limiter.acquire(tokens=300)
+    await limiter.record_usage(window, estimated_tokens=300, used_tokens=120)
+
+    assert redis.values["rate_limit:test:0:tokens"] == 120
+
+
+@pytest.mark.asyncio
+async def test_serves_without_a_budget_when_redis_is_down(redis, clock):
+    redis.fail = True
+    limiter = RedisRateLimiter("test", requests_per_minute=1, tokens_per_minute=1)
+
+    assert await limiter.acquire(tokens=100) == 0
+    assert await limiter.acquire(tokens=100) == 0
+    assert clock["sleeps"] == []
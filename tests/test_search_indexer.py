@@ -0,0 +1,92 @@
+import pytest
+
+import app.tasks.search_indexer as search_indexer
+from app.utils.elastic_search import BulkIndexResult, ElasticsearchClient
+
+SOURCE = search_indexer.SEARCH_INDEX_SOURCES[0]
+
+
+class FakeElasticsearchClient:
+    # Fails each document id with the given statuses in turn, None fails the whole chunk
+    def __init__(self, failures):
+        self.failures = failures
+        self.sent = []
+
+    async def bulk(self, actions, **kwargs):
+        result = BulkIndexResult()
+        chunk = [action async for action in actions]
+        self.sent.append([action["_id"] for action in chunk])
+        result.total = len(chunk)
+        for action in chunk:
+            statuses = self.failures.get(action["_id"])
+            if not statuses:
+                continue
+            status = statuses.pop(0)
+            if status is None:
+                result.failed = len(chunk)
+                result.errors = [{"error": "connection reset"}]
+                return result
+            result.failed += 1
+            result.errors.append(
+                {"op_type": "index", "index": action["_index"], "id": action["_id"], "status": status, "error": "x"}
+            )
+        return result
+
+
+class FakeDatabaseOperations:
+    dead_letters = {}
+
+    async def update_one(self, collection, query, data, upsert=False):
+        assert collection == search_indexer.SEARCH_INDEXER_DEAD_LETTER_COLLECTION
+        self.dead_letters[query["_id"]] = data["$set"]
+
+
+def make_batch(*ids):
+    actions = [ElasticsearchClient.index_action("template", id, {"value": id}) for id in ids]
+    return {(action["_index"], action["_id"]): action for action in actions}
+
+
+@pytest.fixture
+def fakes(monkeypatch):
+    def install(failures):
+        elastic_client = FakeElasticsearchClient(failures)
+        monkeypatch.setattr(search_indexer, "ElasticsearchClient", lambda: elastic_client)
+        monkeypatch.setattr(search_indexer, "DatabaseOperations", FakeDatabaseOperations)
+        monkeypatch.setattr(search_indexer, "SEARCH_INDEXER_RETRY_BACKOFF", 0)
+        FakeDatabaseOperations.dead_letters = {}
+        return elastic_client
+
+    return install
+
+
+@pytest.mark.asyncio
+async def test_flush_retries_only_the_failed_documents(fakes):
+    elastic_client = fakes({"b": [429, 503]})
+
+    await search_indexer.flush_changes(SOURCE, make_batch("a", "b", "c"))
+
+    assert elastic_client.sent == [["a", "b", "c"], ["b"], ["b"]]
+    assert FakeDatabaseOperations.dead_letters == {}
+
+
+@pytest.mark.asyncio
+async def test_flush_dead_letters_rejected_documents(fakes):
+    elastic_client = fakes({"b": [400, 400, 400, 400]})
+
+    await search_indexer.flush_changes(SOURCE, make_batch("a", "b"))
+
+    assert elastic_client.sent == [["a", "b"], ["b"], ["b"], ["b"]]
+    assert list(FakeDatabaseOperations.dead_letters) == ["template:b"]
+    assert FakeDatabaseOperations.dead_letters["template:b"]["status"] == 400
+
+
+@pytest.mark.asyncio
+async def test_flush_raises_when_the_failures_persist(fakes):
+    elastic_client = fakes({"a": [None, None, None, None]})
+
+    with pytest.raises(Exception, match="Failed to index"):
+        await search_indexer.flush_changes(SOURCE, make_batch("a", "b"))
+
+    # The whole batch is sent again after a failed chunk, nothing is set aside
+    assert elastic_client.sent == [["a", "b"]] * 4
+    assert FakeDatabaseOperations.dead_letters == {}
@@ -0,0 +1,99 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+import app.utils.secrets as secrets
+from app.utils.secrets import KeyVaultSecrets
+
+
+class FakeSecretClient:
+    def __init__(self):
+        self.values = {"token": "v1"}
+        self.reads = 0
+        self.release = asyncio.Event()
+        self.release.set()
+
+    async def get_secret(self, name):
+        self.reads += 1
+        value = self.values.get(name)
+        await self.release.wait()
+        return SimpleNamespace(value=value)
+
+    async def set_secret(self, name, value):
+        self.values[name] = value
+
+    async def delete_secret(self, name):
+        self.values.pop(name, None)
+
+
+@pytest.fixture
+def client(monkeypatch):
+    client = FakeSecretClient()
+    KeyVaultSecrets()
+    monkeypatch.setattr(KeyVaultSecrets, "client", client)
+    monkeypatch.setattr(KeyVaultSecrets, "cache", {})
+    monkeypatch.setattr(KeyVaultSecrets, "in_flight", {})
+    monkeypatch.setattr(KeyVaultSecrets, "generations", {})
+    return client
+
+
+@pytest.mark.asyncio
+async def test_secret_is_cached_until_it_expires(client):
+    key_vault = KeyVaultSecrets()
+
+    assert await key_vault.get("token") == "v1"
+    client.values["token"] = "v2"
+    assert await key_vault.get("token") == "v1"
+    assert client.reads == 1
+
+    # Once expired the secret is read again
+    name, (value, expiry) = next(iter(key_vault.cache.items()))
+    key_vault.cache[name] = (value, expiry - secrets.KEYVAULT_CACHE_TTL_SECONDS - 1)
+    assert await key_vault.get("token") == "v2"
+    assert client.reads == 2
+
+
+@pytest.mark.asyncio
+async def test_concurrent_reads_share_a_call(client):
+    key_vault = KeyVaultSecrets()
+    client.release.clear()
+
+    reads = [asyncio.ensure_future(key_vault.get("token")) for _ in range(5)]
+    await asyncio.sleep(0)
+    client.release.set()
+
+    assert await asyncio.gather(*reads) == ["v1"] * 5
+    assert client.reads == 1
+
+
+@pytest.mark.asyncio
+async def test_write_replaces_the_cached_value(client):
+    key_vault = KeyVaultSecrets()
+    await key_vault.get("token")
+
+    await key_vault.set("token", "v2")
+    assert await key_vault.get("token") == "v2"
+    assert client.reads == 1
+
+    await key_vault.delete("token")
+    assert await key_vault.get("token") is None
+    assert client.reads == 2
+
+
+@pytest.mark.asyncio
+async def test_read_started_before_a_write_is_not_cached(client):
+    key_vault = KeyVaultSecrets()
+    client.release.clear()
+
+    read = asyncio.ensure_future(key_vault.get("token"))
+    while not client.reads:
+        await asyncio.sleep(0)
+    client.values["token"] = "v2"
+    key_vault.forget("token")
+    client.release.set()
+
+    # The caller gets what was read, but the old value is not kept
+    assert await read == "v1"
+    assert "token" not in key_vault.cache
+    assert await key_vault.get("token") == "v2"
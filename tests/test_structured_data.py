@@ -0,0 +1,104 @@
+import asyncio
+import contextlib
+from types import SimpleNamespace
+
+import pytest
+
+import app.tasks.structured_data as structured_data
+from app.models.common import PyObjectId
+from app.models.form_data import FormDataMetadata, ImageMetadata
+
+
+class FakeMessage:
+    def __init__(self, body: str):
+        self.body = body.encode()
+
+    @contextlib.asynccontextmanager
+    async def process(self, ignore_processed: bool = False):
+        yield
+
+
+class FakeLockStore:
+    async def acquire(self, name, expiry):
+        return True
+
+    async def release(self, name):
+        pass
+
+
+@pytest.fixture
+def saved(monkeypatch):
+    saved = []
+
+    async def add_attachment_metadata(form_data_id, attachment_metadata):
+        saved.append(attachment_metadata)
+
+    monkeypatch.setattr(structured_data.FormDatas, "add_attachment_metadata", add_attachment_metadata)
+    monkeypatch.setattr(structured_data, "RedisLockStore", FakeLockStore)
+    return saved
+
+
+@pytest.mark.asyncio
+async def test_image_descriptions_are_bounded(monkeypatch, saved):
+    monkeypatch.setitem(structured_data.MEDIA_SEMAPHORES, "IMAGE", asyncio.Semaphore(2))
+    running = []
+    most_running = 0
+
+    async def describe_image_from_id(image_id):
+        nonlocal most_running
+        running.append(image_id)
+        most_running = max(most_running, len(running))
+        await asyncio.sleep(0.01)
+        running.remove(image_id)
+        return f"image {image_id}"
+
+    monkeypatch.setattr(structured_data, "describe_image_from_id", describe_image_from_id)
+
+    form_data_id = PyObjectId()
+    image_ids = [PyObjectId() for _ in range(5)]
+    results = await asyncio.gather(*[structured_data.describe_image_attachment(form_data_id, id) for id in image_ids])
+
+    assert most_running == 2
+    assert [result.image_id for result in results] == image_ids
+    assert sorted(str(metadata.image_id) for metadata in saved) == sorted(str(id) for id in image_ids)
+
+
+@pytest.mark.asyncio
+async def test_failed_transcription_keeps_the_finished_ones(monkeypatch, saved):
+    transcribed_image_id, new_image_id, video_id = PyObjectId(), PyObjectId(), PyObjectId()
+    form_data = SimpleNamespace(
+        values={
+            "photos": {"type": "IMAGE", "value": [{"id": str(transcribed_image_id)}, {"id": str(new_image_id)}]},
+            "video": {"type": "VIDEO", "value": [{"id": str(video_id), "name": "story.mp4"}]},
+            "name": {"type": "STRING", "value": "Jane"},
+        },
+        metadata=FormDataMetadata(image_metadata=[ImageMetadata(image_id=transcribed_image_id, transcript="done")]),
+    )
+    described = []
+    updated = []
+
+    async def read(form_data_id):
+        return [form_data]
+
+    async def describe_image_from_id(image_id):
+        described.append(image_id)
+        return "new"
+
+    async def transcribe_video_from_id(video_id, file_name):
+        raise Exception("ffmpeg failed")
+
+    async def update(**kwargs):
+        updated.append(kwargs)
+
+    monkeypatch.setattr(structured_data.FormDatas, "read", read)
+    monkeypatch.setattr(structured_data.FormDatas, "update", update)
+    monkeypatch.setattr(structured_data, "describe_image_from_id", describe_image_from_id)
+    monkeypatch.setattr(structured_data, "transcribe_video_from_id", transcribe_video_from_id)
+
+    await structured_data.on_generate_structured_data(FakeMessage(str(PyObjectId())))
+
+    # The transcribed image is skipped, the new one is saved although the video failed
+    assert described == [new_image_id]
+    assert [metadata.image_id for metadata in saved] == [new_image_id]
+    # Without every transcription the structured data is not generated
+    assert updated == []